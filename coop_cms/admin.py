@@ -5,6 +5,7 @@ Admin pages for coop_cms
 
 from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.http import Http404
 from django.utils.translation import gettext_lazy as _
 
@@ -14,6 +15,7 @@ from .forms.navigation import NavTypeForm, NavNodeAdminForm
 from .forms.newsletters import NewsletterItemAdminForm, NewsletterAdminForm
 from . import models
 from .settings import get_article_class, import_module
+from .thumbnails import prefetch_thumbnails
 
 
 # The BASE_ADMIN_CLASS can be a Translation admin if needed or regular modelAdmin if not
@@ -138,6 +140,14 @@ class MediaFilterFilter(admin.SimpleListFilter):
         return queryset.filter(filters__id=value)
 
 
+class ImageChangeList(ChangeList):
+    """get the thumbnails of the page at once"""
+
+    def get_results(self, request):
+        super(ImageChangeList, self).get_results(request)
+        prefetch_thumbnails(self.result_list)
+
+
 @admin.register(models.Image)
 class ImageAdmin(admin.ModelAdmin):
     """Image admin"""
@@ -148,6 +158,10 @@ class ImageAdmin(admin.ModelAdmin):
     actions = [clear_thumbnails_action]
     readonly_fields = ['admin_image']
 
+    def get_changelist(self, request, **kwargs):
+        """changelist"""
+        return ImageChangeList
+
 
 @admin.register(models.Fragment)
 class FragmentAdmin(BASE_ADMIN_CLASS):
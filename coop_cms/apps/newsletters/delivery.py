@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Delivery of the emails of an emailing
+
+The emails are sent by a pool of threads: every thread keeps its own SMTP connection opened. The emails are given
+to the threads by batches through a bounded queue: the emails are sent while the next ones are built.
+"""
+
+from email.utils import parseaddr
+import queue
+import smtplib
+import threading
+import time
+
+from django.core.mail import get_connection
+
+from ...logger import logger
+
+from .settings import (
+    get_default_rate_limit, get_rate_limits, get_smtp_batch_size, get_smtp_connections, get_smtp_max_retries,
+    get_smtp_retry_delay
+)
+
+
+# The result of the delivery of an email
+EMAIL_SENT, EMAIL_TRANSIENT_FAILURE, EMAIL_PERMANENT_FAILURE = 'sent', 'transient-failure', 'permanent-failure'
+
+_rate_limiters = {}
+
+
+def is_transient_error(err):
+    """True if the email can be sent again later: temporary error (4xx) or lost connection"""
+    if isinstance(err, smtplib.SMTPRecipientsRefused):
+        codes = [code for (code, _message) in err.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(err, smtplib.SMTPResponseException):
+        return 400 <= err.smtp_code < 500
+    if isinstance(err, smtplib.SMTPServerDisconnected):
+        return True
+    # Other SMTP errors are permanent. A socket error is transient
+    return not isinstance(err, smtplib.SMTPException)
+
+
+class EmailSender(object):
+    """send emails on a connection kept opened"""
+
+    def __init__(self, max_retries=None, retry_delay=None):
+        self.connection = get_connection()
+        self.max_retries = get_smtp_max_retries() if max_retries is None else max_retries
+        self.retry_delay = get_smtp_retry_delay() if retry_delay is None else retry_delay
+
+    def send(self, email):
+        """
+        send an email. Retry with backoff on transient errors
+        Returns EMAIL_SENT, EMAIL_TRANSIENT_FAILURE (can be sent again later) or EMAIL_PERMANENT_FAILURE
+        """
+        attempt = 0
+        while True:
+            try:
+                # The connection is not closed by send_messages if it has been opened before
+                self.connection.open()
+                if self.connection.send_messages([email]):
+                    return EMAIL_SENT
+                # Not sent without error (no valid recipient): it would not be sent later
+                logger.warning("Email to {0} has not been sent".format(', '.join(email.to)))
+                return EMAIL_PERMANENT_FAILURE
+            except OSError as err:  # smtplib.SMTPException is an OSError
+                transient = is_transient_error(err)
+                if attempt >= self.max_retries or not transient:
+                    logger.warning("Email to {0} has not been sent: {1}".format(', '.join(email.to), err))
+                    return EMAIL_TRANSIENT_FAILURE if transient else EMAIL_PERMANENT_FAILURE
+                # The connection may be broken: open a new one
+                self.close()
+                time.sleep(self.retry_delay * 2 ** attempt)
+                attempt += 1
+
+    def close(self):
+        """close the connection"""
+        try:
+            self.connection.close()
+        except OSError:
+            pass
+
+
+class DeliveryPool(object):
+    """
+    a pool of threads sending emails: every thread keeps its SMTP connection opened until the pool is closed
+    With a single connection, the emails are sent by the calling thread
+    """
+
+    def __init__(self, connections=None, batch_size=None):
+        self.connections = connections or get_smtp_connections()
+        self.batch_size = batch_size or get_smtp_batch_size()
+        self._sender = None
+        self._threads = []
+        self._results = []
+        self._lock = threading.Lock()
+        # Bounded: the emails are not built faster than they are sent
+        self._batches = queue.Queue(maxsize=self.connections * 2)
+
+    def __enter__(self):
+        if self.connections <= 1:
+            self._sender = EmailSender()
+        else:
+            self._threads = [threading.Thread(target=self._send_batches) for _index in range(self.connections)]
+            for thread in self._threads:
+                thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _send_batches(self):
+        """thread: send the batches of the queue until None"""
+        sender = EmailSender()
+        try:
+            while True:
+                batch = self._batches.get()
+                try:
+                    if batch is None:
+                        break
+                    results = [(contact_id, sender.send(email)) for (contact_id, email) in batch]
+                    with self._lock:
+                        self._results.extend(results)
+                except Exception:  # pylint: disable=broad-except
+                    # Don't stop the thread: the queue would not be emptied anymore
+                    logger.exception("deliver_emails")
+                finally:
+                    self._batches.task_done()
+        finally:
+            sender.close()
+
+    def deliver(self, emails):
+        """
+        send the emails and wait until they are all sent
+        emails : iterable of (contact id, email) tuples. It is consumed while the emails are sent
+        returns the (sent, failed) lists of contact ids: failed are the permanent failures. The contacts whose
+        email has a transient failure are in none of them
+        """
+        if self._sender:
+            return self._split_results([(contact_id, self._sender.send(email)) for (contact_id, email) in emails])
+
+        batch = []
+        for contact_email in emails:
+            batch.append(contact_email)
+            if len(batch) >= self.batch_size:
+                self._batches.put(batch)
+                batch = []
+        if batch:
+            self._batches.put(batch)
+        self._batches.join()
+        with self._lock:
+            results, self._results = self._results, []
+        return self._split_results(results)
+
+    @staticmethod
+    def _split_results(results):
+        """returns the (sent, failed) lists of contact ids of the (contact id, status) results"""
+        sent_contact_ids = [contact_id for (contact_id, status) in results if status == EMAIL_SENT]
+        failed_contact_ids = [contact_id for (contact_id, status) in results if status == EMAIL_PERMANENT_FAILURE]
+        return sent_contact_ids, failed_contact_ids
+
+    def close(self):
+        """stop the threads and close the connections"""
+        if self._sender:
+            self._sender.close()
+            self._sender = None
+        for _thread in self._threads:
+            self._batches.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+def deliver_emails(emails, connections=None, batch_size=None):
+    """
+    send the emails
+    emails : iterable of (contact id, email) tuples. It is consumed while the emails are sent
+    connections : number of SMTP connections used in parallel (COOP_CMS_NEWSLETTER_SMTP_CONNECTIONS by default)
+    batch_size : number of emails given at once to a connection
+    returns the (sent, failed) lists of contact ids: failed are the permanent failures
+    """
+    with DeliveryPool(connections, batch_size) as pool:
+        return pool.deliver(emails)
+
+
+class TokenBucket(object):
+    """rate limit: at most rate emails by second, with bursts of capacity emails"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = capacity or max(self.rate, 1)
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """wait until an email can be sent"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            self.tokens -= 1
+            # If there is no token left, the caller waits until its token is refilled
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def get_rate_limiter(from_email):
+    """
+    returns the TokenBucket of the domain of from_email. None if not limited
+    The bucket is shared by all the emailings sent by the process with the same domain
+    """
+    domain = parseaddr(from_email)[1].rsplit('@', 1)[-1].lower()
+    rate = get_rate_limits().get(domain, get_default_rate_limit())
+    if not rate:
+        return None
+    if (domain, rate) not in _rate_limiters:
+        _rate_limiters[(domain, rate)] = TokenBucket(rate)
+    return _rate_limiters[(domain, rate)]
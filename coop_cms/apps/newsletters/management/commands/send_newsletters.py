@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from datetime import datetime
+import time
 
 from django.core.management.base import BaseCommand
 
@@ -8,37 +9,56 @@ from ...models import Emailing
 from ...utils import send_newsletter
 
 
+def send_scheduled_emailings(max_nb, verbose=0):
+    """send the scheduled emailings to at most max_nb contacts. Returns the number of emails sent"""
+    emailings = Emailing.objects.filter(
+        status__in=(Emailing.STATUS_SCHEDULED, Emailing.STATUS_SENDING),
+        scheduling_dt__lte=datetime.now()
+    ).order_by('scheduling_dt', 'id')
+    total_sent = 0
+    for emailing in emailings:
+        if total_sent >= max_nb:
+            break  # stop sending if we reached the allowed number
+
+        # update rather than save: don't overwrite the status changed by another worker
+        Emailing.objects.filter(id=emailing.id, status=Emailing.STATUS_SCHEDULED).update(
+            status=Emailing.STATUS_SENDING
+        )
+
+        nb_sent = send_newsletter(emailing, max_nb - total_sent)
+
+        if verbose:
+            print(nb_sent, "emails sent for emailing", emailing.id)
+
+        total_sent += nb_sent
+
+        if emailing.send_to.count() == 0:
+            if verbose:
+                print("emailing", emailing.id, "done")
+            # update rather than save: don't overwrite the status changed while sending
+            Emailing.objects.filter(id=emailing.id, status=Emailing.STATUS_SENDING).update(
+                status=Emailing.STATUS_SENT, sending_dt=datetime.now()
+            )
+    return total_sent
+
+
 class Command(BaseCommand):
-    help = "send all emailing marked ready for sending"
+    help = "send all emailing marked ready for sending: can be called by a cron or run as a worker with --loop"
 
     def add_arguments(self, parser):
         parser.add_argument('max_nb', type=int, default=20, nargs='?')
+        parser.add_argument(
+            '--loop', dest='loop', type=int, default=0, help='wait N seconds and send the emailings again'
+        )
 
     def handle(self, max_nb, *args, **options):
         # look for emailing to be sent
         verbose = options.get('verbosity', 0)
-        
-        emailings = Emailing.objects.filter(
-            status__in=(Emailing.STATUS_SCHEDULED, Emailing.STATUS_SENDING),
-            scheduling_dt__lte=datetime.now()
-        )
-        total_sent = 0
-        for emailing in emailings:
-            emailing.status = Emailing.STATUS_SENDING
-            emailing.save()
-            
-            nb_sent = send_newsletter(emailing, max_nb)
-            
-            if verbose:
-                print(nb_sent, "emails sent for emailing", emailing.id)
-            
-            total_sent += nb_sent
-            
-            if emailing.send_to.count() == 0:
-                if verbose:
-                    print("emailing", emailing.id, "done")
-                emailing.status = Emailing.STATUS_SENT
-                emailing.save()
-                
-            if total_sent > max_nb:
-                break  # stop sending if we reached the allowed number
+        loop = options.get('loop')
+
+        while True:
+            total_sent = send_scheduled_emailings(max_nb, verbose)
+            if not loop:
+                break
+            if not total_sent:
+                time.sleep(loop)
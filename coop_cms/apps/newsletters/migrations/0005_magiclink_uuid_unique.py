@@ -0,0 +1,31 @@
+# Generated by Django 4.2.20 on 2026-10-19 11:02
+
+import uuid
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def set_missing_uuids(apps, schema_editor):
+    """the links without uuid get one: as done before the uuid was unique"""
+    magic_link_class = apps.get_model('newsletters', 'MagicLink')
+    for magic_link in magic_link_class.objects.filter(uuid=''):
+        name = '{0}-magic-link-{1}-{2}'.format(settings.SECRET_KEY, magic_link.id, magic_link.url)
+        magic_link.uuid = str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+        magic_link.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletters', '0004_subscription_unsubscription_reason'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_missing_uuids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='magiclink',
+            name='uuid',
+            field=models.CharField(blank=True, default='', max_length=100, unique=True),
+        ),
+    ]
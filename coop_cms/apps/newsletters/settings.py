@@ -20,3 +20,41 @@ def has_language_choices():
 def get_ignored_magic_links():
     """returns true if we should propose language choices"""
     return getattr(project_settings, 'COOP_CMS_NEWSLETTER_IGNORED_MAGIC_LINKS', [])
+
+
+def get_smtp_connections():
+    """number of SMTP connections used in parallel for sending an emailing"""
+    return getattr(project_settings, 'COOP_CMS_NEWSLETTER_SMTP_CONNECTIONS', 1)
+
+
+def get_smtp_batch_size():
+    """number of emails given at once to a SMTP connection"""
+    return getattr(project_settings, 'COOP_CMS_NEWSLETTER_SMTP_BATCH_SIZE', 20)
+
+
+def get_smtp_max_retries():
+    """number of retries when an email is refused with a temporary error (4xx)"""
+    return getattr(project_settings, 'COOP_CMS_NEWSLETTER_SMTP_MAX_RETRIES', 3)
+
+
+def get_smtp_retry_delay():
+    """delay in seconds before the first retry. It is doubled for every retry"""
+    return getattr(project_settings, 'COOP_CMS_NEWSLETTER_SMTP_RETRY_DELAY', 1)
+
+
+def get_send_chunk_size():
+    """
+    number of contacts rendered, sent and marked as sent together
+    Small by default: the contacts of a chunk are locked until all its emails are sent
+    """
+    return getattr(project_settings, 'COOP_CMS_NEWSLETTER_SEND_CHUNK_SIZE', 20)
+
+
+def get_rate_limits():
+    """max number of emails sent by second for a from_email domain: dict domain -> rate"""
+    return getattr(project_settings, 'COOP_CMS_NEWSLETTER_RATE_LIMITS', {})
+
+
+def get_default_rate_limit():
+    """max number of emails sent by second for the domains without rate limit. None: no limit"""
+    return getattr(project_settings, 'COOP_CMS_NEWSLETTER_RATE_LIMIT', None)
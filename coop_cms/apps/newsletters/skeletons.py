@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Render once, personalize many
+
+The newsletter is rendered once for a placeholder contact: its fields are unique tokens. The rendered email is
+compiled into a skeleton: a list of text parts and of slots. The email of a contact is the join of the text parts
+and of its values.
+If the template compares or transforms a field of the contact, the newsletter is rendered for every contact: see
+SlotToken.
+"""
+
+import re
+import uuid
+
+from django.db import models as db_models
+from django.utils.html import escape
+from django.utils.safestring import SafeString
+
+from .models import Contact
+
+
+def _get_slot_fields():
+    """fields of the contact which are replaced by a slot : the text fields and the id"""
+    return ['id'] + [
+        field.attname for field in Contact._meta.concrete_fields if isinstance(field, db_models.CharField)
+    ]
+
+
+def _str_method_using_value(method_name):
+    """method of SlotToken: the str method recording that the value is used"""
+    str_method = getattr(str, method_name)
+
+    def method(self, *args):
+        self._use()
+        return str_method(self, *args)
+    method.__name__ = method_name
+    return method
+
+
+class SlotToken(SafeString):
+    """
+    The value of a field of a PlaceholderContact: a unique token. It can be rendered but the other uses of its value
+    (ex: {% if contact.first_name == "John" %}) add the field to used_fields: the result depends on the contact
+    A SafeString: its methods are called rather than the ones of the literals of the templates and the filters get
+    the token
+    """
+
+    def __new__(cls, field_name, used_fields):
+        # A uuid is unique and is not changed by html escaping or url quoting
+        token = super(SlotToken, cls).__new__(cls, uuid.uuid4())
+        token.field_name = field_name
+        token.used_fields = used_fields
+        return token
+
+    def __getattribute__(self, name):
+        if not name.startswith('_') and name not in ('field_name', 'used_fields'):
+            # a method of str: lower(), startswith()...
+            self._use()
+        return super(SlotToken, self).__getattribute__(name)
+
+    def _use(self):
+        """the value of the field is used"""
+        self.used_fields.add(self.field_name)
+
+    def __bool__(self):
+        # The empty fields are not replaced by a token: same result for all the contacts with the same skeleton key
+        return True
+
+    __eq__ = _str_method_using_value('__eq__')
+    __ne__ = _str_method_using_value('__ne__')
+    __lt__ = _str_method_using_value('__lt__')
+    __le__ = _str_method_using_value('__le__')
+    __gt__ = _str_method_using_value('__gt__')
+    __ge__ = _str_method_using_value('__ge__')
+    __contains__ = _str_method_using_value('__contains__')
+    __len__ = _str_method_using_value('__len__')
+    __getitem__ = _str_method_using_value('__getitem__')
+    __iter__ = _str_method_using_value('__iter__')
+    __hash__ = _str_method_using_value('__hash__')
+
+
+class PlaceholderContact(object):
+    """
+    A contact whose fields are tokens. The empty fields are kept empty and the other fields (email_verified...)
+    keep the values of the contact: a template testing them gives the same result for all the contacts with the
+    same skeleton key. used_fields are the fields whose value has been used by the template rather than rendered
+    """
+
+    def __init__(self, contact):
+        self.contact = Contact()
+        for field in Contact._meta.concrete_fields:
+            setattr(self.contact, field.attname, getattr(contact, field.attname))
+        self.slots = {}
+        self.used_fields = set()
+        for field_name in _get_slot_fields():
+            if getattr(contact, field_name) not in ('', None):
+                token = SlotToken(field_name, self.used_fields)
+                self.slots[str.__str__(token)] = field_name
+                setattr(self.contact, field_name, token)
+        self.values = dict((field_name, token) for (token, field_name) in self.slots.items())
+
+
+def get_skeleton_key(contact):
+    """contacts with the same key can share the same skeleton"""
+    slot_fields = _get_slot_fields()
+    empty_fields = [field_name for field_name in slot_fields if getattr(contact, field_name) in ('', None)]
+    other_values = [
+        getattr(contact, field.attname) for field in Contact._meta.concrete_fields
+        if field.attname not in slot_fields
+    ]
+    return tuple(empty_fields), tuple(other_values)
+
+
+class Skeleton(object):
+    """a text compiled into parts and slots"""
+
+    def __init__(self, text, slots):
+        """
+        text : the text rendered for a PlaceholderContact
+        slots : dict token -> field name
+        """
+        if slots:
+            parts = re.split('({0})'.format('|'.join(re.escape(token) for token in slots)), text)
+        else:
+            parts = [text]
+        self.texts = parts[0::2]
+        self.fields = [slots[token] for token in parts[1::2]]
+
+    def has_slots(self):
+        """True if the text depends on the contact"""
+        return bool(self.fields)
+
+    def fill(self, values):
+        """returns the text with the values of a contact: values is a dict field name -> value"""
+        if not self.fields:
+            return self.texts[0]
+        parts = [self.texts[0]]
+        for field_name, text in zip(self.fields, self.texts[1:]):
+            parts.append(values[field_name])
+            parts.append(text)
+        return ''.join(parts)
+
+
+def get_contact_values(contact, html=False):
+    """returns the values of the slot fields of a contact. Escaped if html"""
+    values = {}
+    for field_name in _get_slot_fields():
+        value = getattr(contact, field_name)
+        value = '' if value is None else str(value)
+        values[field_name] = escape(value) if html else value
+    return values
+
+
+class EmailSkeleton(object):
+    """the subject, the html and the text of an email compiled for all the contacts of the same kind"""
+
+    def __init__(self, subject, html_text, text, slots):
+        self.subject = Skeleton(subject, slots)
+        self.html_text = Skeleton(html_text, slots)
+        self.text = Skeleton(text, slots)
+
+    def render(self, contact):
+        """returns the (subject, html_text, text) of a contact"""
+        values = get_contact_values(contact)
+        html_values = get_contact_values(contact, html=True)
+        return self.subject.fill(values), self.html_text.fill(html_values), self.text.fill(values)
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 """test email sending"""
 
+import uuid
+
+from django.conf import settings
 from django.urls import reverse
 
 from model_mommy import mommy
@@ -8,6 +11,7 @@ from model_mommy import mommy
 from ....tests import BaseTestCase
 
 from .. import models
+from ..utils import patch_emailing_html
 
 
 class MagicLinkTest(BaseTestCase):
@@ -25,3 +29,70 @@ class MagicLinkTest(BaseTestCase):
         self.assertEqual(response['Location'], link)
         self.assertEqual(magic_link.visitors.count(), 1)
         self.assertEqual(magic_link.visitors.all()[0], contact)
+
+
+class PatchEmailingHtmlTest(BaseTestCase):
+
+    def setUp(self):
+        super(PatchEmailingHtmlTest, self).setUp()
+        self.contact = mommy.make(models.Contact, email='toto@toto.fr')
+        self.emailing = mommy.make(models.Emailing)
+
+    def _get_magic_url(self, url):
+        magic_link = models.MagicLink.objects.get(emailing=self.emailing, url=url)
+        return self.emailing.newsletter.get_site_prefix() + reverse(
+            'newsletters:view_link', args=[magic_link.uuid, self.contact.uuid]
+        )
+
+    def test_links_created_at_once(self):
+        urls = ['http://www.google.fr/{0}'.format(index) for index in range(10)]
+        html_text = ''.join('<a href="{0}">link</a>'.format(url) for url in urls)
+
+        # read the existing links, create the missing links, read them
+        with self.assertNumQueries(3):
+            patched_html = patch_emailing_html(html_text, self.emailing, self.contact)
+
+        self.assertEqual(models.MagicLink.objects.filter(emailing=self.emailing).count(), len(urls))
+        self.assertEqual(
+            patched_html, ''.join('<a href="{0}">link</a>'.format(self._get_magic_url(url)) for url in urls)
+        )
+
+        with self.assertNumQueries(1):
+            self.assertEqual(patch_emailing_html(html_text, self.emailing, self.contact), patched_html)
+
+    def test_same_link_twice(self):
+        html_text = '<a href="http://www.google.fr">1</a><a href="http://www.google.fr">2</a>'
+        patched_html = patch_emailing_html(html_text, self.emailing, self.contact)
+        magic_url = self._get_magic_url("http://www.google.fr")
+        self.assertEqual(patched_html, '<a href="{0}">1</a><a href="{0}">2</a>'.format(magic_url))
+
+    def test_existing_duplicated_links(self):
+        magic_link1 = models.MagicLink.objects.create(
+            emailing=self.emailing, url="http://www.google.fr", uuid=str(uuid.uuid4())
+        )
+        models.MagicLink.objects.create(emailing=self.emailing, url="http://www.google.fr", uuid=str(uuid.uuid4()))
+        patched_html = patch_emailing_html('<a href="http://www.google.fr">1</a>', self.emailing, self.contact)
+        self.assertIn(reverse('newsletters:view_link', args=[magic_link1.uuid, self.contact.uuid]), patched_html)
+
+    def test_not_magic_links(self):
+        unregister_url = reverse('newsletters:unregister', args=[self.emailing.id, self.contact.uuid])
+        html_text = '<a href="#top">1</a><a href="{0}">2</a>'.format(unregister_url)
+        with self.assertNumQueries(0):
+            self.assertEqual(patch_emailing_html(html_text, self.emailing, self.contact), html_text)
+        self.assertEqual(models.MagicLink.objects.count(), 0)
+
+    def test_uuid(self):
+        magic_link = models.MagicLink.objects.create(emailing=self.emailing, url="http://www.google.fr")
+        self.assertEqual(magic_link.uuid, models.MagicLink.make_uuid(self.emailing.id, "http://www.google.fr"))
+        self.assertNotEqual(magic_link.uuid, models.MagicLink.make_uuid(self.emailing.id, "http://www.google.com"))
+
+    def test_uuid_legacy_collision(self):
+        # The uuid of a link created before was made from its id: the same number as an emailing id
+        url = "http://www.google.fr"
+        legacy_name = '{0}-magic-link-{1}-{2}'.format(settings.SECRET_KEY, self.emailing.id, url)
+        legacy_link = models.MagicLink.objects.create(
+            emailing=mommy.make(models.Emailing), url=url, uuid=str(uuid.uuid5(uuid.NAMESPACE_URL, legacy_name))
+        )
+        magic_link = models.MagicLink.objects.create(emailing=self.emailing, url=url)
+        self.assertNotEqual(magic_link.uuid, legacy_link.uuid)
+        self.assertEqual(models.MagicLink.objects.get(uuid=magic_link.uuid), magic_link)
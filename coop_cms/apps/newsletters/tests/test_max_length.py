@@ -1,11 +1,71 @@
 # -*- coding: utf-8 -*-
 """test email sending"""
 
+import os
+import timeit
+from unittest import skipUnless
+
 from ....tests import BaseTestCase
+from ....utils import avoid_line_too_long
 
 from ..utils import force_line_max_length
 
 
+def _legacy_force_line_max_length(text, max_length_per_line=400, dont_cut_in_quotes=True):
+    """the previous implementation: reference for the parity and the benchmark"""
+    out_text = ""
+    for line in text.split("\n"):
+        if len(line) < max_length_per_line:
+            out_text += line + "\n"
+        else:
+            words = []
+            line_length = 0
+            quotes_count = 0
+            for word in line.split(" "):
+                if word:
+                    words.append(word)
+                    quotes_count += word.count('"')
+                    line_length += len(word) + 1
+                    in_quotes = (quotes_count % 2) == 1
+                    if line_length > max_length_per_line:
+                        if not (not dont_cut_in_quotes and in_quotes):
+                            out_text += " ".join(words) + "\n"
+                            words = []
+                            line_length = 0
+            if words:
+                out_text += " ".join(words) + "\n"
+    return out_text[:-1]
+
+
+def _legacy_avoid_line_too_long(pretty_html_text):
+    """the previous implementation: reference for the parity and the benchmark"""
+    new_lines = []
+    for line in pretty_html_text.split('\n'):
+        line_length = len(line)
+        if line_length >= 998:
+            parts = []
+            part_size = 900
+            while part_size * len(parts) < line_length:
+                parts.append(line[len(parts) * part_size:(len(parts) + 1) * part_size])
+            parts = [part[::-1].replace(' ', '\n', 1)[::-1] for part in parts]
+            new_lines.append(''.join(parts))
+        else:
+            new_lines.append(line)
+    return '\n'.join(new_lines)
+
+
+def _make_newsletter_html(size):
+    """a newsletter of about size characters: long paragraphs with links and short lines"""
+    paragraph = '<p style="margin: 0;  color: #333">' + ' '.join(
+        ['Lorem ipsum', '<a class="link  big" href="http://toto.fr/a?b=1">dolor</a>', 'sit "amet"', '  consectetur']
+        * 50
+    ) + '</p>'
+    lines = []
+    while sum(len(line) + 1 for line in lines) < size:
+        lines.extend([paragraph, '<tr><td>Short line</td></tr>', '', '   indented "quote'])
+    return '\n'.join(lines)
+
+
 class MaxLineLengthTest(BaseTestCase):
     """Check that we can control the max length of line"""
 
@@ -130,3 +190,36 @@ class MaxLineLengthTest(BaseTestCase):
 
         result = force_line_max_length(content, max_length_per_line=400, dont_cut_in_quotes=False)
         self.assertEqual(expected_content, result)
+
+
+class MaxLineLengthBenchmarkTest(BaseTestCase):
+    """same results as the previous implementation. The benchmark on a 200 KB newsletter is run on demand"""
+
+    def test_parity(self):
+        texts = [
+            _make_newsletter_html(20000), '', '\n', ' ' * 500, 'a  b   c ' * 100 + '\n\n' + '"' * 900,
+            'x "a b" c "d' * 50
+        ]
+        for text in texts:
+            for max_length in (1, 5, 80, 400):
+                for dont_cut_in_quotes in (True, False):
+                    self.assertEqual(
+                        force_line_max_length(text, max_length, dont_cut_in_quotes),
+                        _legacy_force_line_max_length(text, max_length, dont_cut_in_quotes)
+                    )
+            self.assertEqual(avoid_line_too_long(text), _legacy_avoid_line_too_long(text))
+
+    @skipUnless(os.environ.get('COOP_CMS_BENCHMARK'), "set COOP_CMS_BENCHMARK=1 to run the benchmark")
+    def test_benchmark(self):
+        html = _make_newsletter_html(200 * 1024)
+        for function, legacy_function in (
+            (force_line_max_length, _legacy_force_line_max_length),
+            (avoid_line_too_long, _legacy_avoid_line_too_long),
+        ):
+            self.assertEqual(function(html), legacy_function(html))
+            # The durations are printed rather than compared: they depend on the machine
+            duration = min(timeit.repeat(lambda: function(html), number=5, repeat=3))
+            legacy_duration = min(timeit.repeat(lambda: legacy_function(html), number=5, repeat=3))
+            print("{0}: {1:.1f}ms (previous: {2:.1f}ms)".format(
+                function.__name__, duration * 1000, legacy_duration * 1000
+            ))
@@ -2,12 +2,16 @@
 """test email sending"""
 
 from datetime import datetime
+import smtplib
 from unittest import skipIf
+from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import management
 from django.core import mail
+from django.core.mail.backends import locmem
+from django.db import transaction
 from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils.translation import activate
@@ -18,6 +22,11 @@ from coop_cms.utils import get_url_in_language
 from model_mommy import mommy
 
 from .. import models
+from ..delivery import (
+    EMAIL_PERMANENT_FAILURE, EMAIL_SENT, EMAIL_TRANSIENT_FAILURE, DeliveryPool, EmailSender, TokenBucket,
+    deliver_emails, get_rate_limiter, is_transient_error
+)
+from ..utils import claim_contacts, send_newsletter
 
 
 class SendEmailingTest(BaseTestCase):
@@ -475,3 +484,316 @@ class SendEmailingTest(BaseTestCase):
             self.assertTrue(email.alternatives[0][0].find("#art1") > 0)
             # Check magic links
             self.assertTrue(models.MagicLink.objects.count() > 0)
+
+
+class FailingEmailBackend(locmem.EmailBackend):
+    """the emails sent to a 'fail' address are refused"""
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].startswith('fail'):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'refused')})
+        return super(FailingEmailBackend, self).send_messages(messages)
+
+
+@override_settings(COOP_CMS_REPLY_TO="", COOP_CMS_FROM_EMAIL='toto@toto.fr')
+class MarkAsSentTest(BaseTestCase):
+    """the contacts are moved from send_to to sent_to once sent"""
+
+    def _make_emailing(self, contacts):
+        emailing = mommy.make(
+            models.Emailing,
+            newsletter=mommy.make(Newsletter, template='test/newsletter_contact.html'),
+            status=models.Emailing.STATUS_SCHEDULED,
+            scheduling_dt=datetime.now(),
+            subscription_type=mommy.make(models.SubscriptionType)
+        )
+        emailing.send_to.add(*contacts)
+        return emailing
+
+    def test_mark_as_sent(self):
+        contacts = [mommy.make(models.Contact, email='contact{0}@toto.fr'.format(index)) for index in range(3)]
+        emailing = self._make_emailing(contacts)
+        emailing.sent_to.add(contacts[0])
+
+        emailing.mark_as_sent([contacts[0].id, contacts[1].id])
+
+        self.assertEqual(list(emailing.send_to.all()), [contacts[2]])
+        self.assertEqual(sorted(emailing.sent_to.values_list('id', flat=True)), [contacts[0].id, contacts[1].id])
+
+    def test_mark_as_sent_no_contacts(self):
+        emailing = self._make_emailing([mommy.make(models.Contact, email='contact@toto.fr')])
+        with self.assertNumQueries(0):
+            emailing.mark_as_sent([])
+        self.assertEqual(emailing.send_to.count(), 1)
+
+    def test_send_newsletter(self):
+        contacts = [mommy.make(models.Contact, email='contact{0}@toto.fr'.format(index)) for index in range(3)]
+        contact_no_email = mommy.make(models.Contact, email='')
+        emailing = self._make_emailing(contacts + [contact_no_email])
+
+        self.assertEqual(send_newsletter(emailing, 10), 3)
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(emailing.send_to.count(), 0)
+        self.assertEqual(emailing.sent_to.count(), 4)
+
+    @override_settings(
+        EMAIL_BACKEND='coop_cms.apps.newsletters.tests.test_sending.TransientFailingEmailBackend',
+        COOP_CMS_NEWSLETTER_SMTP_MAX_RETRIES=0
+    )
+    def test_failed_send_stay_in_send_to(self):
+        TransientFailingEmailBackend.attempts = {}
+        contacts = [mommy.make(models.Contact, email='contact{0}@toto.fr'.format(index)) for index in range(2)]
+        failing_contact = mommy.make(models.Contact, email='busy@toto.fr')
+        emailing = self._make_emailing(contacts + [failing_contact])
+
+        self.assertEqual(send_newsletter(emailing, 10), 2)
+
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), ['contact0@toto.fr', 'contact1@toto.fr'])
+        self.assertEqual(list(emailing.send_to.all()), [failing_contact])
+        self.assertEqual(
+            sorted(emailing.sent_to.values_list('id', flat=True)), sorted(contact.id for contact in contacts)
+        )
+
+    @override_settings(EMAIL_BACKEND='coop_cms.apps.newsletters.tests.test_sending.FailingEmailBackend')
+    def test_refused_send_leave_send_to(self):
+        contacts = [mommy.make(models.Contact, email='contact{0}@toto.fr'.format(index)) for index in range(2)]
+        failing_contact = mommy.make(models.Contact, email='fail@toto.fr')
+        emailing = self._make_emailing(contacts + [failing_contact])
+
+        management.call_command('send_newsletters', 10, verbosity=0)
+
+        self.assertEqual(len(mail.outbox), 2)
+        emailing = models.Emailing.objects.get(id=emailing.id)
+        self.assertEqual(emailing.send_to.count(), 0)
+        self.assertEqual(emailing.sent_to.count(), 3)
+        self.assertEqual(emailing.status, models.Emailing.STATUS_SENT)
+
+    @override_settings(COOP_CMS_NEWSLETTER_SEND_CHUNK_SIZE=2)
+    def test_send_newsletter_by_chunks(self):
+        contacts = [mommy.make(models.Contact, email='contact{0}@toto.fr'.format(index)) for index in range(5)]
+        emailing = self._make_emailing(contacts)
+
+        self.assertEqual(send_newsletter(emailing, 3), 3)
+
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), [contact.email for contact in contacts[:3]])
+        self.assertEqual(list(emailing.send_to.order_by('id')), contacts[3:])
+
+        self.assertEqual(send_newsletter(emailing, 10), 2)
+        self.assertEqual(emailing.send_to.count(), 0)
+
+    @override_settings(
+        EMAIL_BACKEND='coop_cms.apps.newsletters.tests.test_sending.TransientFailingEmailBackend',
+        COOP_CMS_NEWSLETTER_SEND_CHUNK_SIZE=1,
+        COOP_CMS_NEWSLETTER_SMTP_MAX_RETRIES=0
+    )
+    def test_send_newsletter_by_chunks_failed(self):
+        TransientFailingEmailBackend.attempts = {}
+        failing_contact = mommy.make(models.Contact, email='busy@toto.fr')
+        contacts = [mommy.make(models.Contact, email='contact{0}@toto.fr'.format(index)) for index in range(2)]
+        emailing = self._make_emailing([failing_contact] + contacts)
+
+        self.assertEqual(send_newsletter(emailing, 10), 2)
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(list(emailing.send_to.all()), [failing_contact])
+
+    def test_claim_contacts(self):
+        contacts = [mommy.make(models.Contact, email='contact{0}@toto.fr'.format(index)) for index in range(5)]
+        emailing = self._make_emailing(contacts)
+        with transaction.atomic():
+            self.assertEqual(claim_contacts(emailing, 0, 3), contacts[:3])
+            self.assertEqual(claim_contacts(emailing, contacts[2].id, 3), contacts[3:])
+
+    @override_settings(
+        EMAIL_BACKEND='coop_cms.apps.newsletters.tests.test_sending.CrashingEmailBackend',
+        COOP_CMS_NEWSLETTER_SEND_CHUNK_SIZE=2
+    )
+    def test_send_newsletter_resume_after_crash(self):
+        contacts = [mommy.make(models.Contact, email='contact{0}@toto.fr'.format(index)) for index in range(2)]
+        crash_contacts = [
+            mommy.make(models.Contact, email='contact2@toto.fr'), mommy.make(models.Contact, email='crash@toto.fr')
+        ]
+        other_contacts = [mommy.make(models.Contact, email='contact4@toto.fr')]
+        emailing = self._make_emailing(contacts + crash_contacts + other_contacts)
+
+        CrashingEmailBackend.crashed = False
+        self.assertRaises(RuntimeError, send_newsletter, emailing, 10)
+
+        # The chunk sent before the crash is kept: the chunk of the crash is rolled back
+        self.assertEqual(list(emailing.sent_to.order_by('id')), contacts)
+        self.assertEqual(list(emailing.send_to.order_by('id')), crash_contacts + other_contacts)
+
+        self.assertEqual(send_newsletter(emailing, 10), 3)
+        self.assertEqual(emailing.send_to.count(), 0)
+        self.assertEqual(emailing.sent_to.count(), 5)
+
+    def test_send_newsletters_max_nb(self):
+        emailings = [
+            self._make_emailing(
+                [mommy.make(models.Contact, email='contact{0}{1}@toto.fr'.format(index, i)) for i in range(3)]
+            )
+            for index in range(2)
+        ]
+
+        management.call_command('send_newsletters', 4, verbosity=0)
+
+        self.assertEqual(len(mail.outbox), 4)
+        emailings = [models.Emailing.objects.get(id=emailing.id) for emailing in emailings]
+        self.assertEqual(emailings[0].status, models.Emailing.STATUS_SENT)
+        self.assertEqual(emailings[1].status, models.Emailing.STATUS_SENDING)
+        self.assertEqual(emailings[1].send_to.count(), 2)
+
+        management.call_command('send_newsletters', 4, verbosity=0)
+
+        self.assertEqual(len(mail.outbox), 6)
+        self.assertEqual(models.Emailing.objects.get(id=emailings[1].id).status, models.Emailing.STATUS_SENT)
+
+    def test_send_newsletters_status_changed(self):
+        emailing = self._make_emailing([mommy.make(models.Contact, email='contact@toto.fr')])
+
+        def send_and_edit(emailing, max_nb):
+            # The emailing is edited again by someone else while it is sent
+            nb_sent = send_newsletter(emailing, max_nb)
+            models.Emailing.objects.filter(id=emailing.id).update(status=models.Emailing.STATUS_EDITING)
+            return nb_sent
+
+        with patch('coop_cms.apps.newsletters.management.commands.send_newsletters.send_newsletter', send_and_edit):
+            management.call_command('send_newsletters', 10, verbosity=0)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(models.Emailing.objects.get(id=emailing.id).status, models.Emailing.STATUS_EDITING)
+
+    @override_settings(COOP_CMS_NEWSLETTER_RATE_LIMITS={'toto.fr': 1000})
+    def test_send_newsletter_rate_limit(self):
+        emailing = self._make_emailing(
+            [mommy.make(models.Contact, email='contact{0}@toto.fr'.format(index)) for index in range(3)]
+        )
+        emailing.subscription_type.from_email = 'newsletter@toto.fr'
+        with patch.object(TokenBucket, 'acquire') as acquire:
+            self.assertEqual(send_newsletter(emailing, 10), 3)
+        self.assertEqual(acquire.call_count, 3)
+
+
+class CrashingEmailBackend(locmem.EmailBackend):
+    """the process crashes the first time an email is sent to a 'crash' address"""
+    crashed = False
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].startswith('crash') and not CrashingEmailBackend.crashed:
+                CrashingEmailBackend.crashed = True
+                raise RuntimeError('crash')
+        return super(CrashingEmailBackend, self).send_messages(messages)
+
+
+class TransientFailingEmailBackend(locmem.EmailBackend):
+    """refuse the first attempts of sending to 'busy' addresses with a temporary error"""
+    attempts = {}
+
+    def send_messages(self, messages):
+        for message in messages:
+            address = message.to[0]
+            if address.startswith('busy'):
+                attempts = TransientFailingEmailBackend.attempts
+                attempts[address] = attempts.get(address, 0) + 1
+                if attempts[address] <= 2:
+                    raise smtplib.SMTPRecipientsRefused({address: (451, b'try again later')})
+        return super(TransientFailingEmailBackend, self).send_messages(messages)
+
+
+@override_settings(COOP_CMS_NEWSLETTER_SMTP_RETRY_DELAY=0)
+class DeliverEmailsTest(BaseTestCase):
+    """the emails are sent by a pool of connections"""
+
+    def setUp(self):
+        super(DeliverEmailsTest, self).setUp()
+        TransientFailingEmailBackend.attempts = {}
+
+    def _make_emails(self, addresses):
+        return [
+            (index, mail.EmailMessage('Subject', 'Body', 'toto@toto.fr', [address]))
+            for (index, address) in enumerate(addresses)
+        ]
+
+    def test_deliver_emails_in_parallel(self):
+        addresses = ['contact{0}@toto.fr'.format(index) for index in range(25)]
+        sent_ids, failed_ids = deliver_emails(iter(self._make_emails(addresses)), connections=3, batch_size=4)
+        self.assertEqual(sorted(sent_ids), list(range(25)))
+        self.assertEqual(failed_ids, [])
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), sorted(addresses))
+
+    @override_settings(EMAIL_BACKEND='coop_cms.apps.newsletters.tests.test_sending.FailingEmailBackend')
+    def test_deliver_emails_permanent_error(self):
+        addresses = ['contact0@toto.fr', 'fail@toto.fr', 'contact1@toto.fr']
+        sent_ids, failed_ids = deliver_emails(self._make_emails(addresses), connections=2, batch_size=1)
+        self.assertEqual(sorted(sent_ids), [0, 2])
+        self.assertEqual(failed_ids, [1])
+        self.assertEqual(len(mail.outbox), 2)
+
+    @override_settings(EMAIL_BACKEND='coop_cms.apps.newsletters.tests.test_sending.TransientFailingEmailBackend')
+    def test_deliver_emails_retry(self):
+        addresses = ['contact0@toto.fr', 'busy@toto.fr']
+        sent_ids, failed_ids = deliver_emails(self._make_emails(addresses), connections=1)
+        self.assertEqual(sorted(sent_ids), [0, 1])
+        self.assertEqual(failed_ids, [])
+        self.assertEqual(TransientFailingEmailBackend.attempts['busy@toto.fr'], 3)
+        self.assertEqual(len(mail.outbox), 2)
+
+    @override_settings(
+        EMAIL_BACKEND='coop_cms.apps.newsletters.tests.test_sending.TransientFailingEmailBackend',
+        COOP_CMS_NEWSLETTER_SMTP_MAX_RETRIES=1
+    )
+    def test_deliver_emails_too_many_retries(self):
+        addresses = ['contact0@toto.fr', 'busy@toto.fr']
+        sent_ids, failed_ids = deliver_emails(self._make_emails(addresses), connections=2, batch_size=1)
+        self.assertEqual(sent_ids, [0])
+        # A transient failure is not a failure: the email can be sent again later
+        self.assertEqual(failed_ids, [])
+        self.assertEqual(TransientFailingEmailBackend.attempts['busy@toto.fr'], 2)
+
+    def test_delivery_pool(self):
+        with DeliveryPool(connections=2, batch_size=2) as pool:
+            sent_ids, failed_ids = pool.deliver(self._make_emails(['a@toto.fr', 'b@toto.fr', 'c@toto.fr']))
+            self.assertEqual(sorted(sent_ids), [0, 1, 2])
+            self.assertEqual(failed_ids, [])
+            self.assertEqual(pool.deliver(self._make_emails(['d@toto.fr'])), ([0], []))
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_email_sender_status(self):
+        sender = EmailSender(max_retries=0)
+        self.assertEqual(sender.send(self._make_emails(['a@toto.fr'])[0][1]), EMAIL_SENT)
+        with override_settings(
+            EMAIL_BACKEND='coop_cms.apps.newsletters.tests.test_sending.TransientFailingEmailBackend'
+        ):
+            sender = EmailSender(max_retries=0)
+            self.assertEqual(sender.send(self._make_emails(['busy@toto.fr'])[0][1]), EMAIL_TRANSIENT_FAILURE)
+        with override_settings(EMAIL_BACKEND='coop_cms.apps.newsletters.tests.test_sending.FailingEmailBackend'):
+            sender = EmailSender(max_retries=0)
+            self.assertEqual(sender.send(self._make_emails(['fail@toto.fr'])[0][1]), EMAIL_PERMANENT_FAILURE)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(10, capacity=2)
+        with patch('coop_cms.apps.newsletters.delivery.time.sleep') as sleep:
+            bucket.acquire()
+            bucket.acquire()
+            self.assertEqual(sleep.call_count, 0)
+            bucket.acquire()
+            self.assertEqual(sleep.call_count, 1)
+            self.assertTrue(0 < sleep.call_args[0][0] <= 0.1)
+
+    @override_settings(COOP_CMS_NEWSLETTER_RATE_LIMITS={'toto.fr': 5}, COOP_CMS_NEWSLETTER_RATE_LIMIT=None)
+    def test_get_rate_limiter(self):
+        rate_limiter = get_rate_limiter('"Toto" <newsletter@Toto.fr>')
+        self.assertEqual(rate_limiter.rate, 5)
+        self.assertIs(get_rate_limiter('other@toto.fr'), rate_limiter)
+        self.assertIsNone(get_rate_limiter('newsletter@titi.fr'))
+
+    def test_is_transient_error(self):
+        self.assertTrue(is_transient_error(smtplib.SMTPRecipientsRefused({'a@toto.fr': (450, b'busy')})))
+        self.assertFalse(is_transient_error(smtplib.SMTPRecipientsRefused({'a@toto.fr': (550, b'unknown')})))
+        self.assertTrue(is_transient_error(smtplib.SMTPDataError(421, b'closing')))
+        self.assertFalse(is_transient_error(smtplib.SMTPSenderRefused(553, b'refused', 'toto@toto.fr')))
+        self.assertTrue(is_transient_error(smtplib.SMTPServerDisconnected()))
+        self.assertTrue(is_transient_error(ConnectionResetError()))
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""test the newsletter is rendered once for all the contacts"""
+
+from datetime import datetime
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.template import Context, Template
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from model_mommy import mommy
+
+from ....models import Newsletter
+from ....tests import BaseTestCase
+
+from .. import models, utils
+from ..skeletons import PlaceholderContact, Skeleton, get_skeleton_key
+
+
+class SkeletonTest(BaseTestCase):
+    """compile a text into a skeleton"""
+
+    def test_fill(self):
+        contact = mommy.make(models.Contact, email='toto@toto.fr', first_name='John', last_name='')
+        placeholder = PlaceholderContact(contact)
+        text = 'Hello {0.first_name} {0.last_name}<{0.email}> {0.uuid}'.format(placeholder.contact)
+        skeleton = Skeleton(text, placeholder.slots)
+        self.assertTrue(skeleton.has_slots())
+        self.assertEqual(
+            skeleton.fill({'first_name': 'Jim', 'email': 'jim@toto.fr', 'uuid': 'abc'}),
+            'Hello Jim <jim@toto.fr> abc'
+        )
+
+    def test_no_slots(self):
+        skeleton = Skeleton('Hello', {})
+        self.assertFalse(skeleton.has_slots())
+        self.assertEqual(skeleton.fill({}), 'Hello')
+
+    def test_skeleton_key(self):
+        contact1 = mommy.make(models.Contact, email='toto@toto.fr', first_name='John', last_name='')
+        contact2 = mommy.make(models.Contact, email='titi@toto.fr', first_name='Jim', last_name='')
+        contact3 = mommy.make(models.Contact, email='tutu@toto.fr', first_name='', last_name='')
+        self.assertEqual(get_skeleton_key(contact1), get_skeleton_key(contact2))
+        self.assertNotEqual(get_skeleton_key(contact1), get_skeleton_key(contact3))
+
+
+@override_settings(COOP_CMS_REPLY_TO="", COOP_CMS_FROM_EMAIL='toto@toto.fr')
+class SendWithSkeletonTest(BaseTestCase):
+    """the newsletter is rendered once and personalized for every contact"""
+
+    def _make_emailing(self, contacts, template='test/newsletter_contact.html', content=''):
+        site = Site.objects.get_current()
+        site.domain = "toto.fr"
+        site.save()
+        newsletter = mommy.make(
+            Newsletter, subject='Hello #!-first_name-!#', template=template,
+            content=content or '<p>#!-fullname-!# <a href="http://toto.fr">us</a></p>'
+        )
+        emailing = mommy.make(
+            models.Emailing,
+            newsletter=newsletter,
+            status=models.Emailing.STATUS_SCHEDULED,
+            scheduling_dt=datetime.now(),
+            subscription_type=mommy.make(models.SubscriptionType, site=site)
+        )
+        emailing.send_to.add(*contacts)
+        return emailing
+
+    def _get_emails(self):
+        return dict((email.to[0], email) for email in mail.outbox)
+
+    def test_render_once(self):
+        contacts = [
+            mommy.make(models.Contact, email=name + '@toto.fr', first_name=name.capitalize(), last_name='Doe')
+            for name in ('alpha', 'beta', 'gamma')
+        ]
+        emailing = self._make_emailing(contacts)
+
+        with patch.object(utils, 'render_contact_email') as render_mock:
+            with patch.object(utils, '_render_contact_html', wraps=utils._render_contact_html) as render_html_mock:
+                self.assertEqual(utils.send_newsletter(emailing, 10), 3)
+        self.assertFalse(render_mock.called)
+        # The newsletter is rendered twice: with a placeholder contact and a probe
+        self.assertEqual(render_html_mock.call_count, 2)
+        magic_link = models.MagicLink.objects.get(emailing=emailing, url='http://toto.fr')
+
+        emails = self._get_emails()
+        self.assertEqual(len(emails), 3)
+        for contact in contacts:
+            email = emails[contact.email]
+            html_text = email.alternatives[0][0]
+            self.assertEqual(email.subject, 'Hello ' + contact.first_name)
+            self.assertIn(contact.fullname, html_text)
+            self.assertIn(contact.fullname, email.body)
+            self.assertIn(reverse('newsletters:unregister', args=[emailing.id, contact.uuid]), html_text)
+            self.assertIn(reverse('newsletters:view_link', args=[magic_link.uuid, contact.uuid]), html_text)
+            for other_contact in contacts:
+                if other_contact != contact:
+                    self.assertNotIn(other_contact.first_name, html_text)
+                    self.assertNotIn(str(other_contact.uuid), html_text)
+
+    def test_text_alternative_once(self):
+        """the text alternative is computed from the skeleton: not for every contact"""
+        call_counts = []
+        for names in (('alpha', ), ('beta', 'gamma', 'delta')):
+            contacts = [
+                mommy.make(models.Contact, email=name + '@toto.fr', first_name=name.capitalize(), last_name='Doe')
+                for name in names
+            ]
+            emailing = self._make_emailing(contacts)
+            with patch.object(utils, 'dehtml', wraps=utils.dehtml) as dehtml_mock:
+                self.assertEqual(utils.send_newsletter(emailing, 10), len(contacts))
+            call_counts.append(dehtml_mock.call_count)
+        self.assertEqual(call_counts[0], call_counts[1])
+        self.assertIn('Delta Doe', self._get_emails()['delta@toto.fr'].body)
+
+    def test_same_as_render_for_contact(self):
+        contact = mommy.make(models.Contact, email='alpha@toto.fr', first_name='Alpha', last_name='Doe')
+        # The long lines are cut after filling the values: the tokens and the values don't have the same length
+        content = '<p>{0} #!-fullname-!# {0} <a href="http://toto.fr">us</a></p>'.format(' '.join(['word'] * 150))
+        emailing = self._make_emailing([contact], content=content)
+        lang = settings.LANGUAGE_CODE[:2]
+
+        with patch.object(utils, 'render_contact_email') as render_mock:
+            utils.send_newsletter(emailing, 10)
+        self.assertFalse(render_mock.called)
+
+        email = self._get_emails()[contact.email]
+        expected_email = utils.render_contact_email(emailing, contact, lang)
+        self.assertEqual((email.subject, email.alternatives[0][0], email.body), expected_email)
+
+    def test_empty_fields(self):
+        contact1 = mommy.make(models.Contact, email='alpha@toto.fr', first_name='Alpha', last_name='Doe')
+        contact2 = mommy.make(models.Contact, email='beta@toto.fr', first_name='', last_name='Doe')
+        emailing = self._make_emailing([contact1, contact2], template='test/newsletter_contact_default.html')
+
+        with patch.object(utils, 'render_contact_email') as render_mock:
+            utils.send_newsletter(emailing, 10)
+        self.assertFalse(render_mock.called)
+
+        emails = self._get_emails()
+        self.assertIn('Dear Alpha Doe', emails[contact1.email].alternatives[0][0])
+        self.assertIn('Dear friend Doe', emails[contact2.email].alternatives[0][0])
+
+    def test_escaped_values(self):
+        contact = mommy.make(models.Contact, email='alpha@toto.fr', first_name='Tom & <Jerry>', last_name='Doe')
+        emailing = self._make_emailing([contact])
+        utils.send_newsletter(emailing, 10)
+
+        email = self._get_emails()[contact.email]
+        self.assertEqual(email.subject, 'Hello Tom & <Jerry>')
+        self.assertIn('Tom &amp; &lt;Jerry&gt; Doe', email.alternatives[0][0])
+        self.assertIn('Tom & <Jerry> Doe', email.body)
+
+    def test_transformed_value(self):
+        """the template transforms a field of the contact: the newsletter is rendered for every contact"""
+        contacts = [
+            mommy.make(models.Contact, email=name + '@toto.fr', first_name=name, last_name='Doe')
+            for name in ('alpha', 'beta')
+        ]
+        emailing = self._make_emailing(contacts, template='test/newsletter_contact_upper.html')
+
+        with patch.object(utils, 'render_contact_email', wraps=utils.render_contact_email) as render_mock:
+            self.assertEqual(utils.send_newsletter(emailing, 10), 2)
+        self.assertEqual(render_mock.call_count, 2)
+
+        emails = self._get_emails()
+        self.assertIn('Dear ALPHA', emails['alpha@toto.fr'].alternatives[0][0])
+        self.assertIn('Dear BETA', emails['beta@toto.fr'].alternatives[0][0])
+
+    def test_compared_value(self):
+        """the template compares a field of the contact: the newsletter is rendered for every contact"""
+        contacts = [
+            mommy.make(models.Contact, email=name.lower() + '@toto.fr', first_name=name, last_name='Doe')
+            for name in ('John', 'Jim')
+        ]
+        emailing = self._make_emailing(contacts, template='test/newsletter_contact_if.html')
+
+        with patch.object(utils, 'render_contact_email', wraps=utils.render_contact_email) as render_mock:
+            self.assertEqual(utils.send_newsletter(emailing, 10), 2)
+        self.assertEqual(render_mock.call_count, 2)
+
+        emails = self._get_emails()
+        self.assertIn('Hi John', emails['john@toto.fr'].alternatives[0][0])
+        self.assertIn('Dear Jim', emails['jim@toto.fr'].alternatives[0][0])
+
+    def test_placeholder_used_fields(self):
+        contact = mommy.make(models.Contact, email='toto@toto.fr', first_name='John', last_name='Doe')
+        placeholder = PlaceholderContact(contact)
+        self.assertEqual(
+            Template('{{ contact.first_name }} {{ contact.fullname }} {% if contact.last_name %}!{% endif %}').render(
+                Context({'contact': placeholder.contact})
+            ),
+            '{0} {0} {1} !'.format(placeholder.values['first_name'], placeholder.values['last_name'])
+        )
+        self.assertEqual(placeholder.used_fields, set())
+
+        for template in (
+            '{% if contact.first_name == "John" %}!{% endif %}',
+            '{% if "John" == contact.first_name %}!{% endif %}',
+            '{% if contact.first_name|lower == "john" %}!{% endif %}',
+            '{% if contact.first_name in names %}!{% endif %}',
+            '{{ contact.first_name|length }}',
+        ):
+            placeholder = PlaceholderContact(contact)
+            Template(template).render(Context({'contact': placeholder.contact, 'names': ['John', 'Jim']}))
+            self.assertEqual(placeholder.used_fields, {'first_name'})
+
+    def test_personal_link(self):
+        """a link with a field of the contact is not a magic link shared by all contacts"""
+        contacts = [
+            mommy.make(models.Contact, email=name + '@toto.fr', first_name=name, last_name='Doe')
+            for name in ('alpha', 'beta')
+        ]
+        content = '<p><a href="http://toto.fr/?email=#!-email-!#">profile</a></p>'
+        emailing = self._make_emailing(contacts, content=content)
+
+        with patch.object(utils, 'render_contact_email', wraps=utils.render_contact_email) as render_mock:
+            utils.send_newsletter(emailing, 10)
+        self.assertEqual(render_mock.call_count, 2)
+        self.assertEqual(
+            sorted(
+                models.MagicLink.objects.filter(emailing=emailing, url__contains='email=').values_list('url', flat=True)
+            ),
+            ['http://toto.fr/?email=alpha@toto.fr', 'http://toto.fr/?email=beta@toto.fr']
+        )
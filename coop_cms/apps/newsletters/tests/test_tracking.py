@@ -3,18 +3,32 @@
 
 from datetime import datetime
 
+from asgiref.sync import async_to_sync
+
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core import management
 from django.core import mail
-from django.urls import reverse
+from django.http import Http404
+from django.test import AsyncRequestFactory
+from django.test.utils import override_settings
+from django.urls import include, path, reverse
 
 from model_mommy import mommy
 
 from ....models import Newsletter
 from ....tests import BaseTestCase
 
-from .. import models
+from .. import models, views
+
+
+# the async views are used by the newsletters urls only if COOP_CMS_ASYNC_VIEWS is set when they are imported
+urlpatterns = [
+    path('async/view-online/<int:emailing_id>/<uuid:contact_uuid>/', views.async_view_emailing_online),
+    path('async/link/<uuid:link_uuid>/<uuid:contact_uuid>/', views.async_view_link),
+    path('async/email-img/<int:emailing_id>/<uuid:contact_uuid>/', views.async_email_tracking),
+    path('', include('urls')),
+]
 
 
 class EmailTrackingTest(BaseTestCase):
@@ -164,3 +178,70 @@ class EmailTrackingTest(BaseTestCase):
             tracking_url += reverse("newsletters:email_tracking", args=[emailing.id, contact.uuid])
             self.assertTrue(email.alternatives[0][1], "text/html")
             self.assertTrue(email.alternatives[0][0].find(tracking_url) >= 0)
+
+
+class AsyncEmailTrackingTest(BaseTestCase):
+    """async version of the tracking views"""
+
+    def setUp(self):
+        """before each test"""
+        super(AsyncEmailTrackingTest, self).setUp()
+        newsletter = mommy.make(Newsletter, subject='This is the subject', template='test/newsletter_contact.html')
+        self.emailing = mommy.make(
+            models.Emailing,
+            newsletter=newsletter,
+            status=models.Emailing.STATUS_SENT,
+            scheduling_dt=datetime.now(),
+            sending_dt=datetime.now()
+        )
+        self.contact = mommy.make(models.Contact, email='alpha@toto.fr')
+        self.emailing.sent_to.add(self.contact)
+
+    def test_track_image(self):
+        """opened emails are updated"""
+        request = AsyncRequestFactory().get('/')
+        response = async_to_sync(views.async_email_tracking)(request, self.emailing.id, self.contact.uuid)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(list(self.emailing.opened_emails.all()), [self.contact])
+
+    def test_track_image_unknown_contact(self):
+        """404 if unknown contact"""
+        request = AsyncRequestFactory().get('/')
+        self.assertRaises(
+            Http404, async_to_sync(views.async_email_tracking), request, self.emailing.id, 'unknown'
+        )
+
+    def test_view_link(self):
+        """visitors are updated"""
+        magic_link = models.MagicLink.objects.create(emailing=self.emailing, url='http://toto.fr/')
+        request = AsyncRequestFactory().get('/')
+        response = async_to_sync(views.async_view_link)(request, magic_link.uuid, self.contact.uuid)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], 'http://toto.fr/')
+        self.assertEqual(list(magic_link.visitors.all()), [self.contact])
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncEmailTrackingUrlsTest(AsyncEmailTrackingTest):
+    """async tracking views called by the handler: the ci_project uses ATOMIC_REQUESTS"""
+
+    def test_track_image_url(self):
+        """opened emails are updated"""
+        response = self.client.get('/async/email-img/{0}/{1}/'.format(self.emailing.id, self.contact.uuid))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(list(self.emailing.opened_emails.all()), [self.contact])
+
+    def test_view_link_url(self):
+        """visitors are updated"""
+        magic_link = models.MagicLink.objects.create(emailing=self.emailing, url='http://toto.fr/')
+        response = self.client.get('/async/link/{0}/{1}/'.format(magic_link.uuid, self.contact.uuid))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], 'http://toto.fr/')
+        self.assertEqual(list(magic_link.visitors.all()), [self.contact])
+
+    def test_view_online_url(self):
+        """the emailing is rendered"""
+        response = self.client.get('/async/view-online/{0}/{1}/'.format(self.emailing.id, self.contact.uuid))
+        self.assertEqual(response.status_code, 200)
@@ -2,10 +2,18 @@
 
 from django.urls import path
 
+from ...settings import use_async_views
 from . import views
 
 app_name = "newsletters"
 
+if use_async_views():
+    view_online, view_link, email_tracking = (
+        views.async_view_emailing_online, views.async_view_link, views.async_email_tracking
+    )
+else:
+    view_online, view_link, email_tracking = views.view_emailing_online, views.view_link, views.email_tracking
+
 
 urlpatterns = [
     path(
@@ -15,7 +23,7 @@ urlpatterns = [
     ),
     path(
         'view-online/<int:emailing_id>/<uuid:contact_uuid>/',
-        views.view_emailing_online,
+        view_online,
         name='view_online'
     ),
     path(
@@ -25,12 +33,12 @@ urlpatterns = [
     ),
     path(
         'link/<uuid:link_uuid>/<uuid:contact_uuid>/',
-        views.view_link,
+        view_link,
         name='view_link'
     ),
     path(
         'email-img/<int:emailing_id>/<uuid:contact_uuid>/',
-        views.email_tracking,
+        email_tracking,
         name='email_tracking'
     ),
 ]
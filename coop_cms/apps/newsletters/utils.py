@@ -6,7 +6,8 @@ import re
 import sys
 
 from django.conf import settings
-from django.core.mail import get_connection, EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
 from django.template.loader import get_template
 from django.utils import translation
 from django.utils.translation import get_language as django_get_language
@@ -15,10 +16,15 @@ from django.urls import reverse
 from ...logger import logger
 from ...models import Newsletter
 from ...settings import get_newsletter_context_callbacks
-from ...utils import dehtml, make_links_absolute
+from ...utils import dehtml, make_links_absolute, wrap_long_lines
 
-from .settings import get_ignored_magic_links
+from .delivery import DeliveryPool, get_rate_limiter
+from .settings import get_ignored_magic_links, get_send_chunk_size
 from .models import Emailing, MagicLink, Contact
+from .skeletons import EmailSkeleton, PlaceholderContact, Skeleton, get_skeleton_key
+
+
+HREF_REGEX = re.compile('href="(?P<url>.+?)"')
 
 
 class EmailSendError(Exception):
@@ -79,10 +85,8 @@ def get_emailing_context(emailing, contact):
     return context_dict
 
 
-def patch_emailing_html(html_text, emailing, contact):
-    """transform links into magic link"""
-    links = re.findall('href="(?P<url>.+?)"', html_text)
-
+def get_emailing_ignored_links(emailing, contact):
+    """links which are not turned into magic links: 'unregister' and 'view online'"""
     ignore_links = [
         reverse("newsletters:unregister", args=[emailing.id, contact.uuid]),
         reverse("newsletters:view_online", args=[emailing.id, contact.uuid]),
@@ -95,97 +99,238 @@ def patch_emailing_html(html_text, emailing, contact):
         )
 
     ignore_links += get_ignored_magic_links()
+    return ignore_links
+
+
+def get_magic_links(emailing, urls):
+    """
+    returns a dict url -> uuid of the magic links of the emailing
+    The missing magic links are created at once: a link already created by another process is ignored
+    """
+    # If a link has been created twice (before the uuid was unique): use the first one
+    magic_links = dict(
+        MagicLink.objects.filter(emailing=emailing, url__in=urls).order_by('-id').values_list('url', 'uuid')
+    )
+    # The links are created in the order of the newsletter
+    missing_urls = [url for url in dict.fromkeys(urls) if url not in magic_links]
+    if missing_urls:
+        MagicLink.objects.bulk_create(
+            [
+                MagicLink(emailing=emailing, url=url, uuid=MagicLink.make_uuid(emailing.id, url))
+                for url in missing_urls
+            ],
+            ignore_conflicts=True
+        )
+        magic_links.update(
+            MagicLink.objects.filter(emailing=emailing, url__in=missing_urls).values_list('url', 'uuid')
+        )
+    return magic_links
+
+
+def patch_emailing_html(html_text, emailing, contact):
+    """transform links into magic link"""
+    ignore_links = set(get_emailing_ignored_links(emailing, contact))
 
     html_text = html_text.replace(
         'href="mailto:', 'href="mailto:{0}'.format(settings.COOP_CMS_REPLY_TO)
     )
 
-    for link in links:
+    magic_urls = []
+    for link in HREF_REGEX.findall(html_text):
         if (not link.lower().startswith('mailto:')) and (link[0] != "#") and link not in ignore_links:
             # mailto, internal links, 'unregister' and 'view online' are not magic
             if len(link) < 500:
-
-                magic_links = MagicLink.objects.filter(emailing=emailing, url=link)
-                if magic_links.count() == 0:
-                    magic_link = MagicLink.objects.create(emailing=emailing, url=link)
-                else:
-                    magic_link = magic_links[0]
-
-                view_magic_link_url = reverse('newsletters:view_link', args=[magic_link.uuid, contact.uuid])
-                magic_url = emailing.newsletter.get_site_prefix() + view_magic_link_url
-                html_text = html_text.replace('href="{0}"'.format(link), 'href="{0}"'.format(magic_url))
+                magic_urls.append(link)
             else:
                 if 'test' not in sys.argv:
                     logger.warning(
                         "magic link size is greater than 500 ({0}) : {1}".format(len(link), link)
                     )
-    return html_text
+
+    if not magic_urls:
+        return html_text
+
+    magic_links = get_magic_links(emailing, magic_urls)
+    site_prefix = emailing.newsletter.get_site_prefix()
+
+    def replace_link(match):
+        """replace the url by the url of its magic link"""
+        link = match.group('url')
+        if link in magic_links:
+            view_magic_link_url = reverse('newsletters:view_link', args=[magic_links[link], contact.uuid])
+            return 'href="{0}{1}"'.format(site_prefix, view_magic_link_url)
+        return match.group(0)
+
+    return HREF_REGEX.sub(replace_link, html_text)
+
+
+def _render_contact_html(emailing, contact, lang):
+    """returns the (subject, html_text) of the newsletter rendered for a contact"""
+    emailing_context = get_emailing_context(emailing, contact)
+    emailing_context["LANGUAGE_CODE"] = lang
+    the_template = get_template(emailing.newsletter.get_template_name())
+    return emailing_context['title'], the_template.render(emailing_context)
+
+
+def _finalize_email(emailing, contact, subject, html_text):
+    """returns the (subject, html_text, text) of the email: magic links and absolute urls"""
+    html_text = patch_emailing_html(html_text, emailing, contact)
+    html_text = make_links_absolute(
+        html_text, emailing.newsletter, site_prefix=emailing.get_domain_url_prefix(), wrap_lines=False
+    )
+    return subject, html_text, dehtml(html_text)
+
+
+def _cut_long_lines(subject, html_text, text):
+    """returns the (subject, html_text, text) of the email with the max line length"""
+    html_text = force_line_max_length(html_text, max_length_per_line=400, dont_cut_in_quotes=True)
+    return subject, wrap_long_lines(html_text), force_line_max_length(text)
+
+
+def render_contact_email(emailing, contact, lang):
+    """returns the (subject, html_text, text) of the email of a contact: the newsletter is rendered for him"""
+    subject, html_text = _render_contact_html(emailing, contact, lang)
+    return _cut_long_lines(*_finalize_email(emailing, contact, subject, html_text))
+
+
+def _has_personal_links(html_text, emailing, placeholder):
+    """True if a link depends on the contact: it can not be a magic link shared by all contacts"""
+    ignore_links = get_emailing_ignored_links(emailing, placeholder.contact)
+    for link in HREF_REGEX.findall(html_text):
+        if link not in ignore_links and any(token in link for token in placeholder.slots):
+            return True
+    return False
+
+
+def build_email_skeleton(emailing, contact, lang):
+    """
+    returns the EmailSkeleton shared by all the contacts with the same skeleton key than this contact
+    None if the newsletter can not be rendered once: the template compares or transforms the values of the contact
+    The long lines are not cut: the values of the contacts don't have the length of the tokens
+    """
+    placeholder = PlaceholderContact(contact)
+    subject, html_text = _render_contact_html(emailing, placeholder.contact, lang)
+
+    # Render again with other tokens: the skeleton is valid if the tokens are the only differences
+    probe = PlaceholderContact(contact)
+    probe_email = _render_contact_html(emailing, probe.contact, lang)
+    email_check = (
+        Skeleton(subject, placeholder.slots).fill(probe.values),
+        Skeleton(html_text, placeholder.slots).fill(probe.values),
+    )
+    if placeholder.used_fields or email_check != probe_email or _has_personal_links(html_text, emailing, placeholder):
+        return None
+
+    subject, html_text, text = _finalize_email(emailing, placeholder.contact, subject, html_text)
+    return EmailSkeleton(subject, html_text, text, placeholder.slots)
+
+
+def _build_contact_email(emailing, contact, skeletons, from_email):
+    """returns the email of a contact. skeletons is the cache of the skeletons of the emailing"""
+    lang = emailing.lang or contact.favorite_language or settings.LANGUAGE_CODE[:2]
+    translation.activate(lang)
+
+    skeleton_key = (lang, get_skeleton_key(contact))
+    if skeleton_key not in skeletons:
+        skeletons[skeleton_key] = build_email_skeleton(emailing, contact, lang)
+    skeleton = skeletons[skeleton_key]
+
+    if skeleton:
+        subject, html_text, text = _cut_long_lines(*skeleton.render(contact))
+    else:
+        subject, html_text, text = render_contact_email(emailing, contact, lang)
+
+    list_unsubscribe_url = emailing.get_domain_url_prefix() + reverse(
+        "newsletters:unregister", args=[emailing.id, contact.uuid]
+    )
+    list_unsubscribe_email = getattr(settings, 'COOP_CMS_REPLY_TO', '') or from_email
+    headers = {
+        "List-Unsubscribe": "<{0}>, <mailto:{1}?subject=unsubscribe>".format(
+            list_unsubscribe_url, list_unsubscribe_email
+        )
+    }
+
+    if getattr(settings, 'COOP_CMS_REPLY_TO', None):
+        headers['Reply-To'] = settings.COOP_CMS_REPLY_TO
+
+    email = EmailMultiAlternatives(
+        subject,
+        text,
+        from_email,
+        [contact.email],
+        headers=headers
+    )
+    email.attach_alternative(html_text, "text/html")
+    return email
+
+
+def claim_contacts(emailing, after_id, nb):
+    """
+    returns the next nb contacts of send_to, by increasing id. Must be called in a transaction
+    Their send_to rows are locked until the end of the transaction: the contacts being sent by another worker are
+    skipped (databases without select_for_update like sqlite don't lock)
+    """
+    send_to_model = Emailing.send_to.through
+    contact_ids = list(
+        send_to_model.objects.select_for_update(skip_locked=True).filter(
+            emailing_id=emailing.id, contact_id__gt=after_id
+        ).order_by('contact_id').values_list('contact_id', flat=True)[:nb]
+    )
+    return list(Contact.objects.filter(id__in=contact_ids).order_by('id'))
+
+
+def _iter_contact_emails(emailing, contacts, skeletons, from_email):
+    """yields the (contact id, email) of the contacts. Wait for the rate limit of the from_email domain"""
+    rate_limiter = get_rate_limiter(from_email)
+    for contact in contacts:
+        if contact.email:
+            if rate_limiter:
+                rate_limiter.acquire()
+            yield contact.id, _build_contact_email(emailing, contact, skeletons, from_email)
 
 
 def send_newsletter(emailing, max_nb):
-    """send newsletter"""
+    """
+    send newsletter to at most max_nb contacts of send_to
+    The newsletter is rendered once by language and kind of contact (see skeletons) rather than for every contact
+    The contacts are locked, sent and marked as sent by chunks: the memory doesn't grow with max_nb and several
+    workers can send the same emailing. Every chunk is a checkpoint: after a crash, only the contacts of the
+    current chunk may be sent again. The rows of a chunk stay locked during the SMTP sends and the rate limit
+    waits: see COOP_CMS_NEWSLETTER_SEND_CHUNK_SIZE
+    """
 
     # Clean the urls
     emailing.newsletter.content = make_links_absolute(
         emailing.newsletter.content, emailing.newsletter, site_prefix=emailing.get_domain_url_prefix()
     )
     
-    connection = get_connection()
     from_email = emailing.subscription_type.from_email or settings.COOP_CMS_FROM_EMAIL
-    emails = []
-    
-    contacts = list(emailing.send_to.all()[:max_nb])
-    for contact in contacts:
-        
-        if contact.email:
-            lang = emailing.lang or contact.favorite_language or settings.LANGUAGE_CODE[:2]
-            translation.activate(lang)
-
-            emailing_context = get_emailing_context(emailing, contact)
-            emailing_context["LANGUAGE_CODE"] = lang
-            context = emailing_context
-            the_template = get_template(emailing.newsletter.get_template_name())
-
-            html_text = the_template.render(context)
-
-            html_text = patch_emailing_html(html_text, emailing, contact)
-
-            html_text = make_links_absolute(
-                html_text, emailing.newsletter, site_prefix=emailing.get_domain_url_prefix()
-            )
-            
-            text = dehtml(html_text)
-            list_unsubscribe_url = emailing.get_domain_url_prefix() + reverse(
-                "newsletters:unregister", args=[emailing.id, contact.uuid]
-            )
-            list_unsubscribe_email = getattr(settings, 'COOP_CMS_REPLY_TO', '') or from_email
-            headers = {
-                "List-Unsubscribe": "<{0}>, <mailto:{1}?subject=unsubscribe>".format(
-                    list_unsubscribe_url, list_unsubscribe_email
+    chunk_size = get_send_chunk_size()
+    skeletons = {}
+    nb_processed = 0
+    nb_sent = 0
+    last_id = 0
+
+    with DeliveryPool() as pool:
+        while nb_processed < max_nb:
+            with transaction.atomic():
+                contacts = claim_contacts(emailing, last_id, min(chunk_size, max_nb - nb_processed))
+                if not contacts:
+                    break
+                # The contacts without email are marked as sent: nothing to do for them
+                processed_contact_ids = [contact.id for contact in contacts if not contact.email]
+                # The emails are built while the previous ones are sent
+                sent_contact_ids, failed_contact_ids = pool.deliver(
+                    _iter_contact_emails(emailing, contacts, skeletons, from_email)
                 )
-            }
-
-            if getattr(settings, 'COOP_CMS_REPLY_TO', None):
-                headers['Reply-To'] = settings.COOP_CMS_REPLY_TO
-
-            email = EmailMultiAlternatives(
-                context['title'],
-                force_line_max_length(text),
-                from_email,
-                [contact.email],
-                headers=headers
-            )
-            html_text = force_line_max_length(html_text, max_length_per_line=400, dont_cut_in_quotes=True)
-            email.attach_alternative(html_text, "text/html")
-            emails.append(email)
-
-        # print contact, "processed"
-        emailing.send_to.remove(contact)
-        emailing.sent_to.add(contact)
-    
-    emailing.save()
-    nb_sent = connection.send_messages(emails)
-    return nb_sent or 0
+                # A permanent refusal is handled like a hard bounce: the email would never be sent. Only the
+                # contacts whose email had a transient failure are kept in send_to to be sent again later
+                emailing.mark_as_sent(processed_contact_ids + sent_contact_ids + failed_contact_ids)
+            last_id = contacts[-1].id
+            nb_processed += len(contacts)
+            nb_sent += len(sent_contact_ids)
+
+    return nb_sent
 
 
 def on_bounce(event_type, email, description, permanent, contact_uuid, emailing_id):
@@ -226,31 +371,36 @@ def get_language():
 
 
 def force_line_max_length(text, max_length_per_line=400, dont_cut_in_quotes=True):
-    """returns same text with end of lines inserted if lien length is greater than 400 chars"""
-    out_text = ""
+    """
+    returns same text with end of lines inserted if lien length is greater than 400 chars
+    The words of a cut line are separated by one space. If dont_cut_in_quotes is False, a line is not cut after an
+    odd number of double quotes. Linear time: the cuts are searched with str.find and the lines kept in a list
+    """
+    out_lines = []
     for line in text.split("\n"):
 
         if len(line) < max_length_per_line:
-            out_text += line + "\n"
-        else:
-            words = []
-            line_length = 0
-            quotes_count = 0
-            for word in line.split(" "):
-                if word:
-                    words.append(word)
-                    quotes_count += word.count('"')
-                    line_length += len(word) + 1
-                    in_quotes = (quotes_count % 2) == 1  # If there are not an even number we may be inside a ""
-                    if line_length > max_length_per_line:
-                        if not (not dont_cut_in_quotes and in_quotes):
-                            # Line is more than allowed length for a line. Enter a end line character
-                            out_line = " ".join(words)
-                            out_text += out_line + "\n"
-                            words = []
-                            line_length = 0
-            if words:
-                out_line = " ".join(words)
-                out_text += out_line + "\n"
-
-    return out_text[:-1]  # Remove the last "\n"
+            out_lines.append(line)
+            continue
+
+        words_line = " ".join(word for word in line.split(" ") if word)
+        start = 0
+        quotes_count = 0
+        quotes_counted_pos = 0
+        # A line is cut after the first word ending max_length_per_line characters after its start
+        cut_pos = words_line.find(" ", max_length_per_line)
+        while cut_pos >= 0:
+            if not dont_cut_in_quotes:
+                quotes_count += words_line.count('"', quotes_counted_pos, cut_pos)
+                quotes_counted_pos = cut_pos
+                if quotes_count % 2:
+                    # We may be inside a "": try after the next word
+                    cut_pos = words_line.find(" ", cut_pos + 1)
+                    continue
+            out_lines.append(words_line[start:cut_pos])
+            start = cut_pos + 1
+            cut_pos = words_line.find(" ", start + max_length_per_line)
+        if start < len(words_line):
+            out_lines.append(words_line[start:])
+
+    return "\n".join(out_lines)
@@ -4,19 +4,35 @@
 import datetime
 import os.path
 
+from asgiref.sync import sync_to_async
+
+from django.db import transaction
 from django.urls import reverse
 from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django.shortcuts import render, get_object_or_404
 from django.template.loader import get_template
 
 from ...utils import redirect_to_language
-from wsgiref.util import FileWrapper
 
 from . import models
 from . import forms
 from .utils import get_emailing_context, patch_emailing_html
 
 
+TRACKING_IMAGE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files/email-tracking.png")
+
+
+def _tracking_image_response():
+    """response with the tracking image: the file is read only once"""
+    if not hasattr(_tracking_image_response, '_cache_content'):
+        with open(TRACKING_IMAGE_FILE, 'rb') as image_file:
+            setattr(_tracking_image_response, '_cache_content', image_file.read())
+    content = getattr(_tracking_image_response, '_cache_content')
+    response = HttpResponse(content, content_type='image/png')
+    response['Content-Length'] = len(content)
+    return response
+
+
 def view_link(request, link_uuid, contact_uuid):
     """view magic link"""
     link = get_object_or_404(models.MagicLink, uuid=link_uuid)
@@ -96,15 +112,19 @@ def unregister_contact(request, emailing_id, contact_uuid):
     )
 
 
+def _render_emailing_online(emailing, contact):
+    """render an emailing for a contact"""
+    context = get_emailing_context(emailing, contact)
+    the_template = get_template(emailing.newsletter.get_template_name())
+    html_text = the_template.render(context)
+    return patch_emailing_html(html_text, emailing, contact)
+
+
 def view_emailing_online(request, emailing_id, contact_uuid):
     """view an emailing online"""
     contact = get_object_or_404(models.Contact, uuid=contact_uuid)
     emailing = get_object_or_404(models.Emailing, id=emailing_id)
-    context = get_emailing_context(emailing, contact)
-    the_template = get_template(emailing.newsletter.get_template_name())
-    html_text = the_template.render(context)
-    html_text = patch_emailing_html(html_text, emailing, contact)
-    return HttpResponse(html_text)
+    return HttpResponse(_render_emailing_online(emailing, contact))
 
 
 def view_emailing_online_lang(request, emailing_id, contact_uuid, lang):
@@ -121,8 +141,47 @@ def email_tracking(request, emailing_id, contact_uuid):
     emailing.opened_emails.add(contact)
     emailing.save()
 
-    dir_name = os.path.dirname(os.path.abspath(__file__))
-    file_name = os.path.join(dir_name, "files/email-tracking.png")
-    response = HttpResponse(FileWrapper(open(file_name, 'rb')), content_type='image/png')
-    response['Content-Length'] = os.path.getsize(file_name)
-    return response
+    return _tracking_image_response()
+
+
+async def _aget_object_or_404(queryset, **kwargs):
+    """async version of get_object_or_404"""
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404
+
+
+@transaction.non_atomic_requests
+async def async_view_link(request, link_uuid, contact_uuid):
+    """view magic link: async version"""
+    link = await _aget_object_or_404(models.MagicLink.objects, uuid=link_uuid)
+    try:
+        user = await models.Contact.objects.aget(uuid=contact_uuid)
+        await link.visitors.aadd(user)
+    except models.Contact.DoesNotExist:
+        pass
+    return HttpResponseRedirect(link.url)
+
+
+@transaction.non_atomic_requests
+async def async_view_emailing_online(request, emailing_id, contact_uuid):
+    """view an emailing online: async version"""
+    contact = await _aget_object_or_404(models.Contact.objects, uuid=contact_uuid)
+    emailing = await _aget_object_or_404(
+        models.Emailing.objects.select_related('newsletter', 'subscription_type'), id=emailing_id
+    )
+    html_text = await sync_to_async(_render_emailing_online)(emailing, contact)
+    return HttpResponse(html_text)
+
+
+@transaction.non_atomic_requests
+async def async_email_tracking(request, emailing_id, contact_uuid):
+    """handle download of email opening tracking image: async version"""
+    emailing = await _aget_object_or_404(models.Emailing.objects, id=emailing_id)
+    contact = await _aget_object_or_404(models.Contact.objects, uuid=contact_uuid)
+
+    await emailing.opened_emails.aadd(contact)
+    await emailing.asave()
+
+    return _tracking_image_response()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Batch import of articles
+
+Creating articles one by one with objects.create is slow: every save probes the slug, saves twice for adding the
+site, creates navigation and newsletter items through signals. The functions below load articles by chunks with
+bulk_create. The post_save signal is not sent for imported articles.
+"""
+
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.db import transaction
+
+from .models import InvalidArticleError, NewsletterItem
+from .settings import get_article_class, get_bulk_import_chunk_size, get_newsletter_item_classes, is_localized
+from .utils import dehtml, slugify
+
+
+SLUG_MAX_LENGTH = 100
+
+
+def _get_slug_fields():
+    """returns the list of the db fields for article slug"""
+    if is_localized():
+        from modeltranslation.utils import build_localized_fieldname  # pylint: disable=F0401
+        return [build_localized_fieldname('slug', lang_code) for (lang_code, lang_name) in settings.LANGUAGES]
+    return ['slug']
+
+
+def get_existing_slugs():
+    """returns the set of slugs already used by an article: in any language"""
+    article_class = get_article_class()
+    existing_slugs = set()
+    for slug_field in _get_slug_fields():
+        existing_slugs.update(
+            article_class.objects.exclude(**{slug_field + '__isnull': True}).values_list(slug_field, flat=True)
+        )
+    return existing_slugs
+
+
+def make_unique_slug(title, existing_slugs, lang=None):
+    """
+    returns a slug which is not in existing_slugs and register it in the set
+    It is the same algorithm than BaseArticle.get_unique_slug without any db query
+    """
+    slug = slugify(dehtml(title), lang)
+    next_suffix, origin_slug = 2, slug
+    while slug in existing_slugs:
+        next_suffix_len = len(str(next_suffix))
+        safe_slug = origin_slug[:(SLUG_MAX_LENGTH - next_suffix_len)]
+        slug = "{0}{1}".format(safe_slug, next_suffix)
+        next_suffix += 1
+    existing_slugs.add(slug)
+    return slug
+
+
+def _set_article_slugs(article, existing_slugs):
+    """set the slugs of a new article: same rules than BaseArticle.save"""
+    if (not article.title) and (not article.slug):
+        raise InvalidArticleError("coop_cms.Article: slug can not be empty")
+
+    if is_localized():
+        from modeltranslation.utils import build_localized_fieldname  # pylint: disable=F0401
+        for lang_code in [lang[0] for lang in settings.LANGUAGES]:
+            locale_title = getattr(article, build_localized_fieldname('title', lang_code), '')
+            loc_slug_var = build_localized_fieldname('slug', lang_code)
+            locale_slug = getattr(article, loc_slug_var, '')
+            if locale_title and not locale_slug:
+                setattr(article, loc_slug_var, make_unique_slug(locale_title, existing_slugs, lang_code))
+            elif locale_slug:
+                existing_slugs.add(locale_slug)
+    else:
+        if not article.slug:
+            article.slug = make_unique_slug(article.title, existing_slugs)
+        else:
+            existing_slugs.add(article.slug)
+
+
+def _get_article_slug(article):
+    """returns the (slug field, slug) of the first language with a slug: the slugs are unique in all languages"""
+    for slug_field in _get_slug_fields():
+        slug = getattr(article, slug_field, None)
+        if slug:
+            return slug_field, slug
+    raise InvalidArticleError("coop_cms.Article: slug can not be empty")
+
+
+def _set_article_ids(article_class, articles):
+    """The db backend doesn't return the primary keys (MySQL): get them from the slugs"""
+    article_slugs = [_get_article_slug(article) for article in articles]
+    ids_by_slug = {}
+    for slug_field in _get_slug_fields():
+        slugs = [slug for (field, slug) in article_slugs if field == slug_field]
+        if slugs:
+            ids_by_slug.update(
+                ((slug_field, slug), article_id)
+                for (slug, article_id) in article_class.objects.filter(
+                    **{slug_field + '__in': slugs}
+                ).values_list(slug_field, 'id')
+            )
+    for article, article_slug in zip(articles, article_slugs):
+        article.id = ids_by_slug[article_slug]
+
+
+def _import_chunk(article_class, articles, sites, newsletter_content_type):
+    """Insert a list of unsaved articles and their relations"""
+    with transaction.atomic():
+        article_class.objects.bulk_create(articles)
+
+        if any(article.id is None for article in articles):
+            _set_article_ids(article_class, articles)
+
+        sites_field = article_class._meta.get_field('sites')
+        through_class = sites_field.remote_field.through
+        article_column = sites_field.m2m_field_name() + '_id'
+        site_column = sites_field.m2m_reverse_field_name() + '_id'
+        through_class.objects.bulk_create([
+            through_class(**{article_column: article.id, site_column: site.id})
+            for article in articles for site in sites
+        ])
+
+        if newsletter_content_type:
+            NewsletterItem.objects.bulk_create(
+                [
+                    NewsletterItem(content_type=newsletter_content_type, object_id=article.id)
+                    for article in articles if getattr(article, 'in_newsletter', True)
+                ],
+                ignore_conflicts=True
+            )
+
+
+def import_articles(rows, chunk_size=None, sites=None):
+    """
+    Create articles from an iterable of dict of field values
+    rows : the articles data. It can be a generator: it is consumed chunk by chunk
+    chunk_size : the number of articles inserted by transaction
+    sites : the sites of the articles. By default, the current site
+    returns the number of articles created
+    """
+    article_class = get_article_class()
+    chunk_size = chunk_size or get_bulk_import_chunk_size()
+    if sites is None:
+        sites = [Site.objects.get_current()]
+
+    newsletter_content_type = None
+    if article_class in get_newsletter_item_classes():
+        newsletter_content_type = ContentType.objects.get_for_model(article_class)
+
+    existing_slugs = get_existing_slugs()
+    rows_iterator = iter(rows)
+    nb_created = 0
+    while True:
+        chunk = list(islice(rows_iterator, chunk_size))
+        if not chunk:
+            break
+        articles = []
+        for row in chunk:
+            article = article_class(**row)
+            _set_article_slugs(article, existing_slugs)
+            articles.append(article)
+        _import_chunk(article_class, articles, sites, newsletter_content_type)
+        nb_created += len(articles)
+    return nb_created
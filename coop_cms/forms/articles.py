@@ -3,7 +3,6 @@
 
 from django import forms
 from django.conf import settings
-from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.utils.translation import gettext as _
@@ -12,10 +11,11 @@ from ..models import BaseArticle
 from ..settings import (
     get_article_class, get_article_templates, is_localized, can_rewrite_url, is_multi_site
 )
-from ..utils import dehtml
+from ..utils import dehtml, get_current_site
 from ..widgets import ImageEdit, ReadOnlyInput
 
 from .base import InlineHtmlEditableModelForm
+from .fields import UploadedImageField
 from .navigation import WithNavigationModelForm
 
 
@@ -128,7 +128,7 @@ class ArticleTemplateForm(forms.Form):
 
 class ArticleLogoForm(forms.Form):
     """article logo form"""
-    image = forms.ImageField(required=True, label=_('Logo'),)
+    image = UploadedImageField(required=True, label=_('Logo'),)
 
 
 class ArticleSettingsForm(WithNavigationModelForm):
@@ -202,12 +202,12 @@ class NewArticleForm(WithNavigationModelForm):
     def get_initials(self, field_name):
         """return the initial values"""
         if field_name == 'sites':
-            return [Site.objects.get_current()]
+            return [get_current_site()]
 
     def clean_site(self):
         """check that the current site is selected"""
         sites = self.cleaned_data['sites']
-        if Site.objects.get_current() not in sites:
+        if get_current_site() not in sites:
             raise ValidationError(_("It is recommended to keep the current site."))
         return sites
 
@@ -12,7 +12,7 @@ import floppyforms as floppyforms
 from ..models import Alias, Link, Document, MediaFilter, ImageSize
 from ..widgets import ChosenSelectMultiple
 
-from .fields import HidableMultipleChoiceField
+from .fields import FloppyUploadedImageField, HidableMultipleChoiceField
 from .navigation import WithNavigationModelForm
 
 
@@ -43,7 +43,7 @@ class MediaBaseAddMixin(object):
 class AddImageForm(MediaBaseAddMixin, floppyforms.Form):
     """Form for adding new image"""
 
-    image = floppyforms.ImageField(required=True, label=_('Image'),)
+    image = FloppyUploadedImageField(required=True, label=_('Image'),)
     descr = floppyforms.CharField(
         required=False,
         widget=floppyforms.TextInput(
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 """forms"""
 
+from django import forms
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
+
 import floppyforms as floppyforms
 
+from ..settings import get_max_uploaded_image_pixels, get_max_uploaded_image_size
+from ..utils.images import IMAGE_ERRORS, downscale_image, get_image_info
+
 
 class HidableMultipleChoiceField(floppyforms.MultipleChoiceField):
     """
@@ -10,3 +17,48 @@ class HidableMultipleChoiceField(floppyforms.MultipleChoiceField):
     Overload this field to restore an <input type="hidden">
     """
     hidden_widget = floppyforms.HiddenInput
+
+
+class UploadedImageFieldMixin(object):
+    """
+    The ImageField of Django reads the uploaded file in memory in order to verify it.
+    This field only reads the header of the image for checking its format and its dimensions.
+    An image larger than COOP_CMS_MAX_UPLOADED_IMAGE_SIZE is downscaled
+    """
+    default_error_messages = {
+        'image_too_large': _("The image is too large: {0}x{1} pixels"),
+    }
+
+    def to_python(self, data):
+        """validation"""
+        uploaded_file = forms.FileField.to_python(self, data)
+        if uploaded_file is None:
+            return None
+
+        try:
+            width, height, image_format = get_image_info(uploaded_file)
+        except IMAGE_ERRORS as exc:
+            # Pillow doesn't recognize it as an image or the image is a decompression bomb
+            raise ValidationError(self.error_messages['invalid_image'], code='invalid_image') from exc
+
+        max_pixels = get_max_uploaded_image_pixels()
+        if max_pixels and width * height > max_pixels:
+            raise ValidationError(
+                self.error_messages['image_too_large'].format(width, height), code='image_too_large'
+            )
+
+        try:
+            return downscale_image(uploaded_file, get_max_uploaded_image_size())
+        except IMAGE_ERRORS as exc:
+            # The header is valid but the image data is corrupted
+            raise ValidationError(self.error_messages['invalid_image'], code='invalid_image') from exc
+
+
+class UploadedImageField(UploadedImageFieldMixin, forms.ImageField):
+    """image field: see UploadedImageFieldMixin"""
+    pass
+
+
+class FloppyUploadedImageField(UploadedImageFieldMixin, floppyforms.ImageField):
+    """floppyforms image field: see UploadedImageFieldMixin"""
+    pass
@@ -4,7 +4,6 @@
 from django import forms
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
 from django.utils.timezone import now as dt_now
 from django.utils.translation import gettext as _, gettext_lazy
@@ -14,6 +13,7 @@ import floppyforms as floppyforms
 from ..bs_forms import Form as BsForm
 from ..models import Newsletter, NewsletterSending, NewsletterItem
 from ..settings import get_article_class, get_newsletter_templates
+from ..utils import get_current_site
 from ..widgets import ChosenSelectMultiple
 
 from .base import InlineHtmlEditableModelForm
@@ -63,7 +63,7 @@ class NewsletterSettingsForm(forms.ModelForm):
         self.fields["items"].widget.attrs["class"] = "chosen-select"
         choices = list(self.fields['items'].choices)
         sites_choices = []
-        current_site = Site.objects.get_current()
+        current_site = get_current_site()
         for choice in choices:
             obj_id = choice[0].value
             obj = NewsletterItem.objects.get(id=obj_id)
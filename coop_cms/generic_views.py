@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 """generic views"""
 
+from asgiref.sync import sync_to_async
+
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.messages.api import success as success_message, error as error_message
 from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
+from django.db import connections, transaction
 from django.forms.models import modelformset_factory
 from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
@@ -142,9 +145,11 @@ class EditableObjectView(View):
         cache_key = '{0}-{1}-{2}-{3}'.format(settings.SITE_ID, language, class_name, obj.id)
         return cache_key
 
-    def get(self, request, *args, **kwargs):
-        """handle http get -> view"""
-
+    def prepare_object(self):
+        """
+        get the object and check perms
+        returns a response if the object is not found and handle_object_not_found returns it, None if ok
+        """
         try:
             self.object = self.get_object()
         except Http404:
@@ -156,24 +161,36 @@ class EditableObjectView(View):
 
         if not self.can_access_object():
             raise Http404
-        
+
         if not self.can_view_object():
             # logger.warning("PermissionDenied")
             raise PermissionDenied
 
-        if self.can_cache():
-            response_content = cache.get(self.get_cache_key(self.object))
-            if response_content:
-                return HttpResponse(response_content)
-        
+        return None
+
+    def render_object(self, request):
+        """render the object"""
         self.form = self.get_form(instance=self.object)
-        
-        response = render(
+
+        return render(
             request,
             self.get_template(),
             self.get_context_data()
         )
 
+    def get(self, request, *args, **kwargs):
+        """handle http get -> view"""
+        response = self.prepare_object()
+        if response:
+            return response
+
+        if self.can_cache():
+            response_content = cache.get(self.get_cache_key(self.object))
+            if response_content:
+                return HttpResponse(response_content)
+
+        response = self.render_object(request)
+
         if response.status_code == 200 and self.can_cache():
             cache.set(self.get_cache_key(self.object), response.content)
 
@@ -229,6 +246,57 @@ class EditableObjectView(View):
         )
 
 
+class AsyncEditableObjectView(EditableObjectView):
+    """
+    Async version of EditableObjectView: for ASGI servers
+    The cache is accessed with the async cache API. The object lookup, the perms checks and the template rendering
+    use the sync ORM: they are executed in a thread.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        """an async view can not run in the transaction of ATOMIC_REQUESTS"""
+        return transaction.non_atomic_requests(super(AsyncEditableObjectView, cls).as_view(**initkwargs))
+
+    def _prepare_cached_object(self):
+        """get the object, check perms and returns (response, cache key)"""
+        response = self.prepare_object()
+        if response:
+            return response, None
+        cache_key = self.get_cache_key(self.object) if self.can_cache() else None
+        return None, cache_key
+
+    async def get(self, request, *args, **kwargs):
+        """handle http get -> view"""
+        response, cache_key = await sync_to_async(self._prepare_cached_object)()
+        if response:
+            return response
+
+        if cache_key:
+            response_content = await cache.aget(cache_key)
+            if response_content:
+                return HttpResponse(response_content)
+
+        response = await sync_to_async(self.render_object)(request)
+
+        if response.status_code == 200 and cache_key:
+            await cache.aset(cache_key, response.content)
+
+        return response
+
+    def _atomic_post(self, request, *args, **kwargs):
+        """the edit runs in the transaction of ATOMIC_REQUESTS like in the sync view: only the get skips it"""
+        post = super(AsyncEditableObjectView, self).post
+        for alias, settings_dict in connections.settings.items():
+            if settings_dict['ATOMIC_REQUESTS']:
+                post = transaction.atomic(using=alias)(post)
+        return post(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        """handle http post -> edit"""
+        return await sync_to_async(self._atomic_post)(request, *args, **kwargs)
+
+
 class EditableFormsetView(TemplateView):
     """Base class for editing several objects on the same page"""
     template_name = ""
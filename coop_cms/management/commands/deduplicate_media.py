@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""media with the same content share the same file"""
+
+import os.path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.db.models import Q
+from django.utils.encoding import filepath_to_uri
+
+from ...models import Document, Fragment, Image, Newsletter, PieceOfHtml
+from ...settings import get_article_class
+from ...utils import get_file_hash
+
+
+# The html fields which may embed the url of a media file: also their localized versions (content_fr...)
+HTML_FIELDS = ('content', 'summary')
+
+
+def _is_file_in_html(file_name):
+    """True if the file name or its url is in the html of an article, a newsletter, a piece of html or a fragment"""
+    names = set([file_name, filepath_to_uri(file_name)])
+    for model_class in (get_article_class(), Newsletter, PieceOfHtml, Fragment):
+        lookup = Q()
+        for field in model_class._meta.get_fields():
+            if isinstance(field, models.TextField) and field.name.split('_')[0] in HTML_FIELDS:
+                for name in names:
+                    lookup |= Q(**{field.name + '__contains': name})
+        if lookup and model_class.objects.filter(lookup).exists():
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    """deduplicate media"""
+    help = "compute the content hash of the media and make media with the same content share the same file"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete-files', dest='delete_files', action='store_true',
+            help='delete the duplicated files which are not used anymore. A file whose name is in the html of an '
+            'article, a newsletter, a piece of html or a fragment is kept. Other html (templates, external sites, '
+            'emails already sent) may still link to the deleted files: make a backup of the media first'
+        )
+        parser.add_argument('--dry-run', dest='dry_run', action='store_true')
+        parser.add_argument(
+            '--noinput', '--no-input', action='store_false', dest='interactive',
+            help='do not ask for the confirmation of --delete-files'
+        )
+
+    def _update_hashes(self, media_class, verbose):
+        """compute the missing content hashes"""
+        for media in media_class.objects.filter(content_hash='').only('id', 'file').iterator():
+            try:
+                content_hash = get_file_hash(media.file)
+            except (IOError, ValueError):
+                if verbose:
+                    print("Can not read", media.file.name)
+                continue
+            finally:
+                media.file.close()
+            media_class.objects.filter(id=media.id).update(content_hash=content_hash)
+
+    def _deduplicate(self, media_class, delete_files, dry_run, verbose):
+        """the media with same hash in the same folder use the file of the oldest one"""
+        queryset = media_class.objects.exclude(content_hash='').order_by('content_hash', 'id')
+        shared_files = {}
+        duplicated_files = set()
+        nb_updated = 0
+        for media_id, content_hash, file_name in queryset.values_list('id', 'content_hash', 'file').iterator():
+            key = (content_hash, os.path.dirname(file_name))
+            shared_file_name = shared_files.setdefault(key, file_name)
+            if shared_file_name != file_name:
+                nb_updated += 1
+                duplicated_files.add(file_name)
+                if not dry_run:
+                    media_class.objects.filter(id=media_id).update(file=shared_file_name)
+
+        nb_deleted = 0
+        if delete_files and not dry_run:
+            storage = media_class._meta.get_field('file').storage
+            for file_name in duplicated_files:
+                if media_class.objects.filter(file=file_name).exists() or _is_file_in_html(file_name):
+                    if verbose > 1:
+                        print("Keep", file_name, ": still used")
+                    continue
+                if storage.exists(file_name):
+                    storage.delete(file_name)
+                    nb_deleted += 1
+
+        if verbose:
+            print(
+                media_class._meta.verbose_name_plural, ":", nb_updated, "media updated,", nb_deleted, "files deleted"
+            )
+
+    def handle(self, *args, **options):
+        """command"""
+        verbose = options.get('verbosity', 1)
+        if options.get('delete_files') and not options.get('dry_run') and options.get('interactive', True):
+            answer = input(
+                "The duplicated files will be deleted: some html which is not in the database may still link to "
+                "them. Type 'yes' to continue: "
+            )
+            if answer != 'yes':
+                raise CommandError("deduplicate_media cancelled")
+        for media_class in (Image, Document):
+            self._update_hashes(media_class, verbose)
+            self._deduplicate(media_class, options.get('delete_files'), options.get('dry_run'), verbose)
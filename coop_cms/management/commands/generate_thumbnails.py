@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""generate the thumbnails queued in background"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...thumbnails import process_thumbnail_jobs
+
+
+class Command(BaseCommand):
+    """generate thumbnails"""
+    help = "generate the queued thumbnails: can be called by a cron or run as a worker with --loop"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', dest='processes', type=int, default=1)
+        parser.add_argument('--limit', dest='limit', type=int, default=None, help='max number of jobs by batch')
+        parser.add_argument(
+            '--loop', dest='loop', type=int, default=0, help='wait N seconds and process the queue again'
+        )
+
+    def handle(self, *args, **options):
+        """command"""
+        verbose = options.get('verbosity', 1)
+        processes = max(options.get('processes') or 1, 1)
+        limit = options.get('limit')
+        loop = options.get('loop')
+
+        while True:
+            nb_jobs, nb_failures = process_thumbnail_jobs(limit=limit, processes=processes)
+            if verbose and nb_jobs:
+                print(nb_jobs, "thumbnail jobs processed", "({0} failures)".format(nb_failures) if nb_failures else "")
+            if not loop:
+                break
+            if not nb_jobs:
+                time.sleep(loop)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""import articles from a json or csv file"""
+
+import csv
+import json
+import sys
+
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+
+from ...bulk_import import import_articles
+
+
+def read_json_rows(stream):
+    """
+    iterate on articles of a json stream
+    It can be a json list of objects or one json object per line (json lines): the latter is not fully loaded
+    """
+    first_char = stream.read(1)
+    while first_char and first_char.isspace():
+        first_char = stream.read(1)
+    if first_char == '[':
+        for row in json.loads(first_char + stream.read()):
+            yield row
+    else:
+        first_line = first_char + stream.readline()
+        if first_line.strip():
+            yield json.loads(first_line)
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_csv_rows(stream):
+    """iterate on articles of a csv stream: the first line contains the field names"""
+    for row in csv.DictReader(stream):
+        yield dict((key, value) for (key, value) in row.items() if value != '')
+
+
+class Command(BaseCommand):
+    """import articles"""
+    help = "import articles from a json or csv file (use - for stdin)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename')
+        parser.add_argument('--format', dest='file_format', choices=('json', 'csv'), default=None)
+        parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=None)
+        parser.add_argument('--site', dest='site_ids', type=int, action='append', default=None)
+
+    def handle(self, filename, *args, **options):
+        """command"""
+        verbose = options.get('verbosity', 1)
+        file_format = options.get('file_format')
+        if not file_format:
+            file_format = 'csv' if filename.lower().endswith('.csv') else 'json'
+
+        sites = None
+        site_ids = options.get('site_ids')
+        if site_ids:
+            sites = list(Site.objects.filter(id__in=site_ids))
+            if len(sites) != len(set(site_ids)):
+                raise CommandError("Unknown site in {0}".format(site_ids))
+
+        if filename == '-':
+            stream = sys.stdin
+        else:
+            try:
+                stream = open(filename, 'r', newline='' if file_format == 'csv' else None)
+            except IOError:
+                raise CommandError("{0} doesn't exist".format(filename))
+
+        try:
+            rows = read_csv_rows(stream) if file_format == 'csv' else read_json_rows(stream)
+            nb_created = import_articles(rows, chunk_size=options.get('chunk_size'), sites=sites)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if verbose:
+            print(nb_created, "articles created")
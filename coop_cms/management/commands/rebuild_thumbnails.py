@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""create again the thumbnails of the images and of the article logos"""
+
+from datetime import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ...models import ImageSize
+from ...thumbnails import (
+    THUMBNAIL_CREATED, THUMBNAIL_FAILED, THUMBNAIL_UP_TO_DATE, get_rebuild_jobs, rebuild_thumbnails
+)
+
+
+class Command(BaseCommand):
+    """rebuild thumbnails"""
+    help = "create the thumbnails of the images and article logos which are missing or older than their image"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', dest='processes', type=int, default=1)
+        parser.add_argument(
+            '--only-size', dest='only_size', default='', help='only this geometry (ex: 128x128) or this image size name'
+        )
+        parser.add_argument(
+            '--since', dest='since', default='',
+            help='only the images and articles modified since this date: YYYY-MM-DD'
+        )
+
+    def _get_since(self, since):
+        """returns the datetime of the --since option"""
+        if not since:
+            return None
+        try:
+            since = datetime.strptime(since, '%Y-%m-%d')
+        except ValueError:
+            raise CommandError("Invalid date: {0}. Expected format: YYYY-MM-DD".format(since))
+        return timezone.make_aware(since) if settings.USE_TZ else since
+
+    def _get_only_size(self, only_size):
+        """returns the geometry of the --only-size option"""
+        image_size = ImageSize.objects.filter(name=only_size).first() if only_size else None
+        return image_size.size if image_size else only_size
+
+    def handle(self, *args, **options):
+        """command"""
+        verbose = options.get('verbosity', 1)
+        processes = max(options.get('processes') or 1, 1)
+
+        start_time = time.time()
+        jobs_args = get_rebuild_jobs(
+            since=self._get_since(options.get('since')), only_size=self._get_only_size(options.get('only_size'))
+        )
+        results = rebuild_thumbnails(jobs_args, processes=processes)
+        duration = time.time() - start_time
+
+        if verbose:
+            print(
+                results[THUMBNAIL_CREATED], "thumbnails created,",
+                results[THUMBNAIL_UP_TO_DATE], "up to date,",
+                results[THUMBNAIL_FAILED], "failures"
+            )
+            print(
+                "{0} thumbnails in {1:.1f}s: {2:.1f} thumbnails/s".format(
+                    len(jobs_args), duration, len(jobs_args) / duration if duration else 0
+                )
+            )
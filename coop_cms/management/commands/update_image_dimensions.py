@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""store the width, height and format of the images of the media library"""
+
+from django.core.management.base import BaseCommand
+
+from ...models import Image
+
+
+class Command(BaseCommand):
+    """update image dimensions"""
+    help = "store the dimensions of the images uploaded before they were saved in database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', dest='all', action='store_true', help='update also the images already done')
+
+    def handle(self, *args, **options):
+        """command"""
+        verbose = options.get('verbosity', 1)
+
+        images = Image.objects.all()
+        if not options.get('all'):
+            images = images.filter(width__isnull=True)
+
+        nb_updated, nb_errors = 0, 0
+        for image in images.only('id', 'file').iterator():
+            image.update_dimensions()
+            if image.width is None:
+                nb_errors += 1
+                if verbose:
+                    print("Can not read", image.file.name)
+            else:
+                nb_updated += 1
+            Image.objects.filter(id=image.id).update(
+                width=image.width, height=image.height, image_format=image.image_format
+            )
+
+        if verbose:
+            print(nb_updated, "images updated", "({0} errors)".format(nb_errors) if nb_errors else "")
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coop_cms', '0021_newsletter_is_visible'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThumbnailJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, unique=True)),
+                ('file_name', models.CharField(max_length=500)),
+                ('geometry', models.CharField(max_length=100)),
+                ('options', models.TextField(default='{}')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'thumbnail job',
+                'verbose_name_plural': 'thumbnail jobs',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coop_cms', '0022_thumbnailjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='height',
+            field=models.PositiveIntegerField(
+                blank=True, default=None, editable=False, null=True, verbose_name='height'
+            ),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='image_format',
+            field=models.CharField(blank=True, default='', editable=False, max_length=10, verbose_name='format'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='width',
+            field=models.PositiveIntegerField(
+                blank=True, default=None, editable=False, null=True, verbose_name='width'
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coop_cms', '0023_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(
+                blank=True, db_index=True, default='', editable=False, max_length=64, verbose_name='content hash'
+            ),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='content_hash',
+            field=models.CharField(
+                blank=True, db_index=True, default='', editable=False, max_length=64, verbose_name='content hash'
+            ),
+        ),
+    ]
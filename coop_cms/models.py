@@ -13,12 +13,13 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.contrib.staticfiles import finders
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files import File
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
-from django.db.models.aggregates import Max
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.aggregates import Count, Max
+from django.db.models.signals import class_prepared, m2m_changed, pre_delete, post_delete, post_save
 from django.template.loader import get_template
 from django.urls import reverse, NoReverseMatch
 from django.utils.html import escape
@@ -26,21 +27,58 @@ from django.utils.translation import get_language, gettext, gettext_lazy as _
 from django.utils.safestring import mark_safe
 
 from django_extensions.db.models import TimeStampedModel, AutoSlugField
-from sorl.thumbnail import default as sorl_thumbnail, delete as sorl_delete
+from sorl.thumbnail import delete as sorl_delete
 from sorl.thumbnail.parsers import ThumbnailParseError
 
 from .moves import make_context, is_authenticated
 from .optionals import build_localized_fieldname
 from .settings import (
-    get_article_class, get_article_logo_size, get_article_logo_crop, get_article_templates, get_default_logo,
-    get_headline_image_size, get_headline_image_crop, get_img_folder, get_newsletter_item_classes,
-    get_navtree_class, get_max_image_width, is_localized, is_requestprovider_installed, COOP_CMS_NAVTREE_CLASS,
+    generate_thumbnails_in_background, get_article_class, get_article_logo_size, get_article_logo_crop,
+    get_article_templates, get_default_logo, get_headline_image_size, get_headline_image_crop, get_img_folder,
+    get_newsletter_item_classes, get_navtree_class, get_max_image_width, is_cache_enabled, is_localized,
+    is_media_deduplication_enabled, COOP_CMS_NAVTREE_CLASS,
     cms_no_homepage, homepage_no_redirection, has_localized_urls
 )
-from .utils import dehtml, RequestManager, RequestNotFound, get_model_label, make_locale_path, slugify
+from .utils import (
+    dehtml, RequestManager, RequestNotFound, get_current_site, get_file_hash, get_image_info, get_request_context,
+    get_model_label, make_locale_path, slugify
+)
+from .thumbnails import (
+    ADMIN_THUMBS_SIZE, IMAGE_THUMBNAIL_SIZE, clear_default_logo_thumbnails, get_article_logo_geometries,
+    get_default_logo_thumbnail, get_image_geometries, get_thumbnail, queue_thumbnails
+)
+
 
+# default logo files by media file name: see get_default_logo_file
+_default_logo_files = {}
 
-ADMIN_THUMBS_SIZE = '60x60'
+
+def clear_default_logo_cache():
+    """forget the default logo and its thumbnails: if the media folder has been deleted"""
+    _default_logo_files.clear()
+    clear_default_logo_thumbnails()
+
+
+def get_default_logo_file():
+    """
+    returns the default logo of articles
+    It is copied from static to media in order to use sorl thumbnail without raising a suspicious operation.
+    The file system is accessed only the first time
+    """
+    filename = get_default_logo()
+    media_filename = os.path.normpath(settings.MEDIA_ROOT + '/coop_cms/' + filename)
+    logo_file = _default_logo_files.get(media_filename)
+    if logo_file is None:
+        if not os.path.exists(media_filename):
+            file_dir = os.path.dirname(media_filename)
+            if not os.path.exists(file_dir):
+                os.makedirs(file_dir)
+            static_filename = finders.find(filename)
+            shutil.copyfile(static_filename, media_filename)
+        # The file is not opened : sorl thumbnail only needs its name
+        logo_file = File(None, name=media_filename)
+        _default_logo_files[media_filename] = logo_file
+    return logo_file
 
 
 class InvalidArticleError(Exception):
@@ -225,13 +263,13 @@ class NavNode(models.Model):
     
     def is_active_node(self):
         """true if link correspond to the current page"""
-        url = self.get_absolute_url()
-        if url and is_requestprovider_installed():
-            try:
-                http_request = RequestManager().get_request()
-                return http_request and http_request.path == url
-            except RequestNotFound:
-                pass
+        try:
+            http_request = RequestManager().get_request()
+        except RequestNotFound:
+            return False
+        if http_request:
+            url = self.get_absolute_url()
+            return bool(url) and http_request.path == url
         return False
 
     def get_content_name(self):
@@ -513,12 +551,10 @@ class ArticleCategory(models.Model):
     def save(self, *args, **kwargs):
         """save"""
         is_new = not bool(self.id)
-        ret = super(ArticleCategory, self).save(*args, **kwargs)
-        
-        if is_new:
-            site = Site.objects.get(id=settings.SITE_ID)
-            self.sites.add(site)
-            super(ArticleCategory, self).save()
+        with transaction.atomic():
+            ret = super(ArticleCategory, self).save(*args, **kwargs)
+            if is_new:
+                self.sites.add(Site.objects.get_current())
 
         return ret
 
@@ -638,7 +674,7 @@ class BaseArticle(BaseNavigable):
     @property
     def is_homepage(self):
         """True if is the homepage of the current site"""
-        site_settings = SiteSettings.objects.get_or_create(site=Site.objects.get_current())[0]
+        site_settings = SiteSettings.objects.get_or_create(site=get_current_site())[0]
         try:
             if homepage_no_redirection():
                 return site_settings.homepage_article == self.slug
@@ -649,7 +685,7 @@ class BaseArticle(BaseNavigable):
 
     @is_homepage.setter
     def set_is_homepage(self):
-        site_settings = SiteSettings.objects.get_or_create(site=Site.objects.get_current())[0]
+        site_settings = SiteSettings.objects.get_or_create(site=get_current_site())[0]
         if homepage_no_redirection():
             site_settings.homepage_article = self.slug
         else:
@@ -703,15 +739,17 @@ class BaseArticle(BaseNavigable):
                 logo_file = logo.file
             except IOError:
                 pass
-        if not logo_file:
-            logo_file = self._get_default_logo()
         crop = logo_crop or get_article_logo_crop(self)
+        if not logo_file:
+            return self._get_default_logo_thumbnail(size, crop)
 
         try:
-            return sorl_thumbnail.backend.get_thumbnail(logo_file, size, crop=crop)
+            thumbnail = get_thumbnail(logo_file, size, crop=crop)
         except IOError:
             # TODO : In case of error (Pillow 4.2.1 cause "cannot write mode RGBA as JPEG")
             return FileUrlWrapper(logo_file.file)
+        # None if generated in background and not ready yet
+        return thumbnail or FileUrlWrapper(logo_file.file)
 
     def get_headline_image(self):
         """headline image"""
@@ -721,21 +759,19 @@ class BaseArticle(BaseNavigable):
 
     def _get_default_logo(self):
         """default logo"""
-        # copy from static to media in order to use sorl thumbnail without raising a suspicious operation
-        filename = get_default_logo()
-        media_filename = os.path.normpath(settings.MEDIA_ROOT + '/coop_cms/' + filename)
-        if not os.path.exists(media_filename):
-            file_dir = os.path.dirname(media_filename)
-            if not os.path.exists(file_dir):
-                os.makedirs(file_dir)
-            static_filename = finders.find(filename)
-            shutil.copyfile(static_filename, media_filename)
-        return File(open(media_filename, 'r'))
+        return get_default_logo_file()
+
+    def _get_default_logo_thumbnail(self, size, crop):
+        """thumbnail of the default logo: the same for all articles and computed once"""
+        logo_file = self._get_default_logo()
+        return get_default_logo_thumbnail(logo_file, size, crop) or FileUrlWrapper(logo_file)
 
     def logo_list_display(self):
         """logo in article admin"""
         if self.logo:
-            thumb = sorl_thumbnail.backend.get_thumbnail(self.logo.file, ADMIN_THUMBS_SIZE)
+            thumb = get_thumbnail(self.logo.file, ADMIN_THUMBS_SIZE)
+            if not thumb:
+                return mark_safe('<img width="%s" src="%s" />' % (ADMIN_THUMBS_SIZE.split('x')[0], self.logo.url))
             return mark_safe('<img width="%s" src="%s" />' % (thumb.width, thumb.url))
         else:
             return _("No Image")
@@ -776,12 +812,11 @@ class BaseArticle(BaseNavigable):
                 self.slug = self.get_unique_slug('slug', self.title)
         
         is_new = not bool(self.id)
-        ret = super(BaseArticle, self).save(*args, **kwargs)
-        
-        if is_new:
-            site = Site.objects.get(id=settings.SITE_ID)
-            self.sites.add(site)
-            ret = super(BaseArticle, self).save(do_not_create_nav=True)
+        with transaction.atomic():
+            ret = super(BaseArticle, self).save(*args, **kwargs)
+            if is_new:
+                # The article is saved only once: the site is added in the same transaction
+                self.sites.add(Site.objects.get_current())
 
         return ret
 
@@ -902,18 +937,13 @@ class BaseArticle(BaseNavigable):
     def is_accessible(self):
         """returns True if the content can be accessed. It most cases, it should be overridden"""
 
-        current_site = Site.objects.get_current()
-
-        if current_site not in self.sites.all():
+        if get_current_site() not in self.sites.all():
             return False
 
         if self.is_draft():
-            if is_requestprovider_installed():
-                try:
-                    http_request = RequestManager().get_request()
-                    return http_request.user.is_staff
-                except RequestNotFound:
-                    pass
+            request_context = get_request_context()
+            if request_context:
+                return request_context.is_staff
             return False
 
         if self.is_archived():
@@ -926,13 +956,13 @@ class BaseArticle(BaseNavigable):
 
     def is_current_page(self):
         """true if the article is currently displayed"""
-        url = self.get_absolute_url()
-        if url and is_requestprovider_installed():
-            try:
-                http_request = RequestManager().get_request()
-                return http_request and http_request.path == url
-            except RequestNotFound:
-                pass
+        try:
+            http_request = RequestManager().get_request()
+        except RequestNotFound:
+            return False
+        if http_request:
+            url = self.get_absolute_url()
+            return bool(url) and http_request.path == url
         return False
 
 
@@ -974,8 +1004,7 @@ class Link(BaseNavigable):
 
     def is_accessible(self):
         """returns True if the content can be accessed. It most cases, it should be overridden"""
-        current_site = Site.objects.get_current()
-        if current_site not in self.sites.all():
+        if get_current_site() not in self.sites.all():
             return False
         return True
 
@@ -1018,10 +1047,39 @@ class Media(TimeStampedModel):
     name = models.CharField(_('name'), max_length=200, blank=True, default='')
     filters = models.ManyToManyField(MediaFilter, blank=True, default=None, verbose_name=_("filters"))
     ordering = models.IntegerField(_("ordering"), default=100)
+    # sha256 of the file: media with the same content share the same file
+    content_hash = models.CharField(
+        _("content hash"), max_length=64, blank=True, default='', db_index=True, editable=False
+    )
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """save: a new file is not stored if the same content already exists"""
+        if self.file and not self.file._committed:
+            self.content_hash = get_file_hash(self.file)
+            if is_media_deduplication_enabled():
+                same_file_name = self.get_same_content_file_name()
+                if same_file_name:
+                    self.file = same_file_name
+        return super(Media, self).save(*args, **kwargs)
+
+    def get_upload_folder(self, filename):
+        """the folder where the file would be stored"""
+        return os.path.dirname(self.file.field.generate_filename(self, os.path.basename(filename)))
+
+    def get_same_content_file_name(self):
+        """returns the name of a stored file with the same content in the same folder or None"""
+        folder = self.get_upload_folder(self.file.name)
+        file_names = self.__class__.objects.filter(
+            content_hash=self.content_hash
+        ).exclude(id=self.id).values_list('file', flat=True).order_by('id')
+        for file_name in file_names:
+            if os.path.dirname(file_name) == folder and self.file.storage.exists(file_name):
+                return file_name
+        return None
+
     class Meta:
         abstract = True
 
@@ -1040,18 +1098,39 @@ class Image(Media):
     copyright = models.CharField(max_length=200, verbose_name=_('copyright'), blank=True, default='')
     alt_text = models.CharField(max_length=200, verbose_name=_('alt'), blank=True, default='')
     title = models.CharField(max_length=200, verbose_name=_('title'), blank=True, default='')
+    # Stored when the file is uploaded: the image file doesn't need to be opened for getting its size
+    width = models.PositiveIntegerField(_('width'), blank=True, null=True, default=None, editable=False)
+    height = models.PositiveIntegerField(_('height'), blank=True, null=True, default=None, editable=False)
+    image_format = models.CharField(_('format'), max_length=10, blank=True, default='', editable=False)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """save: store the dimensions of a new file"""
+        if self.file and (self.width is None or not self.file._committed):
+            self.update_dimensions()
+        return super(Image, self).save(*args, **kwargs)
+
+    def update_dimensions(self):
+        """read width, height and format from the image file"""
+        try:
+            self.width, self.height, self.image_format = get_image_info(self.file)
+        except (IOError, ValueError):
+            self.width, self.height, self.image_format = None, None, ''
+
     def clear_thumbnails(self):
         """clear thumbnails"""
         sorl_delete(self.file.file, delete_file=False)    
     
     def as_thumbnail(self):
         """convert to thumbnail"""
+        prefetched_thumbnail = getattr(self, '_prefetched_thumbnail', None)
+        if prefetched_thumbnail:
+            # see thumbnails.prefetch_thumbnails
+            return prefetched_thumbnail
         try:
-            return sorl_thumbnail.backend.get_thumbnail(self.file.file, "64x64", crop='center')
+            return get_thumbnail(self.file, IMAGE_THUMBNAIL_SIZE, crop='center') or self.file
         except IOError:
             return self.file
         
@@ -1066,18 +1145,20 @@ class Image(Media):
             if not self.size:
                 max_width = get_max_image_width(self)
                 max_width = int(max_width) if max_width else 0
-                if max_width and (max_width < self.file.width):
+                # self.width is None if the dimensions have not been stored yet: see update_image_dimensions command
+                width = self.width if self.width is not None else self.file.width
+                if max_width and (max_width < width):
                     try:
-                        url = sorl_thumbnail.backend.get_thumbnail(self.file.file, str(max_width), upscale=False).url
-                        return url
+                        thumbnail = get_thumbnail(self.file, str(max_width), upscale=False)
+                        return thumbnail.url if thumbnail else self.file.url
                     except (IOError, ThumbnailParseError):
                         return self.file.url
                 else:
                     return self.file.url
             try:
                 crop = self.size.crop or None
-                url = sorl_thumbnail.backend.get_thumbnail(self.file.file, self.size.size, crop=crop).url
-                return url
+                thumbnail = get_thumbnail(self.file, self.size.size, crop=crop)
+                return thumbnail.url if thumbnail else self.file.url
             except (IOError, ThumbnailParseError):
                 return self.file.url
         except IOError:
@@ -1089,6 +1170,49 @@ class Image(Media):
         ordering = ('ordering', )
 
 
+class ThumbnailJob(models.Model):
+    """A thumbnail to generate in background: see the generate_thumbnails command"""
+    key = models.CharField(max_length=32, unique=True)
+    file_name = models.CharField(max_length=500)
+    geometry = models.CharField(max_length=100)
+    options = models.TextField(default='{}')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('thumbnail job')
+        verbose_name_plural = _('thumbnail jobs')
+
+    def __str__(self):
+        return "{0} {1}".format(self.file_name, self.geometry)
+
+
+def on_save_image_queue_thumbnails(sender, instance, created, raw, **kwargs):
+    """queue the thumbnails of an uploaded image"""
+    if raw or not generate_thumbnails_in_background():
+        return
+    if instance.file:
+        queue_thumbnails(instance.file, get_image_geometries(instance))
+
+post_save.connect(on_save_image_queue_thumbnails, sender=Image)
+
+
+def on_save_article_queue_thumbnails(sender, instance, created, raw, **kwargs):
+    """queue the thumbnails of an article logo"""
+    if raw or not generate_thumbnails_in_background():
+        return
+    for logo in (instance.logo, instance.temp_logo):
+        if logo:
+            queue_thumbnails(logo, get_article_logo_geometries(instance))
+
+
+def on_prepare_article_class(sender, **kwargs):
+    """the article classes are defined by other apps: connect their post_save when they are created"""
+    if issubclass(sender, BaseArticle):
+        post_save.connect(on_save_article_queue_thumbnails, sender=sender)
+
+class_prepared.connect(on_prepare_article_class)
+
+
 def get_doc_folder(document, filename):
     """where to store this file. If private in a different folder which must be protected by web server"""
     if not document.is_private:
@@ -1157,6 +1281,44 @@ class Document(Media):
         ordering = ('ordering',)
 
 
+def _get_media_filters_cache_key(media_class):
+    """cache key for the filters of a media class"""
+    return 'coop_cms_media_filters_{0}'.format(media_class._meta.model_name)
+
+
+def get_media_filters(media_class):
+    """
+    returns the filters used by at least one media of the given class: sorted by name
+    The number of media is set as media_count
+    """
+    use_cache = is_cache_enabled()
+    if use_cache:
+        media_filters = cache.get(_get_media_filters_cache_key(media_class))
+        if media_filters is not None:
+            return media_filters
+
+    query_name = media_class._meta.get_field('filters').related_query_name()
+    media_filters = MediaFilter.objects.filter(
+        **{query_name + '__isnull': False}
+    ).annotate(media_count=Count(query_name))
+    media_filters = sorted(media_filters, key=lambda media_filter: media_filter.name.upper())
+
+    if use_cache:
+        cache.set(_get_media_filters_cache_key(media_class), media_filters)
+    return media_filters
+
+
+def clear_media_filters_cache(sender, **kwargs):
+    """media filters or media have changed"""
+    cache.delete_many([_get_media_filters_cache_key(media_class) for media_class in (Image, Document)])
+
+post_save.connect(clear_media_filters_cache, sender=MediaFilter)
+post_delete.connect(clear_media_filters_cache, sender=MediaFilter)
+for _media_class in (Image, Document):
+    post_delete.connect(clear_media_filters_cache, sender=_media_class)
+    m2m_changed.connect(clear_media_filters_cache, sender=_media_class.filters.through)
+
+
 class PieceOfHtml(models.Model):
     """This is a block of text thant can be added to a page and edited on it"""
     div_id = models.CharField(verbose_name=_("identifier"), max_length=100, db_index=True)
@@ -1474,7 +1636,7 @@ class SiteSettings(models.Model):
 def get_homepage_url():
     """returns the URL of the home page"""
     if not cms_no_homepage():
-        site = Site.objects.get_current()
+        site = get_current_site()
         # Try site settings
         try:
             site_settings = SiteSettings.objects.get(site=site)
@@ -1487,7 +1649,7 @@ def get_homepage_url():
 def get_homepage_article():
     """returns the URL of the home page"""
     if not cms_no_homepage():
-        site = Site.objects.get_current()
+        site = get_current_site()
         # Try site settings
         try:
             site_settings = SiteSettings.objects.get(site=site)
@@ -318,13 +318,21 @@ def can_rewrite_url():
     return getattr(django_settings, 'COOP_CMS_CAN_EDIT_ARTICLE_SLUG', False)
 
 
+def use_async_views():
+    """returns True if the async version of the public views must be used: for ASGI servers"""
+    return getattr(django_settings, 'COOP_CMS_ASYNC_VIEWS', False)
+
+
 def get_article_views():
     """returns article views"""
     try:
         article_views = getattr(django_settings, 'COOP_CMS_ARTICLE_VIEWS')
         return article_views
     except AttributeError:
-        default_class = 'coop_cms.views.articles.ArticleView'
+        if use_async_views():
+            default_class = 'coop_cms.views.articles.AsyncArticleView'
+        else:
+            default_class = 'coop_cms.views.articles.ArticleView'
         article_view = load_class("COOP_CMS_ARTICLE_VIEW", default_class)
         return {
             'article_view': article_view,
@@ -459,3 +467,47 @@ def is_xsendfile_disabled():
 
 def xsendfile_no_file_size():
     return getattr(django_settings, 'COOP_CMS_XSENDFILE_NO_FILESIZE', True)
+
+
+def is_media_deduplication_enabled():
+    """returns True if an uploaded media with the same content than an existing one shares its file"""
+    return getattr(django_settings, 'COOP_CMS_DEDUPLICATE_MEDIA', False)
+
+
+def get_serve_file_backend():
+    """
+    returns the name of the backend used for serving private files: 'xsendfile', 'x-accel-redirect', 'chunk'
+    It can also be the full name of a function
+    """
+    default_backend = 'chunk' if is_xsendfile_disabled() else 'xsendfile'
+    return getattr(django_settings, 'COOP_CMS_SERVE_FILE_BACKEND', default_backend)
+
+
+def get_x_accel_redirect_locations():
+    """returns a dict: file system path -> nginx internal location. Used by the x-accel-redirect backend"""
+    return getattr(django_settings, 'COOP_CMS_X_ACCEL_REDIRECT_LOCATIONS', {django_settings.MEDIA_ROOT: '/protected/'})
+
+
+def get_bulk_import_chunk_size():
+    """number of articles inserted by transaction when importing articles"""
+    return getattr(django_settings, 'COOP_CMS_BULK_IMPORT_CHUNK_SIZE', 1000)
+
+
+def generate_thumbnails_in_background():
+    """
+    returns True if thumbnails are generated by the generate_thumbnails command rather than during the request
+    """
+    return getattr(django_settings, 'COOP_CMS_THUMBNAILS_IN_BACKGROUND', False)
+
+
+def get_max_uploaded_image_size():
+    """
+    returns the max width and height of an uploaded image in pixels. A larger image is downscaled when uploaded
+    None or 0 : the image is stored unchanged
+    """
+    return getattr(django_settings, 'COOP_CMS_MAX_UPLOADED_IMAGE_SIZE', 4096)
+
+
+def get_max_uploaded_image_pixels():
+    """returns the max number of pixels (width x height) of an uploaded image. A larger image is refused"""
+    return getattr(django_settings, 'COOP_CMS_MAX_UPLOADED_IMAGE_PIXELS', 50000000)
@@ -2,14 +2,13 @@
 """utilities for developpers"""
 
 from django.conf import settings
-from django.contrib.sites.models import Site
 from django.http import Http404, HttpResponsePermanentRedirect, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 
 from .models import BaseArticle, Alias
 from .settings import get_article_class, is_localized
-from .utils import strip_locale_path
+from .utils import get_current_site, strip_locale_path
 
 
 def get_article_slug(*args, **kwargs):
@@ -83,14 +82,14 @@ def get_headlines(article=None, editable=False):
             queryset = queryset.filter(publication__in=(BaseArticle.PUBLISHED, BaseArticle.DRAFT))
         else:
             queryset = queryset.filter(publication=BaseArticle.PUBLISHED)
-        return queryset.filter(sites=Site.objects.get_current()).order_by("-publication_date")
+        return queryset.filter(sites=get_current_site()).order_by("-publication_date")
     return article_class.objects.none()
 
 
 def redirect_if_alias(path):
     """redirect if path correspond to an alias"""
     article_class = get_article_class()
-    site = Site.objects.get_current()
+    site = get_current_site()
 
     # look for an article corresponding to this path. For example if trailing slash is missing in the url
     try:
@@ -10,6 +10,7 @@ from django.utils.translation import activate
 
 from .models import BaseArticle, SiteSettings
 from .settings import get_article_class, has_localized_urls
+from .utils import get_current_site
 
 
 class LocaleSitemap(Sitemap):
@@ -22,7 +23,7 @@ class LocaleSitemap(Sitemap):
     def get_current_site(self):
         """get current site"""
         if not self._current_site:
-            self._current_site = Site.objects.get_current()
+            self._current_site = get_current_site()
         return self._current_site
 
     def get_sitemap_mode(self):
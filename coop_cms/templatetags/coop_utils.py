@@ -7,8 +7,6 @@ import os.path
 import time
 import unicodedata
 
-from bs4 import BeautifulSoup
-
 from django import template
 from django.conf import settings
 from django.template.base import TemplateSyntaxError
@@ -19,9 +17,11 @@ import floppyforms as floppyforms
 
 from ..models import ArticleCategory, Image, Document
 from ..moves import make_context
-from ..settings import get_article_class, logger
+from ..settings import get_article_class
 from ..shortcuts import get_article
+from ..thumbnails import prefetch_thumbnails
 from ..utils import dehtml as do_dehtml, slugify
+from ..utils.css import compile_css_def, inline_css
 from ..templatetags.coop_edition import _extract_if_node_args
 
 
@@ -107,101 +107,31 @@ def sp_rt_lb(value):
 class NewsletterFriendlyCssNode(template.Node):
     """css in tags attributes"""
     def __init__(self, nodelist_content, css_def):
-        self.css_def = css_def
         self.nodelist_content = nodelist_content
-
-    def _style_to_dict(self, style):
-        """
-        convert a style string ('color: #fff; background: #000') into a dict {'color': ''#fff', 'background': '#000'}
-        """
-        css_values = [elt for elt in style.strip().split(";") if elt]
-        css_values = [elt.split(":") for elt in css_values]
-        return dict([(key.strip(), value.strip()) for (key, value) in css_values])
-
-    @staticmethod
-    def _style_to_list(style):
-        """
-        convert a style string ('color: #fff; background: #000') into a list ['color', 'background']
-        """
-        css_values = [elt for elt in style.strip().split(";") if elt]
-        css_values = [elt.split(":") for elt in css_values]
-        return [key_and_value[0].strip() for key_and_value in css_values]
-
-    @staticmethod
-    def _dict_to_style(style_dict, order_of_items):
-        """
-        convert a dict {'color': ''#fff', 'background': '#000'} into a style string ('color: #fff; background: #000')
-        """
-        values = []
-        for elt in order_of_items:
-            value = style_dict.pop(elt, '')
-            if value:
-                values.append("{0}: {1}".format(elt, value))
-        values.extend(["{0}: {1}".format(key, value) for (key, value) in style_dict.items()])
-        if values:
-            return "; ".join(values) + ";"
-        return ""
+        if len(css_def) == 1 and '=' not in css_def[0]:
+            # The name of a variable of the context: compiled when rendered
+            self.css_variable = template.Variable(css_def[0])
+            self.compiled_css = None
+        else:
+            self.css_variable = None
+            # compiled once when the template is parsed. Raise ValueError if invalid
+            self.compiled_css = compile_css_def(tuple(css_def))
 
     def render(self, context):
         """to html"""
         content = self.nodelist_content.render(context)
-
-        if len(self.css_def) == 1:
+        compiled_css = self.compiled_css
+        if self.css_variable:
             try:
-                variable = template.Variable(self.css_def[0])
-                css_def = variable.resolve(context).split("\n")
+                css_def = self.css_variable.resolve(context).split("\n")
             except template.VariableDoesNotExist:
-                css_def = self.css_def
-        else:
-            css_def = self.css_def
-
-        css_map = {}
-        css_order = []
-        for item in css_def:
-            tag, value = item.split("=")
-            tag, value = tag.strip('"'), value.strip('"')
-            css_map[tag] = value
-            css_order.append(tag)
+                return content
+            compiled_css = compile_css_def(tuple(css_def))
 
         if context.get('by_email', False):
-            # avoid string.format issues with curly brackets
-            try:
-                soup = BeautifulSoup(content, "html.parser")
-            except Exception as msg:
-                logger.error("HTMLParseError: %s", msg)
-                logger.error(content)
-                raise
-
-            for tag in css_order:
-                css = css_map[tag]
-                key_and_values = self._style_to_dict(css)
-                key_order = self._style_to_list(css)
-                for html_tag in soup.select(tag):
-                    try:
-                        # do not overwrite an inline css value
-                        style = html_tag["style"]
-                        style_list = self._style_to_list(style)
-                        style_dict = self._style_to_dict(style)
-                    except KeyError:
-                        style_dict = {}
-                        style_list = key_order
-                    for key in key_order:
-                        if key not in style_dict:
-                            value = key_and_values[key]
-                            style_dict[key] = value
-                    # keep items in order
-                    html_tag["style"] = self._dict_to_style(style_dict, style_list)
-
-            # Do not prettify : it may cause some display problems
-            content = '{0}'.format(soup)  # .prettify(formatter="minimal")
-
-        else:
-            style = ""
-            for tag in reversed(list(css_map.keys())):
-                value = css_map[tag]
-                style += "{0} {{ {1} }}\n".format(tag, value)
-            content = "<style>\n{0}</style>\n".format(style) + content
-        return content
+            # The same content is inlined once: the newsletter may be rendered for many contacts
+            return inline_css(compiled_css, content)
+        return compiled_css.style_block + content
 
 
 @register.tag
@@ -211,7 +141,12 @@ def nlf_css(parser, token):
     css_def = args[1:]
     nodelist = parser.parse(('end_nlf_css',))
     token = parser.next_token()
-    return NewsletterFriendlyCssNode(nodelist, css_def)
+    try:
+        return NewsletterFriendlyCssNode(nodelist, css_def)
+    except ValueError:
+        raise TemplateSyntaxError(
+            'nlf_css: usage --> {% nlf_css selector="css" ... %} or {% nlf_css variable_name %}'
+        )
 
 
 @register.filter
@@ -323,7 +258,10 @@ class MediaListNode(template.Node):
     def render(self, context):
         if self.filter_var:
             self.filter_value = self.filter_var.resolve(context)
-        images = self.model_class.objects.filter(filters__name=self.filter_value).order_by("ordering", "-created")
+        images = list(
+            self.model_class.objects.filter(filters__name=self.filter_value).order_by("ordering", "-created")
+        )
+        prefetch_thumbnails(images)
         context.dicts[0][self.var_name] = images
         return ""
 
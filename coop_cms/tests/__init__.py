@@ -14,7 +14,7 @@ from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
-from ..models import Image, Document
+from ..models import Image, Document, clear_default_logo_cache
 from ..settings import get_article_class, get_unit_test_media_root, DEFAULT_MEDIA_ROOT
 
 
@@ -43,6 +43,7 @@ class BeautifulSoup(BaseBeautifulSoup):
 class BaseTestCase(TestCase):
 
     def _clean_files(self):
+        clear_default_logo_cache()
         if DEFAULT_MEDIA_ROOT != settings.MEDIA_ROOT:
             try:
                 shutil.rmtree(settings.MEDIA_ROOT)
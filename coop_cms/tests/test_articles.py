@@ -5,6 +5,7 @@ from datetime import datetime
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.db.models.signals import post_save
 from django.test import override_settings
 from django.urls import reverse
 
@@ -64,6 +65,21 @@ class ArticleTest(BaseArticleTest):
         response = self.client.get(article.get_absolute_url())
         self.assertEqual(200, response.status_code)
         
+    def test_create_article_saved_once(self):
+        article_class = get_article_class()
+        saved = []
+
+        def on_article_saved(sender, instance, created, **kwargs):
+            saved.append(created)
+
+        post_save.connect(on_article_saved, sender=article_class)
+        try:
+            article = article_class.objects.create(title="test")
+        finally:
+            post_save.disconnect(on_article_saved, sender=article_class)
+        self.assertEqual(saved, [True])
+        self.assertEqual(list(article.sites.all()), [Site.objects.get_current()])
+
     def test_publication_flag_published(self):
         article = get_article_class().objects.create(title="test", publication=BaseArticle.PUBLISHED)
         self.assertEqual(article.is_draft(), False)
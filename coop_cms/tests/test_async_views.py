@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sites.models import Site
+from django.core.exceptions import PermissionDenied
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.test import AsyncRequestFactory
+from django.test.utils import override_settings
+from django.urls import include, path, re_path
+
+from model_mommy import mommy
+
+from ..models import Alias, BaseArticle, SiteSettings
+from ..settings import get_article_class
+from ..views.articles import AsyncAliasView, AsyncArticleView
+from ..views.homepage import async_homepage
+from ..generic_views import EditableObjectView
+from . import BaseTestCase
+
+
+# the async views are used by coop_cms.urls only if COOP_CMS_ASYNC_VIEWS is set when it is imported
+urlpatterns = [
+    path('async/', async_homepage),
+    re_path(r'^async/(?P<slug>[-\w]+)/$', AsyncArticleView.as_view()),
+    re_path(r'^async-alias/(?P<path>.+)$', AsyncAliasView.as_view()),
+    path('', include('urls')),
+]
+
+
+class AsyncViewsTest(BaseTestCase):
+    """async version of the public views"""
+
+    def _make_request(self, path='/'):
+        request = AsyncRequestFactory().get(path)
+        request.user = AnonymousUser()
+        return request
+
+    async def test_view_article(self):
+        article = await get_article_class().objects.acreate(
+            title="Hello async", content="Async content", publication=BaseArticle.PUBLISHED
+        )
+        response = await AsyncArticleView.as_view()(self._make_request(), slug=article.slug)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Async content")
+
+    async def test_view_draft_article(self):
+        article = await get_article_class().objects.acreate(title="Hello async", publication=BaseArticle.DRAFT)
+        with self.assertRaises(PermissionDenied):
+            await AsyncArticleView.as_view()(self._make_request(), slug=article.slug)
+
+    def test_view_article_alias(self):
+        mommy.make(Alias, path='toto', redirect_url='/hello/', sites=Site.objects.all())
+        response = async_to_sync(AsyncArticleView.as_view())(self._make_request(), slug="toto")
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], '/hello/')
+
+    async def test_view_unknown_article(self):
+        with self.assertRaises(Http404):
+            await AsyncArticleView.as_view()(self._make_request(), slug="unknown")
+
+    def test_alias(self):
+        article = get_article_class().objects.create(title="Hello", publication=BaseArticle.PUBLISHED)
+        mommy.make(Alias, path='toto', redirect_url=article.get_absolute_url(), sites=Site.objects.all())
+
+        response = async_to_sync(AsyncAliasView.as_view())(self._make_request(), path='toto')
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], article.get_absolute_url())
+
+    @override_settings(COOP_CMS_HOMEPAGE_NO_REDIRECTION=True)
+    def test_homepage(self):
+        article = get_article_class().objects.create(
+            title="Home", content="This is home", publication=BaseArticle.PUBLISHED
+        )
+        SiteSettings.objects.create(site=Site.objects.get_current(), homepage_article=article.slug)
+
+        response = async_to_sync(async_homepage)(self._make_request())
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "This is home")
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewsUrlsTest(BaseTestCase):
+    """async views called by the handler: the ci_project uses ATOMIC_REQUESTS"""
+
+    def test_view_article(self):
+        article = get_article_class().objects.create(
+            title="Hello async", content="Async content", publication=BaseArticle.PUBLISHED
+        )
+        response = self.client.get('/async/{0}/'.format(article.slug))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Async content")
+
+    def test_alias(self):
+        article = get_article_class().objects.create(title="Hello", publication=BaseArticle.PUBLISHED)
+        mommy.make(Alias, path='toto', redirect_url=article.get_absolute_url(), sites=Site.objects.all())
+
+        response = self.client.get('/async-alias/toto')
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], article.get_absolute_url())
+
+    def test_post_atomic(self):
+        """the edit is in a transaction: the ci_project uses ATOMIC_REQUESTS"""
+        atomic_blocks = []
+
+        def post(view, request, *args, **kwargs):
+            atomic_blocks.append(len(connection.atomic_blocks))
+            return HttpResponse()
+
+        article = get_article_class().objects.create(title="Hello", publication=BaseArticle.PUBLISHED)
+        nb_atomic_blocks = len(connection.atomic_blocks)
+        with patch.object(EditableObjectView, 'post', post):
+            response = self.client.post('/async/{0}/'.format(article.slug))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(atomic_blocks, [nb_atomic_blocks + 1])
+
+    @override_settings(COOP_CMS_HOMEPAGE_NO_REDIRECTION=True)
+    def test_homepage(self):
+        article = get_article_class().objects.create(
+            title="Home", content="This is home", publication=BaseArticle.PUBLISHED
+        )
+        SiteSettings.objects.create(site=Site.objects.get_current(), homepage_article=article.slug)
+
+        response = self.client.get('/async/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "This is home")
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os.path
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core import management
+
+from ..bulk_import import import_articles
+from ..models import BaseArticle, NewsletterItem
+from ..settings import get_article_class
+from . import BaseTestCase
+
+
+class BulkImportTest(BaseTestCase):
+    """import articles by chunks"""
+
+    def test_import_articles(self):
+        article_class = get_article_class()
+        rows = [{'title': 'Article {0}'.format(index), 'content': 'Hello'} for index in range(5)]
+
+        nb_created = import_articles(iter(rows), chunk_size=2)
+
+        self.assertEqual(nb_created, 5)
+        self.assertEqual(article_class.objects.count(), 5)
+        site = Site.objects.get_current()
+        content_type = ContentType.objects.get_for_model(article_class)
+        for article in article_class.objects.all():
+            self.assertEqual(list(article.sites.all()), [site])
+            self.assertEqual(article.content, 'Hello')
+            self.assertEqual(article.publication, BaseArticle.PUBLISHED)
+            self.assertEqual(NewsletterItem.objects.filter(content_type=content_type, object_id=article.id).count(), 1)
+
+    def test_import_without_returned_ids(self):
+        """the db backend doesn't set the primary keys of the created objects (MySQL)"""
+        article_class = get_article_class()
+        bulk_create = article_class.objects.bulk_create
+
+        def bulk_create_without_ids(objs, *args, **kwargs):
+            objs = bulk_create(objs, *args, **kwargs)
+            for obj in objs:
+                obj.id = None
+            return objs
+
+        article_class.objects.create(title='Existing')
+        with patch.object(article_class.objects, 'bulk_create', side_effect=bulk_create_without_ids):
+            import_articles([{'title': 'Article {0}'.format(index)} for index in range(3)])
+
+        site = Site.objects.get_current()
+        content_type = ContentType.objects.get_for_model(article_class)
+        for index in range(3):
+            article = article_class.objects.get(title='Article {0}'.format(index))
+            self.assertEqual(list(article.sites.all()), [site])
+            self.assertEqual(NewsletterItem.objects.filter(content_type=content_type, object_id=article.id).count(), 1)
+
+    def test_import_same_titles(self):
+        article_class = get_article_class()
+        existing = article_class.objects.create(title='Same title')
+        rows = [{'title': 'Same title'} for _index in range(3)]
+
+        import_articles(rows, chunk_size=2)
+
+        slugs = set(article_class.objects.values_list('slug', flat=True))
+        self.assertEqual(slugs, {existing.slug, 'same-title2', 'same-title3', 'same-title4'})
+
+    def test_import_other_site(self):
+        article_class = get_article_class()
+        site2 = Site.objects.create(domain='test2.com', name='test2')
+
+        import_articles([{'title': 'Hello'}], sites=[site2])
+
+        article = article_class.objects.get(slug='hello')
+        self.assertEqual(list(article.sites.all()), [site2])
+
+    def test_import_not_in_newsletter(self):
+        article_class = get_article_class()
+
+        import_articles([{'title': 'Hello', 'in_newsletter': False}])
+
+        article = article_class.objects.get(slug='hello')
+        content_type = ContentType.objects.get_for_model(article_class)
+        self.assertEqual(NewsletterItem.objects.filter(content_type=content_type, object_id=article.id).count(), 0)
+
+    def _write_file(self, suffix, content):
+        file_descriptor, filename = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(file_descriptor, 'w') as tmp_file:
+            tmp_file.write(content)
+        self.addCleanup(os.remove, filename)
+        return filename
+
+    def test_command_json_lines(self):
+        article_class = get_article_class()
+        content = '\n'.join(json.dumps({'title': 'Article {0}'.format(index)}) for index in range(3))
+        filename = self._write_file('.json', content)
+
+        management.call_command('import_articles', filename, chunk_size=2, verbosity=0)
+
+        self.assertEqual(article_class.objects.count(), 3)
+
+    def test_command_json_list(self):
+        article_class = get_article_class()
+        filename = self._write_file('.json', json.dumps([{'title': 'A'}, {'title': 'B', 'slug': 'bbb'}]))
+
+        management.call_command('import_articles', filename, verbosity=0)
+
+        self.assertEqual(sorted(article_class.objects.values_list('slug', flat=True)), ['a', 'bbb'])
+
+    def test_command_csv(self):
+        article_class = get_article_class()
+        filename = self._write_file('.csv', 'title,content,publication\nHello,World,0\nBye,,1\n')
+
+        management.call_command('import_articles', filename, verbosity=0)
+
+        self.assertEqual(article_class.objects.get(slug='hello').publication, BaseArticle.DRAFT)
+        self.assertEqual(article_class.objects.get(slug='hello').content, 'World')
+        self.assertEqual(article_class.objects.get(slug='bye').publication, BaseArticle.PUBLISHED)
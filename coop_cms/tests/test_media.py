@@ -2,11 +2,16 @@
 """media library unit testing"""
 
 from datetime import datetime
+import os.path
 from unittest import skipIf
+from unittest.mock import patch
 from io import BytesIO
 from PIL import Image as PilImage
 
 from django.conf import settings
+from django.core import management
+from django.core.management.base import CommandError
+from django.core.cache import cache
 from django.core.files import File
 from django.urls import reverse
 from django.template import Template, Context
@@ -14,6 +19,7 @@ from django.template.base import TemplateSyntaxError
 from django.test.utils import override_settings
 
 from model_mommy import mommy
+from sorl.thumbnail import default as sorl_thumbnail
 
 if 'photologue' in settings.INSTALLED_APPS:
     try:
@@ -21,7 +27,7 @@ if 'photologue' in settings.INSTALLED_APPS:
     except ImportError:
         pass
 
-from ..models import ArticleCategory, Document, Image, ImageSize, MediaFilter
+from ..models import ArticleCategory, Document, Image, ImageSize, MediaFilter, get_media_filters
 from ..moves import get_response_json
 from ..settings import get_article_class
 from . import BaseArticleTest, BaseTestCase, BeautifulSoup, MediaBaseTestCase
@@ -335,6 +341,105 @@ class ImageUploadTest(MediaBaseTestCase):
         self.assertEqual(file_.read(), self._get_file("unittest1.png").read())
 
 
+class ImageUploadDownscaleTest(BaseArticleTest):
+    """large images are downscaled when uploaded"""
+
+    def _get_jpeg(self, width, height, name='large.jpg'):
+        """returns an uploaded jpeg image"""
+        data = BytesIO()
+        PilImage.new('RGB', (width, height), (200, 100, 50)).save(data, format='JPEG')
+        data.seek(0)
+        data.name = name
+        return data
+
+    def _post_image(self, image_file):
+        """post the upload image form"""
+        self._log_as_mediamgr(perm=self._permission("add", Image))
+        url = reverse('coop_cms_upload_image')
+        data = {
+            'image': image_file,
+            'descr': 'a test file',
+            'filters': '',
+        }
+        return self.client.post(url, data=data, follow=True)
+
+    @override_settings(COOP_CMS_MAX_UPLOADED_IMAGE_SIZE=400)
+    def test_upload_large_image(self):
+        """a large image is downscaled"""
+        response = self._post_image(self._get_jpeg(1600, 800))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'close_popup_and_media_slide')
+
+        image = Image.objects.get()
+        self.assertEqual((image.width, image.height, image.image_format), (400, 200, 'JPEG'))
+        self.assertTrue(image.file.name.endswith('.jpg'))
+        image.file.open('rb')
+        with PilImage.open(image.file) as pil_image:
+            self.assertEqual(pil_image.size, (400, 200))
+        image.file.close()
+
+    @override_settings(COOP_CMS_MAX_UPLOADED_IMAGE_SIZE=400)
+    def test_upload_small_image(self):
+        """a small image is unchanged"""
+        image_file = self._get_jpeg(300, 200)
+        content = image_file.getvalue()
+        response = self._post_image(image_file)
+        self.assertEqual(response.content, b'close_popup_and_media_slide')
+
+        image = Image.objects.get()
+        self.assertEqual((image.width, image.height), (300, 200))
+        image.file.open('rb')
+        self.assertEqual(image.file.read(), content)
+        image.file.close()
+
+    @override_settings(COOP_CMS_MAX_UPLOADED_IMAGE_SIZE=None)
+    def test_upload_no_max_size(self):
+        """the image is not downscaled if no max size"""
+        response = self._post_image(self._get_jpeg(1600, 800))
+        self.assertEqual(response.content, b'close_popup_and_media_slide')
+        image = Image.objects.get()
+        self.assertEqual((image.width, image.height), (1600, 800))
+
+    @override_settings(COOP_CMS_MAX_UPLOADED_IMAGE_PIXELS=1000000)
+    def test_upload_too_many_pixels(self):
+        """an image with too many pixels is refused"""
+        response = self._post_image(self._get_jpeg(2000, 1000))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.content, b'close_popup_and_media_slide')
+        self.assertEqual(Image.objects.count(), 0)
+
+    def test_upload_not_an_image(self):
+        """a file which is not an image is refused"""
+        response = self._post_image(self._get_file("unittest1.txt"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.content, b'close_popup_and_media_slide')
+        self.assertEqual(Image.objects.count(), 0)
+
+    @override_settings(COOP_CMS_MAX_UPLOADED_IMAGE_SIZE=400)
+    def test_upload_truncated_image(self):
+        """an image whose data is corrupted is refused"""
+        image_file = self._get_jpeg(1600, 800)
+        image_file = BytesIO(image_file.getvalue()[:2000])
+        image_file.name = 'large.jpg'
+        response = self._post_image(image_file)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.content, b'close_popup_and_media_slide')
+        self.assertEqual(Image.objects.count(), 0)
+
+    @override_settings(COOP_CMS_MAX_UPLOADED_IMAGE_SIZE=400)
+    def test_upload_large_logo(self):
+        """a large logo is downscaled"""
+        article = get_article_class().objects.create(title="test")
+        self._log_as_editor()
+        url = reverse('coop_cms_update_logo', args=[article.id])
+        response = self.client.post(url, data={'image': self._get_jpeg(800, 1600)})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(get_response_json(response)['ok'])
+
+        article = get_article_class().objects.get(id=article.id)
+        self.assertEqual((article.temp_logo.width, article.temp_logo.height), (200, 400))
+
+
 class ImageSizeTest(MediaBaseTestCase):
     """Test media library slide"""
     
@@ -422,6 +527,154 @@ class ImageSizeTest(MediaBaseTestCase):
         self.assertNotEqual(url, image.file.url)
 
 
+@override_settings(COOP_CMS_DEDUPLICATE_MEDIA=True)
+class MediaDeduplicationTest(MediaBaseTestCase):
+    """media with the same content share the same file"""
+
+    def _upload_image(self, file_name):
+        """upload image"""
+        data = {'image': self._get_file(file_name), 'descr': file_name, 'filters': ''}
+        response = self.client.post(reverse('coop_cms_upload_image'), data=data, follow=True)
+        self.assertEqual(response.content, b'close_popup_and_media_slide')
+        return Image.objects.get(name=file_name)
+
+    def test_upload_same_image(self):
+        """same image uploaded twice"""
+        self._log_as_mediamgr(perm=self._permission("add", Image))
+        image1 = self._upload_image("unittest1.png")
+        Image.objects.filter(id=image1.id).update(name="first")
+        image2 = self._upload_image("unittest1.png")
+        image3 = self._upload_image("unittest2.png")
+
+        self.assertEqual(image1.file.name, image2.file.name)
+        self.assertNotEqual(image1.file.name, image3.file.name)
+        self.assertEqual(image1.content_hash, image2.content_hash)
+        self.assertEqual(len(image1.content_hash), 64)
+
+    def test_same_document(self):
+        """same document: shared only in the same folder"""
+        public_doc1 = mommy.make(Document, is_private=False, file=File(self._get_file()))
+        public_doc2 = mommy.make(Document, is_private=False, file=File(self._get_file()))
+        private_doc = mommy.make(Document, is_private=True, file=File(self._get_file()))
+
+        self.assertEqual(public_doc1.file.name, public_doc2.file.name)
+        self.assertNotEqual(public_doc1.file.name, private_doc.file.name)
+        self.assertEqual(public_doc1.content_hash, private_doc.content_hash)
+
+    @override_settings(COOP_CMS_DEDUPLICATE_MEDIA=False)
+    def test_deduplication_disabled(self):
+        """not shared"""
+        doc1 = mommy.make(Document, file=File(self._get_file()))
+        doc2 = mommy.make(Document, file=File(self._get_file()))
+        self.assertNotEqual(doc1.file.name, doc2.file.name)
+
+    def test_deduplicate_media(self):
+        """command"""
+        with override_settings(COOP_CMS_DEDUPLICATE_MEDIA=False):
+            doc1 = mommy.make(Document, file=File(self._get_file()))
+            doc2 = mommy.make(Document, file=File(self._get_file()))
+            doc3 = mommy.make(Document, file=File(self._get_file('unittest1.png')))
+            image1 = mommy.make(Image, _create_files=True)
+            image2 = mommy.make(Image, _create_files=True)
+        Document.objects.filter(id=doc1.id).update(content_hash='')
+        doc2_file_name = doc2.file.name
+
+        management.call_command('deduplicate_media', delete_files=True, interactive=False, verbosity=0)
+
+        doc1, doc2, doc3 = [Document.objects.get(id=doc.id) for doc in (doc1, doc2, doc3)]
+        self.assertEqual(doc2.file.name, doc1.file.name)
+        self.assertNotEqual(doc3.file.name, doc1.file.name)
+        self.assertEqual(Image.objects.get(id=image2.id).file.name, image1.file.name)
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, doc2_file_name)))
+        self.assertTrue(os.path.exists(doc1.file.path))
+
+    def test_deduplicate_media_dry_run(self):
+        """command doesn't change anything"""
+        with override_settings(COOP_CMS_DEDUPLICATE_MEDIA=False):
+            doc1 = mommy.make(Document, file=File(self._get_file()))
+            doc2 = mommy.make(Document, file=File(self._get_file()))
+
+        management.call_command('deduplicate_media', delete_files=True, dry_run=True, verbosity=0)
+
+        self.assertNotEqual(Document.objects.get(id=doc2.id).file.name, doc1.file.name)
+        self.assertTrue(os.path.exists(doc2.file.path))
+
+    def test_deduplicate_media_used_in_html(self):
+        """a file linked by the content of an article is not deleted"""
+        with override_settings(COOP_CMS_DEDUPLICATE_MEDIA=False):
+            image1 = mommy.make(Image, _create_files=True)
+            image2 = mommy.make(Image, _create_files=True)
+        get_article_class().objects.create(title="test", content='<img src="{0}" />'.format(image2.file.url))
+
+        management.call_command('deduplicate_media', delete_files=True, interactive=False, verbosity=0)
+
+        self.assertEqual(Image.objects.get(id=image2.id).file.name, image1.file.name)
+        self.assertTrue(os.path.exists(image2.file.path))
+
+    def test_deduplicate_media_not_confirmed(self):
+        """the files are deleted only if confirmed"""
+        with override_settings(COOP_CMS_DEDUPLICATE_MEDIA=False):
+            doc1 = mommy.make(Document, file=File(self._get_file()))
+            doc2 = mommy.make(Document, file=File(self._get_file()))
+
+        with patch('builtins.input', return_value='no'):
+            self.assertRaises(CommandError, management.call_command, 'deduplicate_media', delete_files=True)
+
+        self.assertNotEqual(Document.objects.get(id=doc2.id).file.name, doc1.file.name)
+        self.assertTrue(os.path.exists(doc2.file.path))
+
+
+class ImageDimensionsTest(MediaBaseTestCase):
+    """width and height are stored in database"""
+
+    def test_upload_image(self):
+        """dimensions are stored when the image is created"""
+        image = Image.objects.create(name="logo", file=File(self._get_file('unittest1.png')))
+        pil_image = PilImage.open(self._get_file('unittest1.png'))
+        self.assertEqual((image.width, image.height), pil_image.size)
+        self.assertEqual(image.image_format, 'PNG')
+
+    def test_change_image(self):
+        """dimensions are updated with the file"""
+        image = mommy.make(Image, _create_files=True)
+        self.assertEqual(image.image_format, 'JPEG')
+        image.file = File(self._get_file('unittest2.png'))
+        image.save()
+        image = Image.objects.get(id=image.id)
+        self.assertEqual((image.width, image.height), PilImage.open(self._get_file('unittest2.png')).size)
+        self.assertEqual(image.image_format, 'PNG')
+
+    @override_settings(COOP_CMS_MAX_IMAGE_WIDTH="600")
+    def test_stored_width(self):
+        """the stored width is used: not the file"""
+        image = mommy.make(Image, _create_files=True)
+        self.assertEqual(image.get_absolute_url(), image.file.url)
+        Image.objects.filter(id=image.id).update(width=1000)
+        image = Image.objects.get(id=image.id)
+        self.assertNotEqual(image.get_absolute_url(), image.file.url)
+
+    def test_update_image_dimensions(self):
+        """dimensions of existing images are stored by command"""
+        image = mommy.make(Image, _create_files=True)
+        width, height = image.width, image.height
+        Image.objects.filter(id=image.id).update(width=None, height=None, image_format='')
+
+        management.call_command('update_image_dimensions', verbosity=0)
+
+        image = Image.objects.get(id=image.id)
+        self.assertEqual((image.width, image.height), (width, height))
+        self.assertEqual(image.image_format, 'JPEG')
+
+    def test_update_image_dimensions_missing_file(self):
+        """missing files are ignored"""
+        image = mommy.make(Image, _create_files=True)
+        Image.objects.filter(id=image.id).update(width=None, file='img/does-not-exist.jpg')
+
+        management.call_command('update_image_dimensions', verbosity=0)
+
+        self.assertIsNone(Image.objects.get(id=image.id).width)
+
+
 class MediaLibraryTest(MediaBaseTestCase):
     """Test media library slide"""
 
@@ -530,8 +783,58 @@ class MediaLibraryTest(MediaBaseTestCase):
         expected = [x.file.url for x in images[:12]]
         actual = [node["rel"] for node in nodes]
         self.assertEqual(expected, actual)
-    
-    
+
+
+class MediaFiltersTest(MediaBaseTestCase):
+    """filters of the media library"""
+
+    def setUp(self):
+        super(MediaFiltersTest, self).setUp()
+        cache.clear()
+
+    def test_get_media_filters(self):
+        """filters used by images with counts"""
+        filter1 = mommy.make(MediaFilter, name="b")
+        filter2 = mommy.make(MediaFilter, name="A")
+        mommy.make(MediaFilter, name="unused")
+        doc_filter = mommy.make(MediaFilter, name="doc")
+        image1 = mommy.make(Image, _create_files=True)
+        image2 = mommy.make(Image, _create_files=True)
+        image1.filters.add(filter1, filter2)
+        image2.filters.add(filter1)
+        document = mommy.make(Document, _create_files=True)
+        document.filters.add(doc_filter)
+
+        with self.assertNumQueries(1):
+            media_filters = get_media_filters(Image)
+
+        self.assertEqual([(filter2, 1), (filter1, 2)], [(mf, mf.media_count) for mf in media_filters])
+        self.assertEqual([doc_filter], get_media_filters(Document))
+
+    @override_settings(COOP_CMS_CACHE=True)
+    def test_media_filters_cache(self):
+        """filters are cached until media or filters change"""
+        media_filter = mommy.make(MediaFilter, name="a")
+        image = mommy.make(Image, _create_files=True)
+        image.filters.add(media_filter)
+        self.assertEqual([media_filter], get_media_filters(Image))
+
+        with self.assertNumQueries(0):
+            self.assertEqual([media_filter], get_media_filters(Image))
+
+        media_filter.name = "b"
+        media_filter.save()
+        self.assertEqual(["b"], [mf.name for mf in get_media_filters(Image)])
+
+        image.filters.remove(media_filter)
+        self.assertEqual([], get_media_filters(Image))
+
+        image.filters.add(media_filter)
+        self.assertEqual([media_filter], get_media_filters(Image))
+        image.delete()
+        self.assertEqual([], get_media_filters(Image))
+
+
 class UploadDocTest(MediaBaseTestCase):
     """Download document"""
 
@@ -841,7 +1144,134 @@ class DownloadDocTest(MediaBaseTestCase):
         self.client.logout()
         response = self.client.get(doc.get_download_url())
         self.assertNotAllowed(response)
-        
+
+
+@skipIf('sanza.Profile' in settings.INSTALLED_APPS, "sanza.Profile installed")
+@override_settings(COOP_CMS_DISABLE_XSENDFILE=True)
+class ChunkDownloadDocTest(MediaBaseTestCase):
+    """Download private document without X-Sendfile"""
+
+    def setUp(self):
+        super(ChunkDownloadDocTest, self).setUp()
+        cat = mommy.make(ArticleCategory, name="private-doc")
+        self.doc = mommy.make(Document, is_private=True, file=File(self._get_file()), category=cat)
+        self.content = self._get_file().read()
+        self._log_as_mediamgr()
+
+    def test_download(self):
+        """download the whole file"""
+        response = self.client.get(self.doc.get_download_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_safe_content(response), self.content)
+        self.assertEqual(response['Content-Disposition'], "attachment; filename=unittest1.txt")
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], "bytes")
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+
+    def test_download_range(self):
+        """download a part of the file"""
+        response = self.client.get(self.doc.get_download_url(), HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.get_safe_content(response), self.content[2:6])
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/{0}'.format(len(self.content)))
+        self.assertEqual(response['Content-Length'], '4')
+
+    def test_download_open_range(self):
+        """download the end of the file"""
+        response = self.client.get(self.doc.get_download_url(), HTTP_RANGE='bytes=3-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.get_safe_content(response), self.content[3:])
+
+    def test_download_suffix_range(self):
+        """download the last bytes of the file"""
+        response = self.client.get(self.doc.get_download_url(), HTTP_RANGE='bytes=-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.get_safe_content(response), self.content[-4:])
+
+    def test_download_unsatisfiable_range(self):
+        """range after the end of file"""
+        response = self.client.get(self.doc.get_download_url(), HTTP_RANGE='bytes=10000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */{0}'.format(len(self.content)))
+
+    def test_download_multiple_ranges(self):
+        """multiple ranges are not supported: the whole file is sent"""
+        response = self.client.get(self.doc.get_download_url(), HTTP_RANGE='bytes=0-1,4-5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_safe_content(response), self.content)
+
+    def test_if_none_match(self):
+        """not modified"""
+        etag = self.client.get(self.doc.get_download_url())['ETag']
+        response = self.client.get(self.doc.get_download_url(), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since(self):
+        """not modified"""
+        last_modified = self.client.get(self.doc.get_download_url())['Last-Modified']
+        response = self.client.get(self.doc.get_download_url(), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_range_changed(self):
+        """the file has changed: the range is ignored"""
+        response = self.client.get(self.doc.get_download_url(), HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_safe_content(response), self.content)
+
+    def test_if_range_unchanged(self):
+        """the file has not changed: the range is sent"""
+        etag = self.client.get(self.doc.get_download_url())['ETag']
+        response = self.client.get(self.doc.get_download_url(), HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+
+@skipIf('sanza.Profile' in settings.INSTALLED_APPS, "sanza.Profile installed")
+@override_settings(COOP_CMS_SERVE_FILE_BACKEND='x-accel-redirect')
+class XAccelRedirectDownloadDocTest(MediaBaseTestCase):
+    """Download private document with nginx"""
+
+    def setUp(self):
+        super(XAccelRedirectDownloadDocTest, self).setUp()
+        cat = mommy.make(ArticleCategory, name="private-doc")
+        self.doc = mommy.make(Document, is_private=True, file=File(self._get_file()), category=cat)
+        self._log_as_mediamgr()
+
+    def test_download(self):
+        """default location"""
+        response = self.client.get(self.doc.get_download_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.doc.file.name)
+        self.assertEqual(response['Content-Disposition'], "attachment; filename=unittest1.txt")
+        self.assertEqual(response['Content-Type'], "text/plain")
+        self.assertEqual(self.get_safe_content(response), b'')
+
+    def test_download_location(self):
+        """most specific location"""
+        locations = {
+            settings.MEDIA_ROOT: '/protected/',
+            os.path.join(settings.MEDIA_ROOT, 'documents/private'): '/private-docs',
+        }
+        with override_settings(COOP_CMS_X_ACCEL_REDIRECT_LOCATIONS=locations):
+            response = self.client.get(self.doc.get_download_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/private-docs/unittest1.txt')
+
+    def test_download_no_location(self):
+        """not in a location : served by django"""
+        with override_settings(COOP_CMS_X_ACCEL_REDIRECT_LOCATIONS={'/not-media': '/protected/'}):
+            response = self.client.get(self.doc.get_download_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Accel-Redirect'))
+        self.assertEqual(self.get_safe_content(response), self._get_file().read())
+
+    def test_custom_backend(self):
+        """function name as backend"""
+        with override_settings(COOP_CMS_SERVE_FILE_BACKEND='coop_cms.utils.xsendfile.xsendfile_serve_file'):
+            response = self.client.get(self.doc.get_download_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('X-Sendfile'))
+
 
 class ImageListTemplateTagTest(BaseTestCase):
     """Test image List template tag"""
@@ -1042,3 +1472,44 @@ class ArticleLogoTest(BaseArticleTest):
         settings.COOP_CMS_ARTICLE_LOGO_SIZE = "x100"
         settings.COOP_CMS_ARTICLE_LOGO_CROP = "top"
         self.test_edit_article_no_image(2, True, True)
+
+
+class DefaultLogoTest(BaseTestCase):
+    """default logo of articles"""
+
+    def test_default_logo_thumbnail(self):
+        """the default logo is used if no logo"""
+        article = get_article_class().objects.create(title="test")
+        thumbnail = article.logo_thumbnail(logo_size="32x32")
+        self.assertEqual(thumbnail.width, 32)
+
+    def test_default_logo_not_opened(self):
+        """the default logo is not left opened"""
+        article = get_article_class().objects.create(title="test")
+        logo_file = article._get_default_logo()
+        self.assertTrue(os.path.exists(logo_file.name))
+        self.assertIsNone(logo_file.file)
+
+    def test_default_logo_once(self):
+        """the file system is not accessed after the first call"""
+        article1 = get_article_class().objects.create(title="test1")
+        article2 = get_article_class().objects.create(title="test2")
+        url = article1.logo_thumbnail(logo_size="32x32").url
+
+        with patch('os.path.exists') as exists_mock:
+            with self.assertNumQueries(0):
+                self.assertEqual(article2.logo_thumbnail(logo_size="32x32").url, url)
+            self.assertFalse(exists_mock.called)
+
+        self.assertNotEqual(article2.logo_thumbnail(logo_size="20x20").url, url)
+
+    def test_default_logo_thumbnail_cleared(self):
+        """the thumbnail is created again if it has been cleared"""
+        article = get_article_class().objects.create(title="test")
+        thumbnail = article.logo_thumbnail(logo_size="32x32")
+        sorl_thumbnail.kvstore.delete(thumbnail)
+        self.assertFalse(thumbnail.exists())
+
+        thumbnail = article.logo_thumbnail(logo_size="32x32")
+        self.assertTrue(thumbnail.exists())
+        self.assertEqual(thumbnail.width, 32)
@@ -1,6 +1,15 @@
 # -*- coding: utf-8 -*-
 
-from ..utils import RequestManager, RequestMiddleware, RequestNotFound
+import asyncio
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.test import RequestFactory
+
+from ..utils import (
+    RequestManager, RequestMiddleware, RequestNotFound, get_current_site, get_request_context, make_links_absolute
+)
 from . import BaseTestCase
 
 
@@ -19,3 +28,66 @@ class RequestManagerTest(BaseTestCase):
         """if no request"""
         RequestManager().clean()
         self.assertRaises(RequestNotFound, RequestManager().get_request)
+
+
+class RequestContextTest(BaseTestCase):
+    """Test request context"""
+
+    def test_get_request_context(self):
+        """retrieve request context"""
+        user = User(username="joe", is_staff=True)
+        request = RequestFactory().get('/')
+        request.user = user
+
+        def fake_view(*args, **kwargs):
+            request_context = get_request_context()
+            self.assertEqual(request_context.request, request)
+            self.assertEqual(request_context.site, Site.objects.get_current())
+            self.assertEqual(request_context.user, user)
+            self.assertEqual(request_context.is_staff, True)
+            self.assertEqual(get_current_site(), Site.objects.get_current())
+        RequestMiddleware(fake_view)(request)
+        self.assertEqual(get_request_context(), None)
+
+    def test_site_of_request_context(self):
+        """the site of the request context is used rather than computed again"""
+        site = Site.objects.get_current()
+
+        def fake_view(*args, **kwargs):
+            get_request_context().site
+            with patch.object(Site.objects, 'get_current', side_effect=AssertionError):
+                self.assertEqual(
+                    make_links_absolute('<a href="/toto">', wrap_lines=False),
+                    '<a href="http://{0}/toto">'.format(site.domain)
+                )
+        RequestMiddleware(fake_view)(RequestFactory().get('/'))
+
+    def test_get_request_context_no_middleware(self):
+        """if no request"""
+        RequestManager().clean()
+        self.assertEqual(get_request_context(), None)
+        self.assertEqual(get_current_site(), Site.objects.get_current())
+
+
+class AsyncRequestManagerTest(BaseTestCase):
+    """Test request manager with async middleware"""
+
+    def test_no_leak(self):
+        """the request is not kept after the response"""
+        RequestManager().clean()
+        RequestMiddleware(lambda request: None)({'user': "joe"})
+        self.assertRaises(RequestNotFound, RequestManager().get_request)
+
+    def test_concurrent_requests(self):
+        """several requests in the same thread"""
+        requests = [{'user': "joe"}, {'user': "jack"}]
+
+        async def fake_view(request):
+            await asyncio.sleep(0.01)
+            return RequestManager().get_request()
+
+        async def serve_all():
+            middleware = RequestMiddleware(fake_view)
+            return await asyncio.gather(*[middleware(request) for request in requests])
+
+        self.assertEqual(asyncio.run(serve_all()), requests)
@@ -2,13 +2,14 @@
 
 from datetime import timedelta
 from unittest import skipIf
+from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.core import mail
 from django.core import management
-from django.template import Template, Context
+from django.template import Template, TemplateSyntaxError, Context
 from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
@@ -19,6 +20,7 @@ from model_mommy import mommy
 from ..models import Newsletter, NewsletterItem, PieceOfHtml, NewsletterSending
 from ..settings import has_localized_urls, get_article_class
 from ..utils import make_links_absolute, strip_a_tags, avoid_line_too_long, send_email
+from ..utils.css import CompiledCss, inline_css
 from . import BaseTestCase, UserBaseTestCase, BeautifulSoup
 
 
@@ -1028,7 +1030,9 @@ class NewsletterTest(UserBaseTestCase):
         ],
         COOP_CMS_FROM_EMAIL='contact@toto.fr'
     )
-    def test_send_test_newsletter_add_email_and_no_choice(self, template='test/newsletter_blue.html', extra_checker=None):
+    def test_send_test_newsletter_add_email_and_no_choice(
+        self, template='test/newsletter_blue.html', extra_checker=None
+    ):
         settings.SITE_ID = 1
         site = Site.objects.get(id=settings.SITE_ID)
         site.domain = 'toto.fr'
@@ -1376,19 +1380,19 @@ class AbsUrlTest(UserBaseTestCase):
         test_html = '<a href="%s/toto">This is a link</a>'
         rel_html = test_html % ""
         abs_html = self._to_text(BeautifulSoup(test_html % self.site_prefix))
-        self.assertEqual(abs_html, strip_a_tags(make_links_absolute(rel_html, self.newsletter)))
+        self.assertEqual(abs_html, self._to_text(BeautifulSoup(make_links_absolute(rel_html, self.newsletter))))
         
     def test_src(self):
         test_html = '<h1>My image</h1><img src="%s/toto">'
         rel_html = test_html % ""
         abs_html = self._to_text(BeautifulSoup(test_html % self.site_prefix))
-        self.assertEqual(abs_html, strip_a_tags(make_links_absolute(rel_html, self.newsletter)))
+        self.assertEqual(abs_html, self._to_text(BeautifulSoup(make_links_absolute(rel_html, self.newsletter))))
         
     def test_relative_path(self):
         test_html = '<h1>My image</h1><img src="%s/toto">'
         rel_html = test_html % "../../.."
         abs_html = self._to_text(BeautifulSoup(test_html % self.site_prefix))
-        self.assertEqual(abs_html, strip_a_tags(make_links_absolute(rel_html, self.newsletter)))
+        self.assertEqual(abs_html, self._to_text(BeautifulSoup(make_links_absolute(rel_html, self.newsletter))))
     
     def test_src_and_img(self):
         test_html = '<h1>My image</h1><a href="{0}/a1">This is a link</a><img src="{0}/toto"/><img src="{0}/titi"/>' + \
@@ -1396,24 +1400,39 @@ class AbsUrlTest(UserBaseTestCase):
         rel_html = test_html.format("")
         html = test_html.format(self.site_prefix)
         abs_html = self._to_text(BeautifulSoup(html))
-        self.assertEqual(abs_html, strip_a_tags(make_links_absolute(rel_html, self.newsletter)))
+        self.assertEqual(abs_html, self._to_text(BeautifulSoup(make_links_absolute(rel_html, self.newsletter))))
         
     def test_href_rel_and_abs(self):
         test_html = '<a href="%s/toto">This is a link</a><a href="http://www.apidev.fr">another</a>'
         rel_html = test_html % ""
         abs_html = self._to_text(BeautifulSoup(test_html % self.site_prefix))
-        self.assertEqual(abs_html, strip_a_tags(make_links_absolute(rel_html, self.newsletter)))
+        self.assertEqual(abs_html, self._to_text(BeautifulSoup(make_links_absolute(rel_html, self.newsletter))))
         
     def test_style_in_between(self):
         test_html = '<img style="margin: 0; width: 700px;" src="%s/media/img/newsletter_header.png" alt="Logo">'
         rel_html = test_html % ""
         abs_html = self._to_text(BeautifulSoup(test_html % self.site_prefix))
-        self.assertEqual(abs_html, strip_a_tags(make_links_absolute(rel_html, self.newsletter)))
+        self.assertEqual(abs_html, self._to_text(BeautifulSoup(make_links_absolute(rel_html, self.newsletter))))
         
     def test_missing_attr(self):
         test_html = '<img alt="Logo" /><a name="aa">link</a>'
         abs_html = self._to_text(BeautifulSoup(test_html))
-        self.assertEqual(abs_html, strip_a_tags(make_links_absolute(test_html, self.newsletter)))
+        self.assertEqual(abs_html, self._to_text(BeautifulSoup(make_links_absolute(test_html, self.newsletter))))
+
+    def test_html_unchanged(self):
+        test_html = '<!-- <a href="/comment"> --><div class="x"><A title="a > b" HREF=\'{0}/toto\'>Link</A>' \
+            '<abbr title="/abbr">abbr</abbr><img\nalt="" src={0}/img.png /><a href="#top" name="aa">top</a></div>'
+        self.assertEqual(
+            make_links_absolute(test_html.format(""), self.newsletter), test_html.format(self.site_prefix)
+        )
+
+    def test_long_lines(self):
+        test_html = '<p>{0}</p><a href="/toto">This is a link</a>'.format('abcd ' * 600) + '<td></td>' * 200
+        fixed_html = make_links_absolute(test_html, self.newsletter)
+        self.assertTrue(max(len(line) for line in fixed_html.split('\n')) < 998)
+        self.assertEqual(fixed_html.count('abcd'), 600)
+        self.assertEqual(fixed_html.count('<td></td>'), 200)
+        self.assertTrue(fixed_html.find('<a href="{0}/toto">'.format(self.site_prefix)) > 0)
 
 
 class NewsletterFriendlyTemplateTagsTest(BaseTestCase):
@@ -1566,6 +1585,79 @@ class NewsletterFriendlyTemplateTagsTest(BaseTestCase):
         html = tpl.render(Context({'by_email': True}))
         self.assertEqual(1, html.count('<hr style="color: red;"/>'))
 
+    def test_css_variable(self):
+        template_content = """
+            {% load coop_utils %}
+            {% nlf_css newsletter_css %}
+                <a>One</a>
+            {% end_nlf_css %}
+        """
+        tpl = Template(template_content)
+        html = tpl.render(Context({'by_email': True, 'newsletter_css': 'a="color: red;"'}))
+        self.assertEqual(1, html.count('<a style="color: red;">'))
+        html = tpl.render(Context({'by_email': True}))
+        self.assertEqual(1, html.count('<a>One</a>'))
+
+    def test_css_url(self):
+        tpl = Template(self.template_content.format('td="background: url(http://example.com/a.png);"'))
+        html = tpl.render(Context({}))
+        self.assertIn('td { background: url(http://example.com/a.png); }', html)
+        html = tpl.render(Context({'by_email': True}))
+        self.assertEqual(4, html.count('<td style="background: url(http://example.com/a.png);">'))
+
+    def test_invalid_css_def(self):
+        self.assertRaises(TemplateSyntaxError, Template, self.template_content.format('a="color"'))
+        self.assertRaises(TemplateSyntaxError, Template, self.template_content.format('a="color: red;" table'))
+
+    def test_compiled_when_parsed(self):
+        tpl = Template(self.template_content.format('a="color: red;" "table.this-one td"="border: none;"'))
+        with patch('coop_cms.templatetags.coop_utils.compile_css_def') as compile_mock:
+            html = tpl.render(Context({'by_email': True}))
+        self.assertFalse(compile_mock.called)
+        self.assertEqual(3, html.count('<a style="color: red;">'))
+        self.assertEqual(2, html.count('<td style="border: none;">'))
+
+    def test_inline_once(self):
+        tpl = Template(self.template_content.format('a="color: red;"'))
+        inline_css.cache_clear()
+        with patch.object(CompiledCss, 'inline', autospec=True, side_effect=CompiledCss.inline) as inline_mock:
+            html1 = tpl.render(Context({'by_email': True}))
+            html2 = tpl.render(Context({'by_email': True}))
+        self.assertEqual(html1, html2)
+        self.assertEqual(inline_mock.call_count, 1)
+
+    def test_other_selectors(self):
+        """the selectors which are not made of tags, classes and ids are inlined by BeautifulSoup"""
+        template_content = """
+            {{% load coop_utils %}}
+            {{% nlf_css {0} %}}
+                <div><a>One</a><p><a>Two</a></p></div>
+            {{% end_nlf_css %}}
+        """
+        tpl = Template(template_content.format('"div > a"="color: red;"'))
+        html = tpl.render(Context({'by_email': True}))
+        self.assertEqual(1, html.count('<a style="color: red;">'))
+
+    def test_same_as_soup(self):
+        content = """
+            <div class="blue big" id="main"><a href="/" class="link">One</a><!-- <a> -->
+            <table class="this-one"><tr><td style="color: #fff">x</td><td>y</td></table>
+            <p><img src="x.png" alt="a > b"><br/><a style='font-family: "Arial";'>Two</a></p>
+            <script>var a = "<a>";</script></div><a>Three</a><span class="blue"><i><a>Four</a></i></span>
+        """
+        css_defs = [
+            ('a="color: red; background: blue;"', 'td="border: none;"', 'img="width: 100px;"'),
+            ('".blue a"="color: #fff"', 'a="color: #000"', '"table.this-one td"="padding: 0;"'),
+            ('"#main a.link"="color: red;"', '"div.big.blue p a"="margin: 0;"', '"*.blue"="padding: 0;"'),
+        ]
+        for css_def in css_defs:
+            compiled_css = CompiledCss(css_def)
+            self.assertTrue(compiled_css.is_simple)
+            self.assertEqual(
+                str(BeautifulSoup(compiled_css.inline(content), 'html.parser')),
+                str(BeautifulSoup(compiled_css._inline_with_soup(content), 'html.parser'))
+            )
+
 
 class HtmlFixTest(BaseTestCase):
     """Test dirty fixs for newsletter html"""
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""thumbnails generated in background"""
+
+from datetime import timedelta
+from io import BytesIO
+import os.path
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core import management
+from django.core.management.base import CommandError
+from django.core.cache import cache
+from django.core.files import File
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from model_mommy import mommy
+from PIL import Image as PilImage
+from sorl.thumbnail import default as sorl_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.engines.pil_engine import Engine as PilEngine
+from sorl.thumbnail.kvstores import base as kvstore_base, cached_db_kvstore
+
+from ..models import Image, ImageSize, ThumbnailJob
+from ..settings import get_article_class
+from ..thumbnail_backend import DraftBackendMixin, DraftEngine
+from ..thumbnails import (
+    get_cached_thumbnail, get_rebuild_backend, get_rebuild_jobs, get_thumbnail_urls, get_thumbnails,
+    prefetch_thumbnails, process_thumbnail_jobs, queue_thumbnails, rebuild_thumbnails
+)
+from . import MediaBaseTestCase
+
+
+@override_settings(COOP_CMS_THUMBNAILS_IN_BACKGROUND=True)
+class BackgroundThumbnailsTest(MediaBaseTestCase):
+    """thumbnails are queued and created by a command"""
+
+    def setUp(self):
+        super(BackgroundThumbnailsTest, self).setUp()
+        # The test images have always the same name: forget the thumbnails of other tests
+        cache.clear()
+
+    def test_upload_image_queue_jobs(self):
+        image_size = mommy.make(ImageSize, size="128x128", crop="center")
+        image = mommy.make(Image, size=image_size, _create_files=True)
+
+        geometries = set(ThumbnailJob.objects.values_list('geometry', flat=True))
+        self.assertEqual(geometries, {'64x64', '128x128'})
+        self.assertIsNone(get_cached_thumbnail(image.file, '128x128', crop='center'))
+
+    def test_get_absolute_url_not_generated(self):
+        image_size = mommy.make(ImageSize, size="128x128")
+        image = mommy.make(Image, size=image_size, _create_files=True)
+
+        self.assertEqual(image.get_absolute_url(), image.file.url)
+        self.assertEqual(image.as_thumbnail(), image.file)
+
+    def test_generate_thumbnails(self):
+        image_size = mommy.make(ImageSize, size="128x128", crop="center")
+        image = mommy.make(Image, size=image_size, _create_files=True)
+
+        management.call_command('generate_thumbnails', verbosity=0)
+
+        self.assertEqual(ThumbnailJob.objects.count(), 0)
+        thumbnail = get_cached_thumbnail(image.file, '128x128', crop='center')
+        self.assertIsNotNone(thumbnail)
+        self.assertEqual(image.get_absolute_url(), thumbnail.url)
+        self.assertNotEqual(image.as_thumbnail().url, image.file.url)
+
+    def test_queue_once(self):
+        image = mommy.make(Image, _create_files=True)
+        queue_thumbnails(image.file, [('64x64', {'crop': 'center'})])
+        queue_thumbnails(image.file, [('64x64', {'crop': 'center'})])
+        self.assertEqual(ThumbnailJob.objects.count(), 1)
+
+    def test_new_image_size(self):
+        image = mommy.make(Image, _create_files=True)
+        process_thumbnail_jobs()
+        image.size = mommy.make(ImageSize, size="32x32")
+
+        self.assertEqual(image.get_absolute_url(), image.file.url)
+
+        self.assertEqual(list(ThumbnailJob.objects.values_list('geometry', flat=True)), ['32x32'])
+        self.assertEqual(process_thumbnail_jobs(), (1, 0))
+        self.assertNotEqual(image.get_absolute_url(), image.file.url)
+
+    def test_wrong_size(self):
+        image_size = mommy.make(ImageSize, size="blabla")
+        image = mommy.make(Image, size=image_size, _create_files=True)
+
+        self.assertEqual(process_thumbnail_jobs(), (2, 1))
+        self.assertEqual(image.get_absolute_url(), image.file.url)
+
+    def test_unexpected_error(self):
+        images = [mommy.make(Image, _create_files=True) for _index in range(2)]
+        get_thumbnail = sorl_thumbnail.backend.get_thumbnail
+
+        def failing_get_thumbnail(file_, geometry_string, **options):
+            if file_ == images[0].file.name:
+                raise RuntimeError('unexpected')
+            return get_thumbnail(file_, geometry_string, **options)
+
+        with patch.object(sorl_thumbnail.backend, 'get_thumbnail', side_effect=failing_get_thumbnail):
+            self.assertEqual(process_thumbnail_jobs(), (2, 1))
+        self.assertEqual(ThumbnailJob.objects.count(), 0)
+        self.assertIsNone(get_cached_thumbnail(images[0].file, '64x64', crop='center'))
+        self.assertIsNotNone(get_cached_thumbnail(images[1].file, '64x64', crop='center'))
+
+    @override_settings(COOP_CMS_ARTICLE_LOGO_SIZE="32x32", COOP_CMS_HEADLINE_IMAGE_SIZE="100")
+    def test_article_logo(self):
+        article = get_article_class().objects.create(title="test", logo=File(self._get_file('unittest1.png')))
+
+        geometries = set(ThumbnailJob.objects.values_list('geometry', flat=True))
+        self.assertEqual(geometries, {'32x32', '100', '60x60'})
+        self.assertTrue(article.logo_thumbnail().url.endswith(article.logo.name))
+
+        process_thumbnail_jobs()
+
+        self.assertFalse(article.logo_thumbnail().url.endswith(article.logo.name))
+        self.assertNotEqual(article.get_headline_image(), article.logo.url)
+        self.assertNotIn(article.logo.url, article.logo_list_display())
+        self.assertEqual(ThumbnailJob.objects.count(), 0)
+
+
+class SyncThumbnailsTest(MediaBaseTestCase):
+    """default : thumbnails are created during the request"""
+
+    def test_no_job(self):
+        image_size = mommy.make(ImageSize, size="128x128")
+        image = mommy.make(Image, size=image_size, _create_files=True)
+
+        self.assertNotEqual(image.get_absolute_url(), image.file.url)
+        self.assertEqual(ThumbnailJob.objects.count(), 0)
+
+
+class BulkThumbnailsTest(MediaBaseTestCase):
+    """get the thumbnails of several images at once"""
+
+    def setUp(self):
+        super(BulkThumbnailsTest, self).setUp()
+        cache.clear()
+
+    def test_get_thumbnails(self):
+        images = [mommy.make(Image, _create_files=True) for _index in range(3)]
+
+        thumbnails = get_thumbnails([image.file for image in images], '32x32', crop='center')
+
+        self.assertEqual(len(thumbnails), 3)
+        for thumbnail in thumbnails:
+            self.assertEqual(thumbnail.width, 32)
+
+    def test_get_thumbnails_one_query(self):
+        images = [mommy.make(Image, _create_files=True) for _index in range(3)]
+        urls = get_thumbnail_urls(images, '32x32', crop='center')
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_thumbnail_urls(images, '32x32', crop='center'), urls)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_thumbnail_urls(images, '32x32', crop='center'), urls)
+
+    @override_settings(COOP_CMS_THUMBNAILS_IN_BACKGROUND=True)
+    def test_get_thumbnail_urls_background(self):
+        images = [mommy.make(Image, _create_files=True) for _index in range(2)]
+        ThumbnailJob.objects.all().delete()
+
+        urls = get_thumbnail_urls(images, '32x32')
+
+        self.assertEqual(urls, [image.file.url for image in images])
+        self.assertEqual(list(ThumbnailJob.objects.values_list('geometry', flat=True)), ['32x32', '32x32'])
+        process_thumbnail_jobs()
+        self.assertNotEqual(get_thumbnail_urls(images, '32x32'), urls)
+
+    def test_prefetch_thumbnails(self):
+        images = [mommy.make(Image, _create_files=True) for _index in range(2)]
+        prefetch_thumbnails(images)
+
+        with self.assertNumQueries(0):
+            for image in images:
+                self.assertNotEqual(image.as_thumbnail().url, image.file.url)
+
+    def test_admin_changelist(self):
+        mommy.make(Image, _create_files=True)
+        self._log_as_mediamgr()
+        User.objects.filter(username='toto').update(is_superuser=True)
+
+        response = self.client.get(reverse('admin:coop_cms_image_changelist'))
+
+        self.assertEqual(response.status_code, 200)
+
+
+class SorlThumbnailApiTest(MediaBaseTestCase):
+    """coop_cms.thumbnails uses some private APIs of sorl-thumbnail: check them when upgrading it"""
+
+    def test_private_api(self):
+        for obj, attr in (
+            (ThumbnailBackend, '_create_thumbnail'),
+            (ThumbnailBackend, '_get_format'),
+            (ThumbnailBackend, '_get_thumbnail_filename'),
+            (kvstore_base, 'add_prefix'),
+            (cached_db_kvstore, 'EMPTY_VALUE'),
+            (cached_db_kvstore.KVStore, '_cached_db_kvstore'),
+        ):
+            self.assertTrue(
+                hasattr(obj, attr),
+                "{0}.{1} doesn't exist: check coop_cms.thumbnails with this version of sorl-thumbnail".format(
+                    obj.__name__, attr
+                )
+            )
+
+    def test_same_thumbnail_as_sorl(self):
+        image = mommy.make(Image, _create_files=True)
+        cache.clear()
+
+        thumbnail = sorl_thumbnail.backend.get_thumbnail(image.file, '32x32', crop='center')
+
+        cached_thumbnail = get_cached_thumbnail(image.file, '32x32', crop='center')
+        self.assertIsNotNone(cached_thumbnail)
+        self.assertEqual(cached_thumbnail.name, thumbnail.name)
+        thumbnails = get_thumbnails([image.file], '32x32', crop='center')
+        self.assertEqual([thumbnail.name], [item.name for item in thumbnails])
+
+
+class RebuildThumbnailsTest(MediaBaseTestCase):
+    """rebuild_thumbnails command"""
+
+    def setUp(self):
+        super(RebuildThumbnailsTest, self).setUp()
+        cache.clear()
+
+    def _get_jobs_geometries(self, **kwargs):
+        return sorted(geometry for (_file_name, geometry, _options) in get_rebuild_jobs(**kwargs))
+
+    @override_settings(COOP_CMS_THUMBNAILS_IN_BACKGROUND=True)
+    def test_rebuild_thumbnails(self):
+        image_size = mommy.make(ImageSize, size="32x32", crop="center")
+        image = mommy.make(Image, size=image_size, _create_files=True)
+        ThumbnailJob.objects.all().delete()
+
+        management.call_command('rebuild_thumbnails', verbosity=0)
+
+        self.assertIsNotNone(get_cached_thumbnail(image.file, '32x32', crop='center'))
+        self.assertNotEqual(image.get_absolute_url(), image.file.url)
+
+        jobs_args = get_rebuild_jobs()
+        self.assertEqual(rebuild_thumbnails(jobs_args), {'created': 0, 'up-to-date': 2, 'failed': 0})
+
+    def test_rebuild_older_thumbnail(self):
+        image = mommy.make(Image, _create_files=True)
+        thumbnail = image.as_thumbnail()
+        thumbnail_path = thumbnail.storage.path(thumbnail.name)
+        os.utime(thumbnail_path, (0, 0))
+
+        self.assertEqual(rebuild_thumbnails(get_rebuild_jobs()), {'created': 1, 'up-to-date': 0, 'failed': 0})
+        self.assertGreater(os.path.getmtime(thumbnail_path), 0)
+        self.assertEqual(image.as_thumbnail().url, thumbnail.url)
+
+    def test_rebuild_failed_keep_thumbnail(self):
+        image = mommy.make(Image, _create_files=True)
+        thumbnail = image.as_thumbnail()
+        thumbnail_path = thumbnail.storage.path(thumbnail.name)
+        os.utime(thumbnail_path, (0, 0))
+
+        with patch.object(DraftBackendMixin.draft_engine, 'create', side_effect=ValueError('image has wrong mode')):
+            self.assertEqual(rebuild_thumbnails(get_rebuild_jobs()), {'created': 0, 'up-to-date': 0, 'failed': 1})
+
+        self.assertTrue(os.path.exists(thumbnail_path))
+        self.assertEqual(os.path.getmtime(thumbnail_path), 0)
+        self.assertEqual(get_cached_thumbnail(image.file, '64x64', crop='center').name, thumbnail.name)
+
+    @override_settings(COOP_CMS_ARTICLE_LOGO_SIZE="32x32", COOP_CMS_HEADLINE_IMAGE_SIZE="100")
+    def test_article_logos(self):
+        get_article_class().objects.create(title="test", logo=File(self._get_file('unittest1.png')))
+        self.assertEqual(self._get_jobs_geometries(), ['100', '32x32', '60x60'])
+
+    def test_only_size(self):
+        mommy.make(ImageSize, name="small", size="32x32")
+        mommy.make(Image, _create_files=True)
+        self.assertEqual(self._get_jobs_geometries(), ['32x32', '64x64'])
+        self.assertEqual(self._get_jobs_geometries(only_size='32x32'), ['32x32'])
+
+        management.call_command('rebuild_thumbnails', only_size='small', verbosity=0)
+        self.assertEqual(rebuild_thumbnails(get_rebuild_jobs()), {'created': 1, 'up-to-date': 1, 'failed': 0})
+
+    def test_since(self):
+        image = mommy.make(Image, _create_files=True)
+        self.assertEqual(self._get_jobs_geometries(since=image.modified), ['64x64'])
+        self.assertEqual(self._get_jobs_geometries(since=image.modified + timedelta(days=1)), [])
+
+        management.call_command('rebuild_thumbnails', since='2100-01-01', verbosity=0)
+        self.assertEqual(rebuild_thumbnails(get_rebuild_jobs()), {'created': 1, 'up-to-date': 0, 'failed': 0})
+
+    def test_draft_backend(self):
+        image = mommy.make(Image, _create_files=True)
+        draft_engine = DraftBackendMixin.draft_engine
+
+        with patch.object(draft_engine, 'create', wraps=draft_engine.create) as create:
+            self.assertEqual(rebuild_thumbnails(get_rebuild_jobs()), {'created': 1, 'up-to-date': 0, 'failed': 0})
+            self.assertTrue(create.called)
+
+        # The engine of sorl-thumbnail is not changed: the other threads still use it
+        self.assertIs(sorl_thumbnail.engine.__class__, PilEngine)
+        self.assertNotEqual(image.as_thumbnail().url, image.file.url)
+
+    @override_settings(THUMBNAIL_ENGINE='coop_cms.thumbnail_backend.DraftEngine')
+    def test_draft_engine_in_settings(self):
+        self.assertIs(get_rebuild_backend(), sorl_thumbnail.backend)
+
+    def test_invalid_since(self):
+        self.assertRaises(CommandError, management.call_command, 'rebuild_thumbnails', since='01/01/2020', verbosity=0)
+
+    def test_shared_file(self):
+        image1 = mommy.make(Image, _create_files=True)
+        mommy.make(Image, file=image1.file.name)
+        self.assertEqual(self._get_jobs_geometries(), ['64x64'])
+
+
+class DraftEngineTest(MediaBaseTestCase):
+    """fast thumbnail engine"""
+
+    def _get_image(self, image_format, mode='RGB'):
+        data = BytesIO()
+        PilImage.new('RGB', (1600, 800), (200, 100, 50)).convert(mode).save(data, format=image_format)
+        data.seek(0)
+        return PilImage.open(data)
+
+    def _get_options(self, **kwargs):
+        options = dict(sorl_thumbnail.backend.default_options, cropbox=None)
+        options.update(kwargs)
+        return options
+
+    def test_jpeg_draft(self):
+        engine = DraftEngine()
+        image = engine._draft(self._get_image('JPEG'), (100, 100), self._get_options())
+        self.assertEqual(image.size, (200, 100))
+        image = engine._draft(self._get_image('JPEG'), (100, 100), self._get_options(crop='center'))
+        self.assertEqual(image.size, (400, 200))
+
+    def test_png_reduce(self):
+        engine = DraftEngine()
+        image = engine._draft(self._get_image('PNG'), (100, 100), self._get_options())
+        self.assertEqual(image.size, (200, 100))
+
+    def test_palette_not_reduced(self):
+        engine = DraftEngine()
+        for image_format, mode in (('GIF', 'P'), ('PNG', 'P'), ('PNG', '1')):
+            image = self._get_image(image_format, mode)
+            self.assertEqual(image.mode, mode)
+            self.assertEqual(engine._draft(image, (100, 100), self._get_options()).size, (1600, 800))
+            image = engine.create(self._get_image(image_format, mode), (100, 100), self._get_options())
+            self.assertEqual(image.size, (100, 50))
+
+    def test_no_draft(self):
+        engine = DraftEngine()
+        image = engine._draft(self._get_image('JPEG'), (1000, 1000), self._get_options())
+        self.assertEqual(image.size, (1600, 800))
+
+    def test_create(self):
+        engine = DraftEngine()
+        for image_format in ('JPEG', 'PNG'):
+            image = engine.create(self._get_image(image_format), (100, 100), self._get_options())
+            self.assertEqual(image.size, (100, 50))
+            image = engine.create(self._get_image(image_format), (100, 100), self._get_options(crop='center'))
+            self.assertEqual(image.size, (100, 100))
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import html
+import os.path
+import re
+
+from ..moves import HTMLParser
 from ..utils import dehtml
 from . import BaseArticleTest
 
@@ -49,3 +54,78 @@ class DehtmlTest(BaseArticleTest):
         text = "This \xf6is \xe4 simple text\xfc"
         html_text = "This &ouml;is &auml; simple text&uuml;"
         self.assertEqual(dehtml(html_text), text)
+
+
+class _LegacyDeHTMLParser(HTMLParser):
+    """the previous implementation of dehtml: reference for the parity"""
+    def __init__(self, allow_spaces=False, allow_html_chars=False):
+        HTMLParser.__init__(self)
+        self._text = []
+        self._allow_spaces = allow_spaces
+        self._allow_html_chars = allow_html_chars
+
+    def handle_data(self, data):
+        self._text.append(data if self._allow_spaces else re.sub('[ \t\r\n]+', ' ', data))
+
+    def handle_entityref(self, name):
+        html_char = '&' + name + ";"
+        self._text.append(html_char if self._allow_html_chars else html.unescape(html_char).replace('\xa0', ' '))
+
+    def handle_charref(self, name):
+        self.handle_entityref("#" + name)
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'p':
+            self._text.append('\n\n')
+        elif tag == 'br':
+            self._text.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == 'br':
+            self._text.append('\n\n')
+
+    def text(self):
+        return ''.join(self._text).strip()
+
+
+def _legacy_dehtml(text, allow_spaces=False, allow_html_chars=False):
+    parser = _LegacyDeHTMLParser(allow_spaces=allow_spaces, allow_html_chars=allow_html_chars)
+    parser.feed(text)
+    parser.close()
+    return parser.text()
+
+
+class DehtmlParityTest(BaseArticleTest):
+    """dehtml gives the same text than the previous HTMLParser implementation"""
+
+    def _assert_parity(self, html_text):
+        for allow_spaces in (False, True):
+            for allow_html_chars in (False, True):
+                self.assertEqual(
+                    dehtml(html_text, allow_spaces=allow_spaces, allow_html_chars=allow_html_chars),
+                    _legacy_dehtml(html_text, allow_spaces=allow_spaces, allow_html_chars=allow_html_chars),
+                    html_text
+                )
+
+    def test_parity(self):
+        html_texts = [
+            '<style>p {color:  red}</style><p>Hi &amp; &nbsp;x&#10;y</p>',
+            'a <b> b', 'a < b', 'x<>y', 'a <3 b', 'a <b', 'a & b &amp c', 'x &amp', 'x &#10',
+            '<br>x<br/>y<br />z<p/>w', '<P>Up</P><BR>x', '<p\nclass="a">x</p >y<br\n/>', '<pre>x</pre>',
+            'x <!-- c <p> --> y', '<script>if (a<b) {x}</script>t', '<STYLE>a  b</STYLE >c',
+            '<a href=/x/>l</a>', '<a title="x>y" class=\'a>b\'>t</a>', '<form action="x"">y</form>',
+            '<title>T</title>',
+            '&#10a; &#x41; &#65;b &foo; &a.b; & ; &Eacute;t&eacute;', '1 &lt;p&gt; 2',
+            '<!DOCTYPE html><html>t</html>', '<![CDATA[x]]>y', '<?xml version="1.0"?>z', 'a</ b>c',
+            '<div>a</div>\n\n<div>  b\t\r\n </div>',
+        ]
+        for html_text in html_texts:
+            self._assert_parity(html_text)
+
+    def test_parity_templates(self):
+        templates_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
+        for dir_path, _dir_names, file_names in os.walk(templates_dir):
+            for file_name in file_names:
+                if file_name.endswith('.html'):
+                    with open(os.path.join(dir_path, file_name), encoding='utf-8') as template_file:
+                        self._assert_parity(template_file.read())
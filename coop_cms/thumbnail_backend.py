@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
-"""custom backend for sorl-thumbnail: keep image file name"""
+"""custom backend and engine for sorl-thumbnail"""
 
 import os.path
 
 from sorl.thumbnail.base import ThumbnailBackend, EXTENSIONS
 from sorl.thumbnail.conf import settings
-from sorl.thumbnail.helpers import tokey, serialize
+from sorl.thumbnail.engines.pil_engine import Engine as PilEngine
+from sorl.thumbnail.helpers import serialize, tokey, toint
+from sorl.thumbnail.parsers import parse_geometry
 
 
 # activated by adding following line to the settings.py
@@ -26,3 +28,58 @@ class KeepNameThumbnailBackend(ThumbnailBackend):
         image_format = options['format']
 
         return '{0}{1}.{2}'.format(settings.THUMBNAIL_PREFIX, path, EXTENSIONS[image_format])
+
+
+# activated by adding following line to the settings.py
+# THUMBNAIL_ENGINE = 'coop_cms.thumbnail_backend.DraftEngine'
+# It is always used by the rebuild_thumbnails command
+
+class DraftEngine(PilEngine):
+    """
+    PIL engine using the fast paths of Pillow: a JPEG is decoded at a lower scale by draft() and other images are
+    reduced by an integer factor by reduce() before being resized. The image is kept at least twice larger than
+    the thumbnail: the quality is the same
+    """
+    # reduce() averages the pixels: not possible for palette (GIF) or bilevel images
+    REDUCE_MODES = ('L', 'LA', 'La', 'I', 'F', 'RGB', 'RGBA', 'RGBa', 'RGBX', 'CMYK', 'YCbCr')
+
+    def create(self, image, geometry, options):
+        """Processing conductor, returns the thumbnail as an image engine instance"""
+        if not options['cropbox']:
+            image = self._draft(image, geometry, options)
+        return super(DraftEngine, self).create(image, geometry, options)
+
+    def _draft(self, image, geometry, options):
+        """returns the image at the lowest scale which keeps twice the size of the thumbnail"""
+        x_image, y_image = map(float, self.get_image_size(image))
+        if self.flip_dimensions(image):
+            factor = self._calculate_scaling_factor(y_image, x_image, geometry, options) * 2
+        else:
+            factor = self._calculate_scaling_factor(x_image, y_image, geometry, options) * 2
+        if factor >= 1:
+            return image
+
+        if image.format == 'JPEG':
+            image.draft(image.mode, (toint(x_image * factor), toint(y_image * factor)))
+        elif image.mode in self.REDUCE_MODES and not self._get_exif_orientation(image):
+            # reduce() returns a new image without the exif data: only if there is no orientation to apply
+            reducing_factor = int(1 / factor)
+            if reducing_factor > 1:
+                image = image.reduce(reducing_factor)
+        return image
+
+
+class DraftBackendMixin(object):
+    """
+    Backend creating the thumbnails with the DraftEngine: used by the rebuild_thumbnails command if sorl-thumbnail
+    is configured with its PIL engine. The engine of sorl-thumbnail is not changed
+    """
+    draft_engine = DraftEngine()
+
+    def _create_thumbnail(self, source_image, geometry_string, options, thumbnail):
+        """Creates the thumbnail: same as ThumbnailBackend._create_thumbnail with the DraftEngine"""
+        ratio = self.draft_engine.get_image_ratio(source_image, options)
+        geometry = parse_geometry(geometry_string, ratio)
+        image = self.draft_engine.create(source_image, geometry, options)
+        self.draft_engine.write(image, options, thumbnail)
+        thumbnail.set_size(self.draft_engine.get_image_size(image))
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+Thumbnails generated in background
+
+sorl-thumbnail creates a thumbnail the first time it is requested: the full image is decoded and resized during the
+web request. When COOP_CMS_THUMBNAILS_IN_BACKGROUND is set, the request only reads the key value store of
+sorl-thumbnail. The missing thumbnails are queued as ThumbnailJob and created by the generate_thumbnails command.
+
+The rebuild_thumbnails command creates again all the thumbnails: for example after changing an ImageSize
+
+The key value store is read without creating the thumbnails with some private APIs of sorl-thumbnail. Its version
+is pinned in setup.py and test_thumbnails.SorlThumbnailApiTest fails if they change.
+"""
+
+from functools import lru_cache
+import json
+from multiprocessing import Pool
+
+from django.core.files.storage import default_storage
+from django.db import connections
+from sorl.thumbnail import default as sorl_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults, settings as sorl_settings
+from sorl.thumbnail.engines.pil_engine import Engine as PilEngine
+from sorl.thumbnail.helpers import get_module_class, tokey
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore as KVStoreModel
+from sorl.thumbnail.parsers import ThumbnailParseError
+
+from .settings import (
+    generate_thumbnails_in_background, get_article_class, get_article_logo_crop, get_article_logo_size,
+    get_headline_image_crop, get_headline_image_size, get_max_image_width, logger
+)
+from .thumbnail_backend import DraftBackendMixin
+
+
+ADMIN_THUMBS_SIZE = '60x60'
+IMAGE_THUMBNAIL_SIZE = '64x64'
+
+THUMBNAIL_CREATED, THUMBNAIL_UP_TO_DATE, THUMBNAIL_FAILED = 'created', 'up-to-date', 'failed'
+
+# thumbnails of the default logo by (file name, size, crop): the same for all articles. See get_default_logo_thumbnail
+_default_logo_thumbnails = {}
+
+
+def _get_thumbnail_options(source, options):
+    """complete the options with default values: same rules than sorl ThumbnailBackend.get_thumbnail"""
+    backend = sorl_thumbnail.backend
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def _get_thumbnail_file(file_, geometry, options):
+    """returns the ImageFile of the thumbnail: it may not exist"""
+    source = ImageFile(file_)
+    options = _get_thumbnail_options(source, options)
+    name = sorl_thumbnail.backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, sorl_thumbnail.storage)
+
+
+def get_cached_thumbnail(file_, geometry, **options):
+    """returns the thumbnail if it has already been generated or None. The image file is not read"""
+    return sorl_thumbnail.kvstore.get(_get_thumbnail_file(file_, geometry, options))
+
+
+def _get_many_from_kvstore(image_files):
+    """
+    returns the list of the stored image files or None if not in key value store
+    The cached db key value store is read with one cache get_many and one db query for the cache misses
+    """
+    kvstore = sorl_thumbnail.kvstore
+    if not getattr(kvstore, '_cached_db_kvstore', False):
+        return [kvstore.get(image_file) for image_file in image_files]
+
+    keys = [add_prefix(image_file.key) for image_file in image_files]
+    values = kvstore.cache.get_many(keys)
+    missing_keys = [key for key in keys if key not in values]
+    if missing_keys:
+        db_values = dict(KVStoreModel.objects.filter(key__in=missing_keys).values_list('key', 'value'))
+        # Same as the key value store : remember the misses for avoiding further db lookups
+        missing_values = dict((key, db_values.get(key, EMPTY_VALUE)) for key in missing_keys)
+        kvstore.cache.set_many(missing_values, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(missing_values)
+    return [
+        deserialize_image_file(values[key]) if values[key] != EMPTY_VALUE else None
+        for key in keys
+    ]
+
+
+def get_thumbnails(files, geometry, **options):
+    """
+    returns the list of the thumbnails of several image files. None for a thumbnail which can not be created
+    The key value store is read once for all the files. The missing thumbnails are created or queued in
+    background mode
+    """
+    thumbnails = _get_many_from_kvstore([_get_thumbnail_file(file_, geometry, options) for file_ in files])
+    missing_files = [file_ for (file_, thumbnail) in zip(files, thumbnails) if not thumbnail]
+    if missing_files and generate_thumbnails_in_background():
+        _queue_jobs([(file_, geometry, options) for file_ in missing_files])
+    elif missing_files:
+        for index, file_ in enumerate(files):
+            if not thumbnails[index]:
+                try:
+                    thumbnails[index] = sorl_thumbnail.backend.get_thumbnail(file_, geometry, **options)
+                except (IOError, ThumbnailParseError):
+                    pass
+    return thumbnails
+
+
+def get_thumbnail_urls(images, geometry, **options):
+    """returns the list of the thumbnail urls of several images: the image url if the thumbnail doesn't exist"""
+    thumbnails = get_thumbnails([image.file for image in images], geometry, **options)
+    return [
+        thumbnail.url if thumbnail else image.file.url
+        for (image, thumbnail) in zip(images, thumbnails)
+    ]
+
+
+def prefetch_thumbnails(images):
+    """get the thumbnails of a list of images at once: Image.as_thumbnail will not access the key value store"""
+    images = [image for image in images if image.file]
+    thumbnails = get_thumbnails([image.file for image in images], IMAGE_THUMBNAIL_SIZE, crop='center')
+    for image, thumbnail in zip(images, thumbnails):
+        image._prefetched_thumbnail = thumbnail or image.file
+
+
+def _get_job_key(file_name, geometry, options):
+    """unique key of a thumbnail job"""
+    return tokey(file_name, geometry, options)
+
+
+def queue_thumbnails(file_, geometries):
+    """
+    queue a job for every geometry. A job already queued is not duplicated
+    file_ : the image file
+    geometries : list of (geometry, options) tuples
+    """
+    _queue_jobs([(file_, geometry, options) for (geometry, options) in geometries])
+
+
+def _queue_jobs(jobs_args):
+    """queue jobs : jobs_args is a list of (file, geometry, options) tuples"""
+    from .models import ThumbnailJob
+
+    jobs = []
+    for file_, geometry, options in jobs_args:
+        file_name = ImageFile(file_).name
+        json_options = json.dumps(options, sort_keys=True)
+        jobs.append(
+            ThumbnailJob(
+                key=_get_job_key(file_name, geometry, json_options),
+                file_name=file_name,
+                geometry=geometry,
+                options=json_options
+            )
+        )
+    ThumbnailJob.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+def get_thumbnail(file_, geometry, **options):
+    """
+    returns the thumbnail of the image file
+    In background mode, returns None and queue a job if the thumbnail doesn't exist yet
+    """
+    if not generate_thumbnails_in_background():
+        return sorl_thumbnail.backend.get_thumbnail(file_, geometry, **options)
+    thumbnail = get_cached_thumbnail(file_, geometry, **options)
+    if not thumbnail:
+        queue_thumbnails(file_, [(geometry, options)])
+    return thumbnail
+
+
+def get_default_logo_thumbnail(logo_file, size, crop):
+    """
+    returns the thumbnail of the default logo of the articles or None if it can not be created yet
+    It is computed once by process. The key value store is still read: the thumbnail may have been cleared
+    by another process (ex: "python manage.py thumbnail clear")
+    """
+    key = (logo_file.name, size, crop)
+    thumbnail = _default_logo_thumbnails.get(key)
+    if thumbnail is not None and not sorl_thumbnail.kvstore.get(thumbnail):
+        thumbnail = None
+    if thumbnail is None:
+        try:
+            thumbnail = get_thumbnail(logo_file, size, crop=crop)
+        except IOError:
+            thumbnail = None
+        if thumbnail:
+            # not memoized if missing: it may be generated later
+            _default_logo_thumbnails[key] = thumbnail
+    return thumbnail
+
+
+def clear_default_logo_thumbnails():
+    """forget the thumbnails of the default logo"""
+    _default_logo_thumbnails.clear()
+
+
+def get_image_geometries(image, image_sizes=None):
+    """
+    list of the thumbnails used for an image of the media library
+    image_sizes : list of the ImageSize. If None, they are read from the database
+    """
+    from .models import ImageSize
+
+    geometries = [(IMAGE_THUMBNAIL_SIZE, {'crop': 'center'})]
+    max_width = get_max_image_width(image)
+    max_width = int(max_width) if max_width else 0
+    if max_width and (image.width is None or max_width < image.width):
+        geometries.append((str(max_width), {'upscale': False}))
+    if image_sizes is None:
+        image_sizes = ImageSize.objects.all()
+    for image_size in image_sizes:
+        geometries.append((image_size.size, {'crop': image_size.crop or None}))
+    return geometries
+
+
+def get_article_logo_geometries(article):
+    """list of the thumbnails used for the logo of an article"""
+    logo_crop = get_article_logo_crop(article)
+    return [
+        (get_article_logo_size(article), {'crop': logo_crop}),
+        (get_headline_image_size(article), {'crop': get_headline_image_crop(article) or logo_crop}),
+        (ADMIN_THUMBS_SIZE, {}),
+    ]
+
+
+def _generate_thumbnail(job_args):
+    """create a thumbnail: called in a worker process"""
+    file_name, geometry, options = job_args
+    try:
+        sorl_thumbnail.backend.get_thumbnail(file_name, geometry, **json.loads(options))
+        return True
+    except (IOError, ThumbnailParseError, ValueError):
+        return False
+    except Exception:  # pylint: disable=broad-except
+        # The other jobs of the batch must be processed and deleted: a failing job would block the next runs
+        logger.exception("generate thumbnail %s %s", file_name, geometry)
+        return False
+
+
+def process_thumbnail_jobs(limit=None, processes=1):
+    """
+    create the thumbnails of the queued jobs
+    limit : max number of jobs to process
+    processes : number of worker processes. If 1, the thumbnails are created in the current process
+    returns a tuple : (number of jobs, number of failures)
+    """
+    from .models import ThumbnailJob
+
+    jobs = ThumbnailJob.objects.order_by('created', 'id')
+    if limit:
+        jobs = jobs[:limit]
+    jobs = list(jobs.values_list('id', 'file_name', 'geometry', 'options'))
+    if not jobs:
+        return 0, 0
+
+    jobs_args = [job[1:] for job in jobs]
+    if processes > 1:
+        # The db connections must not be shared with the forked processes
+        connections.close_all()
+        with Pool(processes) as pool:
+            results = pool.map(_generate_thumbnail, jobs_args)
+    else:
+        results = [_generate_thumbnail(job_args) for job_args in jobs_args]
+
+    # A failing job is not retried: the thumbnail will be queued again next time it is requested
+    ThumbnailJob.objects.filter(id__in=[job[0] for job in jobs]).delete()
+    return len(jobs), results.count(False)
+
+
+def get_rebuild_jobs(since=None, only_size=None):
+    """
+    list of the (file name, geometry, json options) of the thumbnails of the images and of the article logos
+    since : only the images and articles modified since this datetime
+    only_size : only the thumbnails with this geometry
+    """
+    from .models import Image, ImageSize
+
+    images = Image.objects.exclude(file='')
+    articles = get_article_class().objects.exclude(logo='')
+    if since:
+        images = images.filter(modified__gte=since)
+        articles = articles.filter(modified__gte=since)
+
+    sources = []
+    image_sizes = list(ImageSize.objects.all())
+    for image in images.only('id', 'file', 'width').iterator():
+        sources.append((image.file, get_image_geometries(image, image_sizes)))
+    for article in articles.iterator():
+        sources.append((article.logo, get_article_logo_geometries(article)))
+
+    # The same file may be shared by several media: its thumbnails are created once
+    jobs = {}
+    for file_, geometries in sources:
+        for geometry, options in geometries:
+            if only_size and geometry != only_size:
+                continue
+            job_args = (ImageFile(file_).name, geometry, json.dumps(options, sort_keys=True))
+            jobs.setdefault(job_args, job_args)
+    return list(jobs)
+
+
+@lru_cache()
+def _get_draft_backend_class(backend_class):
+    """the backend class of the settings creating the thumbnails with the DraftEngine"""
+    return type('Draft' + backend_class.__name__, (DraftBackendMixin, backend_class), {})
+
+
+def get_rebuild_backend():
+    """
+    returns the backend creating the thumbnails of the rebuild_thumbnails command: with the DraftEngine if
+    sorl-thumbnail is configured with its PIL engine
+    """
+    if get_module_class(sorl_settings.THUMBNAIL_ENGINE) is not PilEngine:
+        return sorl_thumbnail.backend
+    return _get_draft_backend_class(get_module_class(sorl_settings.THUMBNAIL_BACKEND))()
+
+
+def _is_thumbnail_up_to_date(file_name, thumbnail):
+    """True if the thumbnail file exists and is more recent than the image file"""
+    try:
+        thumbnail_time = thumbnail.storage.get_modified_time(thumbnail.name)
+        return thumbnail_time >= default_storage.get_modified_time(file_name)
+    except NotImplementedError:
+        return thumbnail.exists()
+    except (IOError, OSError):
+        return False
+
+
+class _ReplacedImageFile(ImageFile):
+    """a thumbnail whose existing file is deleted only when the new one is written"""
+
+    def write(self, content):
+        if self.exists():
+            self.delete()
+        return super(_ReplacedImageFile, self).write(content)
+
+
+def _replace_thumbnail(backend, file_name, geometry, options, thumbnail):
+    """
+    create the thumbnail again: same steps as sorl ThumbnailBackend.get_thumbnail when the file is missing
+    The existing file is kept if the new thumbnail can't be created
+    """
+    source = ImageFile(file_name)
+    options = _get_thumbnail_options(source, options)
+    engine = sorl_thumbnail.engine
+    source_image = engine.prepare(engine.get_image(source), options)
+    options['image_info'] = engine.get_image_info(source_image)
+    source.set_size(engine.get_image_size(source_image))
+    new_thumbnail = _ReplacedImageFile(thumbnail.name, thumbnail.storage)
+    try:
+        backend._create_thumbnail(source_image, geometry, options, new_thumbnail)
+    finally:
+        engine.cleanup(source_image)
+    sorl_thumbnail.kvstore.get_or_set(source)
+    sorl_thumbnail.kvstore.set(new_thumbnail, source)
+
+
+def _rebuild_thumbnail(job_args):
+    """create a thumbnail if missing or older than its image: called in a worker process"""
+    file_name, geometry, options = job_args
+    options = json.loads(options)
+    backend = get_rebuild_backend()
+    try:
+        thumbnail = _get_thumbnail_file(file_name, geometry, options)
+        if _is_thumbnail_up_to_date(file_name, thumbnail):
+            # Only stored in the key value store if not done yet
+            backend.get_thumbnail(file_name, geometry, **options)
+            return THUMBNAIL_UP_TO_DATE
+        _replace_thumbnail(backend, file_name, geometry, options, thumbnail)
+        return THUMBNAIL_CREATED
+    except (IOError, ThumbnailParseError, ValueError):
+        return THUMBNAIL_FAILED
+
+
+def rebuild_thumbnails(jobs_args, processes=1):
+    """
+    create the thumbnails which are missing or older than their image
+    jobs_args : list of (file name, geometry, json options) tuples. See get_rebuild_jobs
+    processes : number of worker processes. If 1, the thumbnails are created in the current process
+    returns a dict : number of thumbnails by status (created, up-to-date, failed)
+    """
+    if processes > 1 and len(jobs_args) > 1:
+        # The db connections must not be shared with the forked processes
+        connections.close_all()
+        with Pool(processes) as pool:
+            results = pool.map(_rebuild_thumbnail, jobs_args, chunksize=8)
+    else:
+        results = [_rebuild_thumbnail(job_args) for job_args in jobs_args]
+    return dict(
+        (status, results.count(status)) for status in (THUMBNAIL_CREATED, THUMBNAIL_UP_TO_DATE, THUMBNAIL_FAILED)
+    )
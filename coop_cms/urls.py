@@ -6,7 +6,7 @@ from django.urls import include, path, re_path
 
 from . import sitemap
 from .settings import (
-    get_article_views, install_csrf_failure_view, change_site_domain
+    get_article_views, install_csrf_failure_view, change_site_domain, use_async_views
 )
 from .views.newsletters import NewsletterView, NewsletterPdfView
 from .views import articles, fragments, homepage, links, navigation, newsletters, medialib, webutils
@@ -16,6 +16,11 @@ article_views = get_article_views()
 article_view = article_views['article_view']
 edit_article_view = article_views['edit_article_view']
 
+if use_async_views():
+    homepage_view, alias_view = homepage.async_homepage, articles.AsyncAliasView
+else:
+    homepage_view, alias_view = homepage.homepage, articles.AliasView
+
 install_csrf_failure_view()
 change_site_domain()
 
@@ -126,9 +131,9 @@ if 'coop_cms.apps.test_app' in settings.INSTALLED_APPS:
 urlpatterns += [
     re_path(r'(?P<url>[-\w]+)/cms_publish/$', articles.publish_article, name='coop_cms_publish_article'),
     re_path(r'^(?P<url>[-\w]+)/cms_cancel/$', articles.cancel_edit_article, name='coop_cms_cancel_edit_article'),
-    path('', homepage.homepage, name='coop_cms_homepage'),
+    path('', homepage_view, name='coop_cms_homepage'),
     re_path(r'^(?P<slug>[-\w]+)/cms_edit/$', edit_article_view.as_view(edit_mode=True), name='coop_cms_edit_article'),
     re_path(r'^(?P<slug>[-\w]+)/$', article_view.as_view(), name='coop_cms_view_article'),
-    re_path(r'^(?P<path>.+)$', articles.AliasView.as_view(), name='coop_cms_view_alias'),
+    re_path(r'^(?P<path>.+)$', alias_view.as_view(), name='coop_cms_view_alias'),
     path('coop_bar/', include('coop_bar.urls')),
 ]
@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
 """utils"""
 
-from .emails import send_email, send_newsletter, strip_a_tags, avoid_line_too_long, make_links_absolute  # noqa 401
+from .emails import (
+    send_email, send_newsletter, strip_a_tags, avoid_line_too_long, make_links_absolute,
+    wrap_long_lines  # noqa 401
+)
 from .i18n import (
     activate_lang, get_language, get_url_in_language, redirect_to_language, make_locale_path,
     strip_locale_path  # noqa 401
 )
+from .files import get_file_hash, spool_uploads_to_disk  # noqa 401
+from .images import downscale_image, get_image_info  # noqa 401
 from .loaders import get_model_app, get_model_label, get_model_name, get_text_from_template  # noqa 401
 from .pagination import paginate  # noqa 401
-from .requests import RequestManager, RequestMiddleware, RequestNotFound  # noqa 401
+from .requests import (
+    RequestContext, RequestManager, RequestMiddleware, RequestNotFound, get_current_site,
+    get_request_context  # noqa 401
+)
 from .settings import get_login_url  # noqa 401
 from .text import slugify, dehtml  # noqa 401
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""inline css for newsletters"""
+
+from functools import lru_cache
+import html
+import re
+
+from bs4 import BeautifulSoup
+
+from ..settings import logger
+
+from .html_tokens import ATTRIBUTE_REGEX, HTML_TAG_REGEX, get_attribute_value
+
+
+# Selectors made of tags, classes and ids separated by spaces (descendant): the others are inlined by BeautifulSoup
+COMPOUND_SELECTOR_REGEX = re.compile(r'(?P<tag>[a-zA-Z][a-zA-Z0-9]*|\*)?(?P<qualifiers>(?:[.#][-_a-zA-Z0-9]+)*)')
+VOID_ELEMENTS = (
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'
+)
+
+
+def style_to_dict(style):
+    """
+    convert a style string ('color: #fff; background: #000') into a dict {'color': ''#fff', 'background': '#000'}
+    """
+    css_values = [elt for elt in style.strip().split(";") if elt]
+    # A value may contain ':' (url(http://...))
+    css_values = [elt.split(":", 1) for elt in css_values]
+    return dict([(key.strip(), value.strip()) for (key, value) in css_values])
+
+
+def style_to_list(style):
+    """
+    convert a style string ('color: #fff; background: #000') into a list ['color', 'background']
+    """
+    css_values = [elt for elt in style.strip().split(";") if elt]
+    css_values = [elt.split(":", 1) for elt in css_values]
+    return [key_and_value[0].strip() for key_and_value in css_values]
+
+
+def dict_to_style(style_dict, order_of_items):
+    """
+    convert a dict {'color': ''#fff', 'background': '#000'} into a style string ('color: #fff; background: #000')
+    """
+    values = []
+    for elt in order_of_items:
+        value = style_dict.pop(elt, '')
+        if value:
+            values.append("{0}: {1}".format(elt, value))
+    values.extend(["{0}: {1}".format(key, value) for (key, value) in style_dict.items()])
+    if values:
+        return "; ".join(values) + ";"
+    return ""
+
+
+def _is_simple_selector(selector):
+    """True if the selector can be matched by CompiledCss"""
+    parts = selector.split()
+    return bool(parts) and all(COMPOUND_SELECTOR_REGEX.fullmatch(part) for part in parts)
+
+
+class _CompoundSelector(object):
+    """a tag with classes and id: 'table.this-one'"""
+
+    def __init__(self, selector):
+        match = COMPOUND_SELECTOR_REGEX.match(selector)
+        tag = match.group('tag')
+        self.tag = tag.lower() if tag and tag != '*' else None
+        qualifiers = re.findall('[.#][^.#]+', match.group('qualifiers'))
+        self.classes = set(qualifier[1:] for qualifier in qualifiers if qualifier[0] == '.')
+        self.ids = set(qualifier[1:] for qualifier in qualifiers if qualifier[0] == '#')
+
+    def matches(self, element):
+        """element is a (tag, classes, id) tuple"""
+        tag, classes, element_id = element
+        if self.tag and self.tag != tag:
+            return False
+        if self.ids and self.ids != {element_id}:
+            return False
+        return self.classes.issubset(classes)
+
+
+class _CssRule(object):
+    """a selector and its style"""
+
+    def __init__(self, selector, css):
+        self.selector = selector
+        self.css = css
+        self.key_and_values = style_to_dict(css)
+        self.key_order = style_to_list(css)
+        self.compounds = [_CompoundSelector(part) for part in selector.split()] if _is_simple_selector(selector) else []
+
+    def matches(self, element, ancestors):
+        """True if the element is selected. The ancestors are matched from the nearest one"""
+        if not self.compounds[-1].matches(element):
+            return False
+        index = len(self.compounds) - 2
+        for ancestor in reversed(ancestors):
+            if index < 0:
+                break
+            if self.compounds[index].matches(ancestor):
+                index -= 1
+        return index < 0
+
+    def apply(self, style):
+        """returns the style of an element with the css of this rule. Doesn't overwrite an inline css value"""
+        if style is None:
+            style_dict = {}
+            style_list = self.key_order
+        else:
+            style_list = style_to_list(style)
+            style_dict = style_to_dict(style)
+        for key in self.key_order:
+            if key not in style_dict:
+                style_dict[key] = self.key_and_values[key]
+        # keep items in order
+        return dict_to_style(style_dict, style_list)
+
+
+class CompiledCss(object):
+    """the css of the nlf_css templatetag: compiled once and applied to the rendered html"""
+
+    def __init__(self, css_def):
+        """css_def : list of 'selector="css"' items"""
+        css_map = {}
+        css_order = []
+        for item in css_def:
+            tag, value = item.split("=")
+            tag, value = tag.strip('"'), value.strip('"')
+            css_map[tag] = value
+            css_order.append(tag)
+        self.rules = [_CssRule(tag, css_map[tag]) for tag in css_order]
+        self.is_simple = all(rule.compounds for rule in self.rules)
+
+        style = ""
+        for tag in reversed(list(css_map.keys())):
+            style += "{0} {{ {1} }}\n".format(tag, css_map[tag])
+        self.style_block = "<style>\n{0}</style>\n".format(style)
+
+    def _get_element(self, tag, attributes):
+        """returns the (tag, classes, id) of an element and the match of its style attribute"""
+        classes = set()
+        element_id = None
+        style_match = None
+        for attr_match in ATTRIBUTE_REGEX.finditer(attributes):
+            name = attr_match.group('name').lower()
+            if name in ('class', 'id', 'style'):
+                value = get_attribute_value(attr_match)
+                if name == 'class':
+                    classes = set(html.unescape(value).split())
+                elif name == 'id':
+                    element_id = html.unescape(value)
+                else:
+                    style_match = attr_match
+        return (tag.lower(), classes, element_id), style_match
+
+    def inline(self, content):
+        """returns the html with the css in the style attribute of the tags"""
+        if not self.rules:
+            return content
+        if not self.is_simple:
+            return self._inline_with_soup(content)
+
+        ancestors = []
+        out_html = []
+        pos = 0
+        for match in HTML_TAG_REGEX.finditer(content):
+            tag = match.group('tag')
+            end_tag = match.group('end_tag')
+            if end_tag:
+                end_tag = end_tag.lower()
+                # close the element and the elements not closed inside it
+                for index in range(len(ancestors) - 1, -1, -1):
+                    if ancestors[index][0] == end_tag:
+                        del ancestors[index:]
+                        break
+            elif tag:
+                element, style_match = self._get_element(tag, match.group('attributes'))
+                rules = [rule for rule in self.rules if rule.matches(element, ancestors)]
+                if rules:
+                    out_html.append(content[pos:match.start()])
+                    out_html.append(self._make_start_tag(match, style_match, rules))
+                    pos = match.end()
+                if not (match.group('self_closing') or element[0] in VOID_ELEMENTS):
+                    ancestors.append(element)
+        out_html.append(content[pos:])
+        return ''.join(out_html)
+
+    @staticmethod
+    def _make_start_tag(match, style_match, rules):
+        """returns the start tag with the new style attribute"""
+        attributes = match.group('attributes')
+        if style_match:
+            style = html.unescape(get_attribute_value(style_match))
+        else:
+            style = None
+        for rule in rules:
+            style = rule.apply(style)
+        style_attribute = 'style="{0}"'.format(style.replace('&', '&amp;').replace('"', '&quot;'))
+        if style_match:
+            attributes = attributes[:style_match.start()] + style_attribute + attributes[style_match.end():]
+        else:
+            attributes = attributes.rstrip() + ' ' + style_attribute
+        return '<{0}{1}{2}>'.format(match.group('tag'), attributes, match.group('self_closing'))
+
+    def _inline_with_soup(self, content):
+        """inline the css with the selectors of BeautifulSoup"""
+        try:
+            soup = BeautifulSoup(content, "html.parser")
+        except Exception as msg:
+            logger.error("HTMLParseError: %s", msg)
+            logger.error(content)
+            raise
+
+        for rule in self.rules:
+            for html_tag in soup.select(rule.selector):
+                html_tag["style"] = rule.apply(html_tag.get("style"))
+
+        # Do not prettify : it may cause some display problems
+        return '{0}'.format(soup)
+
+
+@lru_cache(maxsize=32)
+def compile_css_def(css_def):
+    """returns the CompiledCss of a tuple of 'selector="css"' items"""
+    return CompiledCss(css_def)
+
+
+@lru_cache(maxsize=32)
+def inline_css(compiled_css, content):
+    """
+    returns the html with the css in the style attribute of the tags
+    Cached: the same content is inlined once when it is rendered for several contacts
+    """
+    return compiled_css.inline(content)
@@ -1,18 +1,17 @@
 # -*- coding: utf-8 -*-
 """utils"""
 
-from bs4 import BeautifulSoup
-
 from django.conf import settings
-from django.contrib.sites.models import Site
 from django.core.mail import get_connection, EmailMultiAlternatives
 from django.template.loader import get_template
 from django.utils import translation
 
 from ..settings import get_newsletter_context_callbacks
 
+from .html_tokens import ATTRIBUTE_REGEX, HTML_TAG_REGEX
 from .text import dehtml
 from .i18n import activate_lang, get_language
+from .requests import get_current_site
 
 
 def strip_a_tags(pretty_html_text):
@@ -40,36 +39,63 @@ def strip_a_tags(pretty_html_text):
     return fixed_html
 
 
-def _replace_from_end(s, a, b, times=None):
-    """replace from end"""
-    return s[::-1].replace(a, b, times)[::-1]
-
-
 def avoid_line_too_long(pretty_html_text):
     """
     detect any line with more than 998 characters
+    The line is cut in parts of 900 characters and the last space of every part is replaced by an end of line
+    Not used by coop_cms anymore (see wrap_long_lines): kept for backward compatibility
     """
-    lines = pretty_html_text.split('\n')
     new_lines = []
-    for line in lines:
-        line_length = len(line)
-        if line_length >= 998:
-            # Cut the line in several parts of 900 characters
+    for line in pretty_html_text.split('\n'):
+        if len(line) >= 998:
             parts = []
-            part_size = 900
-            part_index = 0
-            while part_size * len(parts) < line_length:
-                parts.append(line[part_index*part_size:(part_index + 1)*part_size])
-                part_index = len(parts)
-            parts = [_replace_from_end(part, ' ', '\n', 1) for part in parts]
+            for part_start in range(0, len(line), 900):
+                part = line[part_start:part_start + 900]
+                space_pos = part.rfind(' ')
+                if space_pos >= 0:
+                    part = part[:space_pos] + '\n' + part[space_pos + 1:]
+                parts.append(part)
             new_lines.append(''.join(parts))
         else:
             new_lines.append(line)
     return '\n'.join(new_lines)
 
 
-def make_links_absolute(html_content, newsletter=None, site_prefix=""):
-    """replace all local url with site_prefixed url"""
+URL_ATTRIBUTES = {'a': 'href', 'img': 'src'}
+# Lines longer than this are refused by SMTP servers
+SMTP_MAX_LINE_LENGTH = 998
+
+
+def wrap_long_lines(html_text, max_length=900):
+    """
+    cut the lines too long for SMTP on a space or after a tag, in chunks of at most max_length characters
+    Lines without any possible cut are kept unchanged
+    """
+    if len(html_text) < SMTP_MAX_LINE_LENGTH:
+        return html_text
+    out_lines = []
+    for line in html_text.split('\n'):
+        while len(line) >= SMTP_MAX_LINE_LENGTH:
+            cut_pos = line.rfind(' ', 1, max_length)
+            if cut_pos > 0:
+                out_lines.append(line[:cut_pos])
+                line = line[cut_pos + 1:]
+                continue
+            cut_pos = line.rfind('>', 0, max_length - 1)
+            if cut_pos < 0:
+                break
+            out_lines.append(line[:cut_pos + 1])
+            line = line[cut_pos + 1:]
+        out_lines.append(line)
+    return '\n'.join(out_lines)
+
+
+def make_links_absolute(html_content, newsletter=None, site_prefix="", wrap_lines=True):
+    """
+    replace all local url with site_prefixed url
+    Only the href of the <a> tags and the src of the <img> tags are rewritten: the rest of the html is unchanged
+    wrap_lines : the lines too long for SMTP are cut. If False, wrap_long_lines must be called later
+    """
 
     def make_abs(url):
         """make absolute url"""
@@ -85,21 +111,34 @@ def make_links_absolute(html_content, newsletter=None, site_prefix=""):
         if newsletter:
             site_prefix = newsletter.get_site_prefix()
         else:
-            site = Site.objects.get_current()
+            site = get_current_site()
             site_prefix = "http://{0}".format(site.domain)
 
-    soup = BeautifulSoup(html_content, 'html.parser')
-    for a_tag in soup.find_all("a"):
-        if a_tag.get("href", None):
-            a_tag["href"] = make_abs(a_tag["href"])
-
-    for img_tag in soup.find_all("img"):
-        if img_tag.get("src", None):
-            img_tag["src"] = make_abs(img_tag["src"])
-
-    pretty_html = soup.prettify()
-    fixed_html = strip_a_tags(pretty_html)
-    return avoid_line_too_long(fixed_html)
+    def replace_tag(match):
+        """rewrite the url attribute of a tag"""
+        tag, attributes = match.group('tag'), match.group('attributes')
+        url_attribute = URL_ATTRIBUTES.get(tag.lower()) if tag else None
+        if not (url_attribute and attributes):
+            return match.group(0)
+
+        def replace_attribute(attr_match):
+            """rewrite the url"""
+            if attr_match.group('name').lower() != url_attribute:
+                return attr_match.group(0)
+            for quote, group_name in (('"', 'dq'), ("'", 'sq'), ('', 'uq')):
+                url = attr_match.group(group_name)
+                if url:
+                    return '{0}{1}{2}{3}{2}'.format(
+                        attr_match.group('name'), attr_match.group('equal'), quote, make_abs(url)
+                    )
+            return attr_match.group(0)
+
+        return '<{0}{1}{2}>'.format(
+            tag, ATTRIBUTE_REGEX.sub(replace_attribute, attributes), match.group('self_closing')
+        )
+
+    html_content = HTML_TAG_REGEX.sub(replace_tag, html_content)
+    return wrap_long_lines(html_content) if wrap_lines else html_content
 
 
 def _send_email(subject, html_text, dests, list_unsubscribe):
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""files"""
+
+import hashlib
+from functools import wraps
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+
+def get_file_hash(file_):
+    """returns the sha256 of the file content. The file is read by chunks: never fully loaded in memory"""
+    content_hash = hashlib.sha256()
+    for chunk in file_.chunks():
+        content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def spool_uploads_to_disk(view_func):
+    """
+    view decorator: the uploaded files are written to a temporary file whatever their size
+    The upload handlers must be changed before the POST data is read: the CSRF check is done after
+    """
+    protected_view = csrf_protect(view_func)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return protected_view(request, *args, **kwargs)
+
+    return csrf_exempt(wrapper)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+html tokens: the tags and their attributes are read by regexes rather than by a parser
+The text between the tokens is kept unchanged
+"""
+
+import re
+
+
+# The comments are matched for being skipped
+COMMENT_PATTERN = r'<!--.*?-->'
+# The content of script and style is not parsed
+CDATA_PATTERN = r'<(?P<cdata_tag>script|style)(?:\s[^>]*)?>(?P<cdata>.*?)</(?P=cdata_tag)\s*>'
+# A quote starts an attribute value only after =
+START_TAG_PATTERN = (
+    r'<(?P<tag>[a-zA-Z][^\s/>\x00]*)(?P<attributes>(?:[^>=]|=\s*"[^"]*"|=\s*\'[^\']*\'|=)*?)(?P<self_closing>/?)>'
+)
+END_TAG_PATTERN = r'</(?P<end_tag>[a-zA-Z][^\s/>\x00]*)[^>]*>'
+HTML_TAG_PATTERN = '|'.join((COMMENT_PATTERN, CDATA_PATTERN, START_TAG_PATTERN, END_TAG_PATTERN))
+
+HTML_TAG_REGEX = re.compile(HTML_TAG_PATTERN, re.IGNORECASE | re.DOTALL)
+ATTRIBUTE_REGEX = re.compile(
+    r'(?P<name>[^\s"\'>/=]+)(?:(?P<equal>\s*=\s*)(?:"(?P<dq>[^"]*)"|\'(?P<sq>[^\']*)\'|(?P<uq>[^\s"\'>]*)))?'
+)
+
+
+def get_attribute_value(attr_match):
+    """returns the raw value of an attribute matched by ATTRIBUTE_REGEX: '' if it has no value"""
+    return next((value for value in attr_match.group('dq', 'sq', 'uq') if value is not None), '')
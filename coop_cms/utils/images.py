@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""images"""
+
+import os.path
+import struct
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+from PIL import Image as PilImage
+
+
+# Raised by Pillow for a file which is not an image, a corrupted image or a decompression bomb
+IMAGE_ERRORS = (OSError, SyntaxError, ValueError, EOFError, struct.error, PilImage.DecompressionBombError)
+
+
+def get_image_info(image_file):
+    """
+    returns (width, height, format) of an image file
+    Only the header of the image is read: the image is not decoded
+    """
+    was_closed = image_file.closed
+    image_file.open('rb')
+    try:
+        with PilImage.open(image_file) as image:
+            return image.width, image.height, image.format
+    finally:
+        if was_closed:
+            image_file.close()
+        else:
+            image_file.seek(0)
+
+
+def downscale_image(image_file, max_size):
+    """
+    returns a copy of the image file resized to fit in max_size x max_size or the image file itself if smaller
+    The image is resized with the draft and reduce modes of Pillow: a JPEG is decoded at a lower scale and its full
+    size image is never in memory. The other formats are fully decoded: their memory is only bounded by the
+    COOP_CMS_MAX_UPLOADED_IMAGE_PIXELS limit, checked on the header before calling this function.
+    The copy is a temporary file: it is moved rather than copied when stored
+    """
+    width, height, image_format = get_image_info(image_file)
+    if not max_size or (width <= max_size and height <= max_size):
+        return image_file
+
+    image_file.open('rb')
+    with PilImage.open(image_file) as image:
+        if getattr(image, 'n_frames', 1) > 1 or image_format not in PilImage.SAVE:
+            # Animated images or formats which can not be written are kept unchanged
+            image_file.seek(0)
+            return image_file
+        save_options = {}
+        if image.info.get('exif'):
+            save_options['exif'] = image.info['exif']
+        if image_format == 'JPEG':
+            save_options['quality'] = 90
+        # draft() is called by thumbnail() before decoding, resize() uses reduce() when reducing_gap is set
+        image.thumbnail((max_size, max_size), reducing_gap=2.0)
+        resized_file = TemporaryUploadedFile(
+            os.path.basename(image_file.name), PilImage.MIME.get(image_format), 0, None
+        )
+        image.save(resized_file, format=image_format, **save_options)
+
+    image_file.close()
+    resized_file.size = resized_file.tell()
+    resized_file.seek(0)
+    return resized_file
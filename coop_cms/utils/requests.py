@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 """utils"""
 
-from threading import current_thread
+from contextvars import ContextVar
 
-from ..moves import MiddlewareMixin
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.contrib.sites.models import Site
+from django.utils.functional import cached_property
 
 
 class RequestNotFound(Exception):
@@ -11,48 +14,112 @@ class RequestNotFound(Exception):
     pass
 
 
-class RequestManager(object):
-    """get django request from anywhere"""
-    _shared = {}
+class RequestContext(object):
+    """
+    Current site and user of a request.
+    It is created once by the middleware: models and templatetags can read it rather than computing it on every call
+    The language is not kept: it can be activated after the context is created (LocaleMiddleware, views)
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def site(self):
+        """current site"""
+        return Site.objects.get_current()
+
+    @property
+    def user(self):
+        """current user"""
+        return getattr(self.request, 'user', None)
 
-    def __init__(self):
-        """his is a Borg"""
-        self.__dict__ = RequestManager._shared
+    @cached_property
+    def is_staff(self):
+        """True if the current user is staff"""
+        user = self.user
+        return bool(user is not None and user.is_staff)
 
-    def _get_request_dict(self):
-        """request dict"""
-        if not hasattr(self, '_request'):
-            self._request = {}  # pylint: disable=attribute-defined-outside-init
-        return self._request
+
+# The current request and its context. contextvars are local to a thread and to an asyncio task.
+# It makes possible to serve several requests in the same thread with an ASGI server
+_current_request = ContextVar('coop_cms_current_request', default=None)
+
+
+class RequestManager(object):
+    """get django request from anywhere"""
 
     def clean(self):
         """clean"""
-        if hasattr(self, '_request'):
-            del self._request
+        _current_request.set(None)
+
+    def _get_current(self):
+        """returns the (request, context) tuple"""
+        current = _current_request.get()
+        if current is None:
+            raise RequestNotFound("Request not found: make sure that middleware is installed")
+        return current
 
     def get_request(self):
         """return request"""
-        _requests = self._get_request_dict()
-        the_thread = current_thread()
-        if the_thread not in _requests:
-            raise RequestNotFound("Request not found: make sure that middleware is installed")
-        return _requests[the_thread]
+        return self._get_current()[0]
+
+    def get_context(self):
+        """return the RequestContext of the current request"""
+        return self._get_current()[1]
 
     def set_request(self, request):
-        """set request"""
-        _requests = self._get_request_dict()
-        _requests[current_thread()] = request
+        """set request. returns a token for restoring the previous request"""
+        context = RequestContext(request) if request is not None else None
+        return _current_request.set((request, context))
+
+    def reset_request(self, token):
+        """restore the request which was set before set_request"""
+        _current_request.reset(token)
+
+
+def get_request_context():
+    """returns the RequestContext of the current request or None if called outside of a request"""
+    try:
+        return RequestManager().get_context()
+    except RequestNotFound:
+        return None
+
+
+def get_current_site():
+    """returns the current site: from the request context if any"""
+    context = get_request_context()
+    if context is not None:
+        return context.site
+    return Site.objects.get_current()
+
 
+class RequestMiddleware(object):
+    """
+    middleware for request
+    It can be used in a sync (WSGI) or async (ASGI) middleware chain
+    """
+    sync_capable = True
+    async_capable = True
 
-class RequestMiddleware(MiddlewareMixin):
-    """middleware for request"""
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
-    def process_request(self, request):
-        """middleware is called before every request"""
-        RequestManager().set_request(request)
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = RequestManager().set_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            # Restore the previous value: nothing is kept once the request is processed
+            RequestManager().reset_request(token)
 
-    def process_response(self, request, response):
-        """process response"""
-        # Clear the request : avoid error in unit tests
-        RequestManager().set_request(None)
-        return response
+    async def __acall__(self, request):
+        token = RequestManager().set_request(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            RequestManager().reset_request(token)
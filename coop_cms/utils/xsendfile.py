@@ -3,19 +3,96 @@
 # Borrowed from https://bitbucket.org/wkornewald/django-filetransfers
 
 import mimetypes
+import os.path
+import re
+from urllib.parse import quote
 
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
 from django.utils.encoding import smart_str
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.module_loading import import_string
 
-from ..settings import is_xsendfile_disabled, xsendfile_no_file_size
+from ..logger import logger
+from ..settings import get_serve_file_backend, get_x_accel_redirect_locations, xsendfile_no_file_size
+
+
+RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.I)
 
 
 class ChunkedFile(object):
-    def __init__(self, file):
+    """iterate on the file content: or on a part of it"""
+
+    def __init__(self, file, start=None, length=None):
         self.file = file
+        self.start = start
+        self.length = length
 
     def __iter__(self):
-        return self.file.chunks()
+        if self.start is None:
+            return self.file.chunks()
+        return self._read_range()
+
+    def _read_range(self):
+        """read length bytes from start"""
+        self.file.seek(self.start)
+        remaining = self.length
+        while remaining > 0:
+            data = self.file.read(min(self.file.DEFAULT_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    def close(self):
+        """called by the response when sent"""
+        self.file.close()
+
+
+def parse_range_header(range_header, size):
+    """
+    returns the (first, last) bytes positions of a single range "bytes=first-last"
+    returns None if no range or if the range is not supported (the whole file is sent)
+    raise ValueError if the range can not be satisfied
+    """
+    match = RANGE_RE.match(range_header or '')
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range : the last bytes of the file
+        length = int(last)
+        if not length:
+            raise ValueError("Empty range")
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise ValueError("Range is after the end of file")
+    if last < first:
+        return None
+    return first, last
+
+
+def _get_local_path(file):
+    """returns the path of the file if stored on the local file system"""
+    name = getattr(file, 'name', None) or ''
+    if os.path.isabs(name) and os.path.isfile(name):
+        return name
+    return None
+
+
+def _is_if_range_valid(request, etag, last_modified):
+    """If-Range: the range is sent only if the file has not changed"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return etag is not None and if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return last_modified is not None and if_range_date == last_modified
 
 
 def chunk_serve_file(request, file, save_as, content_type, **kwargs):
@@ -23,12 +100,51 @@ def chunk_serve_file(request, file, save_as, content_type, **kwargs):
     Serves the file in chunks for efficiency reasons, but the transfer still
     goes through Django itself, so it's much worse than using the web server,
     but at least it works with all configurations.
+    Range and conditional (If-None-Match, If-Modified-Since) requests are supported for local files
     """
-    response = HttpResponse(ChunkedFile(file), content_type=content_type)
+    size = file.size
+    local_path = _get_local_path(file)
+    etag, last_modified = None, None
+    if local_path:
+        last_modified = int(os.path.getmtime(local_path))
+        etag = '"{0:x}-{1:x}"'.format(size, last_modified)
+        not_modified_response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified_response is not None:
+            file.close()
+            return not_modified_response
+
+    byte_range = None
+    if size and request.method == 'GET' and _is_if_range_valid(request, etag, last_modified):
+        try:
+            byte_range = parse_range_header(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{0}'.format(size)
+            return response
+
+    if byte_range:
+        first, last = byte_range
+        response = StreamingHttpResponse(
+            ChunkedFile(file, first, last - first + 1), status=206, content_type=content_type
+        )
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(first, last, size)
+        response['Content-Length'] = last - first + 1
+    elif local_path and hasattr(file, 'file'):
+        # FileResponse uses the wsgi.file_wrapper of the server if any: os.sendfile without copy
+        file.seek(0)
+        response = FileResponse(file.file, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(ChunkedFile(file), content_type=content_type)
+        if size is not None:
+            response['Content-Length'] = size
+
+    response['Accept-Ranges'] = 'bytes'
+    if etag:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
     if save_as:
         response['Content-Disposition'] = smart_str(u'attachment; filename={0}'.format(save_as))
-    if file.size is not None:
-        response['Content-Length'] = file.size
     return response
 
 
@@ -45,6 +161,58 @@ def xsendfile_serve_file(request, file, save_as, content_type, no_file_size=Fals
     return response
 
 
+def get_x_accel_redirect_uri(file_path):
+    """returns the nginx internal uri of a file or None if not in a configured location"""
+    locations = get_x_accel_redirect_locations()
+    # The longest path first: the most specific location
+    for path in sorted(locations, key=len, reverse=True):
+        path_prefix = os.path.join(os.path.abspath(path), '')
+        if file_path.startswith(path_prefix):
+            relative_path = file_path[len(path_prefix):]
+            return locations[path].rstrip('/') + '/' + quote(relative_path)
+    return None
+
+
+def x_accel_redirect_serve_file(request, file, save_as, content_type, **kwargs):
+    """Lets nginx serve the file using the X-Accel-Redirect header"""
+    uri = get_x_accel_redirect_uri(os.path.abspath(file.name))
+    if uri is None:
+        logger.warning("{0} is not in COOP_CMS_X_ACCEL_REDIRECT_LOCATIONS: served by django".format(file.name))
+        return chunk_serve_file(request, file, save_as=save_as, content_type=content_type)
+    file.close()
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = uri
+    if save_as:
+        response['Content-Disposition'] = smart_str(u'attachment; filename={0}'.format(save_as))
+    return response
+
+
+SERVE_FILE_BACKENDS = {}
+
+
+def register_serve_file_backend(name, backend):
+    """
+    register a function for serving files
+    backend(request, file, save_as, content_type, **kwargs) must return a response
+    """
+    SERVE_FILE_BACKENDS[name] = backend
+
+
+register_serve_file_backend('chunk', chunk_serve_file)
+register_serve_file_backend('xsendfile', xsendfile_serve_file)
+register_serve_file_backend('x-accel-redirect', x_accel_redirect_serve_file)
+
+
+def get_serve_file_function(backend=None):
+    """returns the function of a backend: the one defined in settings by default"""
+    backend = backend or get_serve_file_backend()
+    if callable(backend):
+        return backend
+    if backend in SERVE_FILE_BACKENDS:
+        return SERVE_FILE_BACKENDS[backend]
+    return import_string(backend)
+
+
 def serve_file(request, file, backend=None, save_as=False, content_type=None):
     # Backends are responsible for handling range requests.
     filename = file.name.rsplit('/')[-1]
@@ -53,10 +221,7 @@ def serve_file(request, file, backend=None, save_as=False, content_type=None):
     if not content_type:
         content_type = mimetypes.guess_type(filename)[0]
 
-    if is_xsendfile_disabled():
-        return chunk_serve_file(request, file, save_as=save_as, content_type=content_type)
-    else:
-        no_file_size = xsendfile_no_file_size()
-        return xsendfile_serve_file(
-            request, file, save_as=save_as, content_type=content_type, no_file_size=no_file_size
-        )
+    serve_file_function = get_serve_file_function(backend)
+    return serve_file_function(
+        request, file, save_as=save_as, content_type=content_type, no_file_size=xsendfile_no_file_size()
+    )
@@ -3,11 +3,14 @@
 
 import json
 
+from asgiref.sync import sync_to_async
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.messages.api import success as success_message
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
 from django.http import HttpResponse, Http404, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
 from django.template.exceptions import TemplateDoesNotExist
@@ -22,7 +25,7 @@ from colorbox.decorators import popup_redirect
 from ..exceptions import ArticleNotAllowed
 from ..forms.articles import ArticleLogoForm, ArticleTemplateForm, PublishArticleForm
 from .. import models
-from ..generic_views import EditableObjectView
+from ..generic_views import AsyncEditableObjectView, EditableObjectView
 from ..logger import logger
 from ..moves import is_authenticated
 from ..settings import (
@@ -30,7 +33,7 @@ from ..settings import (
     get_articles_category_page_size, homepage_no_redirection
 )
 from ..shortcuts import get_article_or_404, get_headlines, redirect_if_alias
-from ..utils import get_model_name, get_model_app, paginate
+from ..utils import get_model_name, get_model_app, paginate, spool_uploads_to_disk
 
 
 def get_article_template(article):
@@ -202,6 +205,7 @@ def new_article(request):
     )
 
 
+@spool_uploads_to_disk
 @login_required
 def update_logo(request, article_id):
     """update logo"""
@@ -212,6 +216,7 @@ def update_logo(request, article_id):
             if form.is_valid():
                 article.temp_logo = form.cleaned_data['image']
                 article.save()
+                form.cleaned_data['image'].close()
                 url = article.logo_thumbnail(True).url
                 data = {'ok': True, 'src': url}
                 return HttpResponse(json.dumps(data), content_type='application/json')
@@ -353,3 +358,29 @@ class AliasView(View):
     def get(self, *args, **kwargs):
         """redirect to aliased page"""
         return redirect_if_alias(path=kwargs.get('path'))
+
+
+class AsyncArticleView(AsyncEditableObjectView, ArticleView):
+    """Async article view: for ASGI servers"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super(ArticleView, self).dispatch(request, *args, **kwargs)
+        except Http404:
+            slug = self.kwargs['slug']
+            return await sync_to_async(redirect_if_alias)(slug)
+        except ArticleNotAllowed:
+            raise Http404
+
+
+class AsyncAliasView(View):
+    """Async version of AliasView"""
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        """an async view can not run in the transaction of ATOMIC_REQUESTS"""
+        return transaction.non_atomic_requests(super(AsyncAliasView, cls).as_view(**initkwargs))
+
+    async def get(self, *args, **kwargs):
+        """redirect to aliased page"""
+        return await sync_to_async(redirect_if_alias)(path=kwargs.get('path'))
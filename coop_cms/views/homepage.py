@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 """homepage management"""
 
+from asgiref.sync import sync_to_async
+
 from django.contrib.auth.decorators import login_required
-from django.contrib.sites.models import Site
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
 from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse_lazy, reverse
@@ -13,6 +15,7 @@ from colorbox.decorators import popup_redirect
 
 from .. import models
 from ..settings import cms_no_homepage, get_article_class, homepage_no_redirection, get_article_views
+from ..utils import get_current_site
 
 
 def homepage(request):
@@ -36,6 +39,31 @@ def homepage(request):
     return HttpResponseRedirect(reverse('coop_cms_view_all_articles'))
 
 
+@transaction.non_atomic_requests
+async def async_homepage(request):
+    """view homepage: async version"""
+    if cms_no_homepage():
+        raise Http404
+
+    if homepage_no_redirection():
+        article_slug = await sync_to_async(models.get_homepage_article)()
+
+        if article_slug:
+            article_views = get_article_views()
+            article_view = article_views['article_view']
+            view = article_view.as_view(as_homepage=True)
+            if not article_view.view_is_async:
+                view = sync_to_async(view)
+            return await view(request, slug=article_slug)
+
+    else:
+        homepage_url = await sync_to_async(models.get_homepage_url)()
+        if homepage_url:
+            return HttpResponseRedirect(homepage_url)
+
+    return HttpResponseRedirect(reverse('coop_cms_view_all_articles'))
+
+
 @login_required(login_url=reverse_lazy('login'))
 @popup_redirect
 def set_homepage(request, article_id):
@@ -46,7 +74,7 @@ def set_homepage(request, article_id):
         raise PermissionDenied
 
     if request.method == "POST":
-        site_settings = models.SiteSettings.objects.get_or_create(site=Site.objects.get_current())[0]
+        site_settings = models.SiteSettings.objects.get_or_create(site=get_current_site())[0]
 
         if homepage_no_redirection():
             site_settings.homepage_url = ''
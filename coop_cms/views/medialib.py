@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 """media library"""
 
-import itertools
 import json
 import os.path
 
@@ -17,7 +16,8 @@ from ..forms.content import AddDocForm, AddImageForm
 from ..logger import logger
 from .. import models
 from ..moves import make_context
-from ..utils import paginate
+from ..thumbnails import prefetch_thumbnails
+from ..utils import paginate, spool_uploads_to_disk
 from ..utils.xsendfile import serve_file
 
 
@@ -97,14 +97,8 @@ def show_media(request, media_type):
         context['can_view_image'] = can_view_image
 
         if not skip_media_filter:
-            # list of lists of media_filters
-            media_filters = [media.filters.all() for media in queryset.all()]
-            # flat list of media_filters
-            media_filters = itertools.chain(*media_filters)
-            # flat list of unique media filters sorted by alphabetical order (ignore case)
-            context['media_filters'] = sorted(
-                list(set(media_filters)), key=lambda mf: mf.name.upper()
-            )
+            # unique media filters of the media sorted by alphabetical order (ignore case)
+            context['media_filters'] = models.get_media_filters(queryset.model)
 
             if int(media_filter):
                 queryset = queryset.filter(filters__id=media_filter)
@@ -113,6 +107,8 @@ def show_media(request, media_type):
         page_obj = paginate(request, queryset, 12)
 
         context[media_type+'s'] = list(page_obj)
+        if media_type == 'image':
+            prefetch_thumbnails(context['images'])
         context['page_obj'] = page_obj
 
         context["allow_photologue"] = "photologue" in settings.INSTALLED_APPS
@@ -137,6 +133,7 @@ def show_media(request, media_type):
         raise
 
 
+@spool_uploads_to_disk
 @login_required
 def upload_image(request):
     """upload image"""
@@ -155,10 +152,13 @@ def upload_image(request):
                     description = os.path.splitext(src.name)[0]
                 image = models.Image(name=description, copyright=copyright)
                 image.size = form.cleaned_data["size"]
-                image.file.save(src.name, src)
+                # The file is stored when saving the image: unless the same content has already been uploaded
+                image.file = src
                 image.alt_text = form.cleaned_data.get('alt_text', '')
                 image.title = form.cleaned_data.get('title' '')
                 image.save()
+                # The file may be a downscaled copy of the uploaded file: remove it if not moved by the storage
+                src.close()
 
                 filters = form.cleaned_data['filters']
                 if filters:
@@ -31,7 +31,8 @@ setup(
     install_requires=[
         'django>=4.2,<5.0',
         'django-extensions',
-        'sorl-thumbnail',
+        # coop_cms.thumbnails uses private APIs of sorl-thumbnail: see test_thumbnails.SorlThumbnailApiTest
+        'sorl-thumbnail>=12.9,<13.3',
         'apidev-coop_colorbox >= 1.6.0',
         'apidev-coop_bar >= 1.6.0',
         'coop_html_editor >= 1.4.0',